@@ -0,0 +1,116 @@
+"""
+Local stand-ins for the Spinitron and Spotify APIs, serving a recorded fixture (see benchmarks/popularity.py)
+
+Only the endpoints the popularity check uses are served: Spinitron's playlists and spins, and Spotify's search,
+several-artists and track endpoints. Latency and 429 responses can be injected, and every request is counted.
+"""
+from aiohttp import web
+import asyncio
+from collections import Counter
+import math
+import random
+
+SPINITRON_PAGE_SIZE = 20
+
+
+class FakeUpstreams:
+    """Serves a fixture as Spinitron (under /spinitron/api) and Spotify (under /spotify/v1)"""
+    def __init__(self, fixture: dict, latency: float = 0.0, jitter: float = 0.0, rate_limited_fraction: float = 0.0, retry_after: float = 1.0, seed: int = 0):
+        """
+        Args:
+            fixture (dict): A fixture, as written by benchmarks/popularity.py
+            latency (float): Seconds added to every response
+            jitter (float): Up to this many more seconds added at random
+            rate_limited_fraction (float): Fraction of requests answered with a 429 instead
+            retry_after (float): Retry-After sent with injected 429s
+        """
+        self.fixture = fixture
+        self.latency = latency
+        self.jitter = jitter
+        self.rate_limited_fraction = rate_limited_fraction
+        self.retry_after = retry_after
+        self.random = random.Random(seed)
+        self.calls = Counter() # Endpoint -> requests, including rate limited ones
+        self.rate_limited = Counter() # Endpoint -> 429s sent
+        self.base_url = None
+        self.runner = None
+
+        self.app = web.Application()
+        self.app.router.add_get("/spinitron/api/playlists", self.playlists)
+        self.app.router.add_get("/spinitron/api/spins", self.spins)
+        self.app.router.add_get("/spotify/v1/search", self.search)
+        self.app.router.add_get("/spotify/v1/artists", self.artists)
+        self.app.router.add_get("/spotify/v1/artists/", self.artists) # spotipy asks for artists/?ids=...
+        self.app.router.add_get("/spotify/v1/tracks/{track_id}", self.track)
+
+    async def start(self, host: str = "127.0.0.1", port: int = 0) -> str:
+        """Starts serving, returns the base url"""
+        self.runner = web.AppRunner(self.app)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, host, port)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        self.base_url = f"http://{host}:{port}"
+        return self.base_url
+
+    async def stop(self):
+        if self.runner:
+            await self.runner.cleanup()
+
+    @property
+    def spinitron_url(self) -> str:
+        return f"{self.base_url}/spinitron/api"
+
+    @property
+    def spotify_url(self) -> str:
+        return f"{self.base_url}/spotify/v1/"
+
+    def reset_counts(self):
+        self.calls.clear()
+        self.rate_limited.clear()
+
+    async def respond(self, endpoint: str, body) -> web.Response:
+        """Counts the request, waits out the injected latency and returns body as json, or a 429"""
+        self.calls[endpoint] += 1
+        delay = self.latency + self.random.random() * self.jitter
+        if delay:
+            await asyncio.sleep(delay)
+        if self.random.random() < self.rate_limited_fraction:
+            self.rate_limited[endpoint] += 1
+            return web.json_response({"error": {"status": 429, "message": "API rate limit exceeded"}}, status=429, headers={"Retry-After": str(self.retry_after)})
+        if body is None:
+            return web.json_response({"error": {"status": 404, "message": "Not found"}}, status=404)
+        return web.json_response(body)
+
+    def page(self, items: list, request: web.Request) -> dict:
+        """Returns one page of a Spinitron collection"""
+        page = int(request.query.get("page", 1))
+        page_count = max(1, math.ceil(len(items) / SPINITRON_PAGE_SIZE))
+        return {
+            "items": items[(page - 1) * SPINITRON_PAGE_SIZE:page * SPINITRON_PAGE_SIZE],
+            "_meta": {"totalCount": len(items), "pageCount": page_count, "currentPage": page, "perPage": SPINITRON_PAGE_SIZE},
+        }
+
+    async def playlists(self, request: web.Request) -> web.Response:
+        playlists = []
+        for playlist in self.fixture["spinitron"]["playlists"]:
+            # Point the playlist's spins link at this server
+            playlist = dict(playlist, _links={"spins": {"href": f"{self.spinitron_url}/spins?playlist_id={playlist['id']}"}})
+            playlists.append(playlist)
+        return await self.respond("spinitron playlists", self.page(playlists, request))
+
+    async def spins(self, request: web.Request) -> web.Response:
+        spins = self.fixture["spinitron"]["spins"].get(request.query.get("playlist_id"), [])
+        return await self.respond("spinitron spins", self.page(spins, request))
+
+    async def search(self, request: web.Request) -> web.Response:
+        limit = int(request.query.get("limit", 10))
+        items = self.fixture["spotify"]["searches"].get(request.query.get("q", ""), [])[:limit]
+        return await self.respond("spotify search", {"tracks": {"items": items, "limit": limit, "offset": 0, "total": len(items)}})
+
+    async def artists(self, request: web.Request) -> web.Response:
+        ids = request.query.get("ids", "").split(",")
+        return await self.respond("spotify artists", {"artists": [self.fixture["spotify"]["artists"].get(artist_id) for artist_id in ids]})
+
+    async def track(self, request: web.Request) -> web.Response:
+        return await self.respond("spotify tracks", self.fixture["spotify"]["tracks"].get(request.match_info["track_id"]))
@@ -0,0 +1,134 @@
+"""
+Benchmark and accuracy check for the popularity check's candidate matching in cogs/matching.py
+
+First checks every case in benchmarks/matching_fixture.json, where a case is a spin, the Spotify search results for it
+and the candidate that should be accepted (or null if none should be). Then times the old matching (re.sub on every
+call, a full SequenceMatcher ratio for both names of every candidate) against cogs/matching.py on generated searches,
+and checks that both pick the same candidate with the same similarities, and so make the same accept/reject decision.
+Run it from the root of the repository: python -m benchmarks.matching
+"""
+from difflib import SequenceMatcher
+from dotenv import load_dotenv
+import json
+import os
+import random
+import re
+import time
+import unicodedata
+
+load_dotenv()
+import cogs.matching
+import cogs.shared
+
+FIXTURE_PATH = os.path.join(os.path.dirname(__file__), "matching_fixture.json")
+SEARCH_COUNT = 5000
+CANDIDATES_PER_SEARCH = 10
+
+
+def old_simplify_string(in_string, remove_bracketed_and_dash=False, remove_listed=False, remove_spaces=True):
+    simplified_string = in_string
+    simplified_string = unicodedata.normalize("NFKD", simplified_string)
+    simplified_string = simplified_string.encode('ascii', 'ignore').decode('ascii')
+    simplified_string = simplified_string.lower()
+    if remove_bracketed_and_dash:
+        simplified_string = re.sub(r'[\[\(].+[\]\)]', '', simplified_string)
+        simplified_string = re.sub(r' - .+$', '', simplified_string)
+    if remove_listed:
+        simplified_string = re.sub(r' & .+$', '', simplified_string)
+        simplified_string = re.sub(r', .+$', '', simplified_string)
+    simplified_string = re.sub(r'feat\. .+$', '', simplified_string)
+    simplified_string = re.sub(r'[^a-z0-9 ]', '', simplified_string)
+    if remove_spaces:
+        simplified_string= re.sub(r' ', '', simplified_string)
+    return simplified_string
+
+def old_match(artist: str, song: str, candidates: list) -> tuple:
+    """The matching as it was in Tasks_Events before cogs/matching.py"""
+    spinitron_artist_simplified = old_simplify_string(artist, remove_bracketed_and_dash=True, remove_listed=True)
+    spinitron_track_simplified = old_simplify_string(song, remove_bracketed_and_dash=True)
+    strongest_candidate = [0, 0.0, 0.0]
+    for i, candidate in enumerate(candidates):
+        candidate_artist_simplified = old_simplify_string(candidate['artists'][0]['name'], remove_bracketed_and_dash=True, remove_listed=True)
+        candidate_track_simplified = old_simplify_string(candidate['name'], remove_bracketed_and_dash=True)
+        artist_similarity = SequenceMatcher(None, spinitron_artist_simplified, candidate_artist_simplified).ratio()
+        track_similarity = SequenceMatcher(None, spinitron_track_simplified, candidate_track_simplified).ratio()
+        candidate = [i, artist_similarity, track_similarity]
+        if candidate[1]+candidate[2] > strongest_candidate[1]+strongest_candidate[2]:
+            strongest_candidate = candidate
+    accepted = ((strongest_candidate[1] > cogs.shared.NAME_SIMILARITY_UPPER_MINIMUM and strongest_candidate[2] > cogs.shared.NAME_SIMILARITY_LOWER_MINIMUM) or
+                (strongest_candidate[1] > cogs.shared.NAME_SIMILARITY_LOWER_MINIMUM and strongest_candidate[2] > cogs.shared.NAME_SIMILARITY_UPPER_MINIMUM))
+    return tuple(strongest_candidate), accepted
+
+def new_match(artist: str, song: str, candidates: list) -> tuple:
+    strongest_candidate = cogs.matching.pick_candidate(cogs.matching.simplify_artist(artist), cogs.matching.simplify_track(song), candidates)
+    return strongest_candidate, cogs.matching.is_match(strongest_candidate[1], strongest_candidate[2])
+
+def spotify_track(artist: str, name: str) -> dict:
+    return {"artists": [{"name": artist}], "name": name}
+
+def clear_caches():
+    cogs.matching.simplify_string.cache_clear()
+    cogs.matching.similarity.cache_clear()
+    cogs.matching.character_counts.cache_clear()
+    cogs.matching.similarity_upper_bound.cache_clear()
+
+
+def check_fixture() -> int:
+    with open(FIXTURE_PATH, encoding="utf-8") as file:
+        cases = json.load(file)
+    for case in cases:
+        candidates = [spotify_track(candidate["artist"], candidate["name"]) for candidate in case["candidates"]]
+        for label, match in (("old", old_match), ("new", new_match)):
+            (index, _, _), accepted = match(case["artist"], case["song"], candidates)
+            result = index if accepted else None
+            assert result == case["expected"], f"{label} matching picked {result} for {case['artist']} - {case['song']}, expected {case['expected']}"
+    return len(cases)
+
+def mutate(text: str, rng: random.Random) -> str:
+    """Returns a near miss of a name, like the ones Spotify's search turns up"""
+    choice = rng.random()
+    if choice < 0.25:
+        return text
+    if choice < 0.45:
+        return text + rng.choice([" - Remastered", " (Live)", " - Radio Edit", " feat. Someone"])
+    if choice < 0.65:
+        i = rng.randrange(len(text))
+        return text[:i] + text[i + 1:]
+    if choice < 0.8:
+        return text.upper()
+    return " ".join(rng.sample(text.split(), len(text.split()))) + " " + rng.choice(WORDS)
+
+WORDS = ["night", "sun", "blue", "river", "ghost", "electric", "love", "summer", "machine", "garden", "fire", "dream",
+         "static", "honey", "parade", "silver", "tide", "echo", "forest", "signal", "velvet", "city", "wolves", "glass"]
+
+def generate_searches(rng: random.Random) -> list:
+    """Generates searches for a station's worth of spins, where artists (and so their names) keep coming back"""
+    artists = [" ".join(rng.sample(WORDS, rng.randint(1, 3))).title() for _ in range(300)]
+    searches = []
+    for _ in range(SEARCH_COUNT):
+        artist = rng.choice(artists)
+        song = " ".join(rng.sample(WORDS, rng.randint(1, 4))).title()
+        candidates = [spotify_track(mutate(artist, rng) if rng.random() < 0.6 else rng.choice(artists), mutate(song, rng))
+                      for _ in range(CANDIDATES_PER_SEARCH)]
+        rng.shuffle(candidates)
+        searches.append((artist, song, candidates))
+    return searches
+
+def run(label: str, match, searches: list) -> tuple:
+    start = time.perf_counter()
+    results = [match(artist, song, candidates) for artist, song, candidates in searches]
+    elapsed = time.perf_counter() - start
+    print(f"{label}: {elapsed * 1000:.1f} ms ({elapsed / len(searches) * 1e6:.1f} us per search)")
+    return elapsed, results
+
+
+if __name__ == "__main__":
+    print(f"Fixture: all {check_fixture()} cases matched as expected by both")
+
+    searches = generate_searches(random.Random(0))
+    clear_caches()
+    old_time, old_results = run("difflib", old_match, searches)
+    new_time, new_results = run("cogs.matching", new_match, searches)
+    assert old_results == new_results, "cogs.matching disagrees with the old matching"
+    accepted = sum(result[1] for result in new_results)
+    print(f"{old_time / new_time:.1f}x faster, same candidate and decision for all {SEARCH_COUNT} searches ({accepted} accepted)")
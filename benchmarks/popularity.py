@@ -0,0 +1,265 @@
+"""
+Benchmark harness for the popularity check, running the popularity engine against local Spinitron and Spotify stand-ins
+
+The stand-ins (benchmarks/fake_upstreams.py) serve a recorded fixture, so no credentials or network are needed.
+Each benchmark checks every set in the fixture twice: once with empty caches (cold), then again with the caches the
+first pass left behind (warm). For each pass it reports the wall time, the requests each upstream endpoint got (and
+how many of them were answered 429), and the match accuracy: the share of spins resolved to the Spotify track the
+fixture expects (or to no track, where the fixture expects none).
+
+Run it from the root of the repository:
+    python -m benchmarks.popularity run [--fixture PATH] [--latency 0.05] [--jitter 0.02] [--rate-limited 0.05]
+    python -m benchmarks.popularity generate [--sets 6] [--spins 30] [--fixture PATH]
+    python -m benchmarks.popularity record START END [--fixture PATH]
+
+generate writes a synthetic fixture. record checks the real HD-1 sets that ended between two local dates
+(YYYY-MM-DD), with the bot's credentials from .env, and writes every response the check used to a fixture. Its
+expected matches are whatever the check matched, so review them by hand before relying on the accuracy numbers.
+"""
+import argparse
+import asyncio
+from dotenv import load_dotenv
+import json
+import logging
+import os
+import random
+import spotipy
+import tempfile
+import time
+
+load_dotenv()
+import cogs.matching
+import cogs.popularity
+import cogs.shared
+import cogs.spotify_cache
+import cogs.timeutil
+from benchmarks.fake_upstreams import FakeUpstreams
+
+DEFAULT_FIXTURE_PATH = os.path.join(os.path.dirname(__file__), "popularity_fixture.json")
+
+
+def use_temporary_databases(directory: str):
+    """Points every cache and results database at a directory, so that benchmarks start cold and leave the bot's alone"""
+    cogs.shared.HTTP_CACHE_DB_PATH = os.path.join(directory, "http-cache.db")
+    cogs.shared.SPOTIFY_CACHE_DB_PATH = os.path.join(directory, "spotify-cache.db")
+    cogs.shared.POPULARITY_DB_PATH = os.path.join(directory, "popularity.db")
+
+def match_accuracy(results: list, expected: dict) -> tuple:
+    """Returns (spins matched as expected, spins with an expectation) over a pass's results"""
+    correct = total = 0
+    for result in results:
+        for track in result['tracks']:
+            spin_id = str(track['spin_id'])
+            if spin_id not in expected:
+                continue
+            total += 1
+            resolved = track['track_id'] if track['status'] == cogs.spotify_cache.MATCHED else None
+            correct += resolved == expected[spin_id]
+    return correct, total
+
+
+async def run_pass(engine: cogs.popularity.PopularityEngine, fixture: dict) -> tuple:
+    """Checks every set in the fixture at once, like the live check does. Returns (results, wall time)"""
+    started = time.perf_counter()
+    playlists = await engine.spinitron.get_all_items(1, "playlists", start=fixture["start"], end=fixture["end"])
+    results = await asyncio.gather(*(engine.evaluate(playlist) for playlist in playlists))
+    return results, time.perf_counter() - started
+
+async def benchmark(fixture: dict, args: argparse.Namespace):
+    # spotipy logs every error response, which would bury the report when 429s are injected
+    logging.getLogger("spotipy").setLevel(logging.CRITICAL)
+    upstreams = FakeUpstreams(fixture, latency=args.latency, jitter=args.jitter, rate_limited_fraction=args.rate_limited, retry_after=args.retry_after)
+    await upstreams.start()
+    cogs.shared.SPINITRON_API_URL = upstreams.spinitron_url
+
+    with tempfile.TemporaryDirectory() as directory:
+        use_temporary_databases(directory)
+        engine = cogs.popularity.standalone_engine(args.rate_share)
+        # A static token, so no token endpoint is needed
+        def benchmark_spotify_client():
+            spotify_client = spotipy.Spotify(auth="benchmark", requests_timeout=30)
+            spotify_client.prefix = upstreams.spotify_url
+            return spotify_client
+        engine.spotify_client_factory = benchmark_spotify_client
+
+        print(f"{len(fixture['spinitron']['playlists'])} sets, {sum(len(spins) for spins in fixture['spinitron']['spins'].values())} spins, "
+              f"latency {args.latency * 1000:.0f}+{args.jitter * 1000:.0f} ms, {args.rate_limited:.0%} of requests rate limited, "
+              f"{args.rate_share:.0%} of the configured rate limits ({cogs.shared.RATE_LIMITS})")
+        try:
+            for label in ("cold", "warm"):
+                upstreams.reset_counts()
+                results, elapsed = await run_pass(engine, fixture)
+                correct, total = match_accuracy(results, fixture["expected"])
+                flagged = sum(1 for result in results if result['score'] and result['score']['flagged'])
+                print(f"\n{label}: {elapsed:.2f} s, {sum(upstreams.calls.values())} upstream requests, "
+                      f"accuracy {correct}/{total} ({correct / total if total else 1:.1%}), {flagged} sets flagged")
+                for endpoint in sorted(upstreams.calls):
+                    print(f"  {endpoint}: {upstreams.calls[endpoint]} ({upstreams.rate_limited[endpoint]} rate limited)")
+        finally:
+            await cogs.popularity.close_standalone_engine(engine)
+            await upstreams.stop()
+
+
+WORDS = ["night", "sun", "blue", "river", "ghost", "electric", "love", "summer", "machine", "garden", "fire", "dream",
+         "static", "honey", "parade", "silver", "tide", "echo", "forest", "signal", "velvet", "city", "wolves", "glass"]
+
+def generate(sets: int, spins_per_set: int, seed: int = 0) -> dict:
+    """Generates a synthetic fixture: sets of spins, a Spotify catalog with near misses, and the expected matches"""
+    rng = random.Random(seed)
+    artists = [{"id": f"artist{i}", "name": " ".join(rng.sample(WORDS, rng.randint(1, 3))).title(), "popularity": rng.randint(5, 90)} for i in range(60)]
+    fixture = {
+        "start": "2025-01-01T00:00:00", "end": "2025-01-02T00:00:00",
+        "spinitron": {"playlists": [], "spins": {}},
+        "spotify": {"searches": {}, "artists": {}, "tracks": {}},
+        "expected": {},
+    }
+    for artist in artists:
+        fixture["spotify"]["artists"][artist["id"]] = {**artist, "external_urls": {"spotify": f"https://open.spotify.com/artist/{artist['id']}"}}
+
+    def spotify_track(track_id: str, artist: dict, name: str) -> dict:
+        track = {
+            "id": track_id, "name": name, "popularity": rng.randint(5, 90),
+            "external_urls": {"spotify": f"https://open.spotify.com/track/{track_id}"},
+            "artists": [{"id": artist["id"], "name": artist["name"], "external_urls": {"spotify": f"https://open.spotify.com/artist/{artist['id']}"}}],
+        }
+        fixture["spotify"]["tracks"][track_id] = track
+        return track
+
+    songs = [(rng.choice(artists), " ".join(rng.sample(WORDS, rng.randint(1, 4))).title()) for _ in range(sets * spins_per_set // 2)]
+    spin_id = 0
+    for set_number in range(sets):
+        playlist_id = 1000 + set_number
+        fixture["spinitron"]["playlists"].append({
+            "id": playlist_id, "persona_id": 500 + set_number, "title": f"Set {set_number}", "category": rng.choice(list(cogs.shared.TRACK_POPULARITY_THRESHOLDS)),
+            "start": f"2025-01-01T{set_number:02d}:00:00+0000", "end": f"2025-01-01T{set_number + 1:02d}:00:00+0000",
+        })
+        spins = []
+        for _ in range(spins_per_set):
+            spin_id += 1
+            artist, song = rng.choice(songs) # Songs come up again across sets
+            song_index = songs.index((artist, song))
+            track_id = f"track{song_index}"
+            kind = song_index % 5
+            spin = {"id": spin_id, "playlist_id": playlist_id, "artist": artist["name"], "song": song, "isrc": None, "upc": None}
+            name_query = f"artist:\"{artist['name']}\" track:\"{song}\""
+            if kind == 0:
+                # Has an ISRC
+                spin["isrc"] = f"USXXX{song_index:07d}"
+                fixture["spotify"]["searches"][f"isrc:{spin['isrc']}"] = [spotify_track(track_id, artist, song)]
+                fixture["expected"][str(spin_id)] = track_id
+            elif kind in (1, 2):
+                # Found by name, among near misses (a remaster the matcher should look past, other artists)
+                candidates = [spotify_track(f"{track_id}-other{i}", rng.choice(artists), song) for i in range(rng.randint(0, 4))]
+                candidates.insert(rng.randint(0, len(candidates)), spotify_track(track_id, artist, song + (" - Remastered" if kind == 2 else "")))
+                fixture["spotify"]["searches"][name_query] = candidates
+                fixture["expected"][str(spin_id)] = track_id
+            elif kind == 3:
+                # Only found by the simplified fallback search
+                fallback_query = "{} {}".format(
+                    cogs.matching.simplify_string(artist["name"], remove_bracketed_and_dash=True, remove_spaces=False),
+                    cogs.matching.simplify_string(song, remove_bracketed_and_dash=True, remove_spaces=False)[:15],
+                )
+                fixture["spotify"]["searches"][fallback_query] = [spotify_track(track_id, artist, song)]
+                fixture["expected"][str(spin_id)] = track_id
+            else:
+                # Not on Spotify, and the search only turns up other artists' tracks
+                fixture["spotify"]["searches"][name_query] = [spotify_track(f"{track_id}-other", rng.choice(artists), song.split()[0] + " " + rng.choice(WORDS).title())]
+                fixture["expected"][str(spin_id)] = None
+            spins.append(spin)
+        fixture["spinitron"]["spins"][str(playlist_id)] = spins
+    return fixture
+
+
+class RecordingSpotify(spotipy.Spotify):
+    """Spotify client that records the responses the popularity check gets into a fixture"""
+    def __init__(self, fixture: dict, **kwargs):
+        super().__init__(**kwargs)
+        self.fixture = fixture
+
+    def search(self, q, limit=10, offset=0, type="track", market=None):
+        response = super().search(q, limit=limit, offset=offset, type=type, market=market)
+        searches = self.fixture["spotify"]["searches"]
+        if len(response["tracks"]["items"]) >= len(searches.get(q, [])):
+            searches[q] = response["tracks"]["items"]
+        return response
+
+    def artists(self, artists):
+        response = super().artists(artists)
+        for artist in response["artists"]:
+            if artist:
+                self.fixture["spotify"]["artists"][artist["id"]] = artist
+        return response
+
+    def track(self, track_id, market=None):
+        response = super().track(track_id, market=market)
+        self.fixture["spotify"]["tracks"][response["id"]] = response
+        return response
+
+async def record(start: str, end: str) -> dict:
+    """Checks the real HD-1 sets that ended between two local dates, recording every response into a fixture"""
+    start_datetime, end_datetime = cogs.popularity.date_range(start, end)
+    playlists = await cogs.popularity.list_finished_sets(start_datetime, end_datetime)
+    local_start = start_datetime.astimezone(cogs.timeutil.local_timezone()).replace(tzinfo=None).isoformat()
+    local_end = end_datetime.astimezone(cogs.timeutil.local_timezone()).replace(tzinfo=None).isoformat()
+    fixture = {
+        "start": local_start, "end": local_end,
+        "spinitron": {"playlists": [], "spins": {}},
+        "spotify": {"searches": {}, "artists": {}, "tracks": {}},
+        "expected": {},
+    }
+
+    with tempfile.TemporaryDirectory() as directory:
+        # Start cold, so that every response the check needs goes through the recorder
+        use_temporary_databases(directory)
+        engine = cogs.popularity.standalone_engine(cogs.shared.POPULARITY_BACKFILL_RATE_SHARE)
+        engine.spotify_client_factory = lambda: RecordingSpotify(fixture, auth_manager=spotipy.oauth2.SpotifyClientCredentials(
+            client_id=cogs.shared.SPOTIFY_CLIENT_ID, client_secret=cogs.shared.SPOTIFY_CLIENT_SECRET
+        ))
+        try:
+            for playlist in playlists:
+                fixture["spinitron"]["playlists"].append({key: value for key, value in playlist.items() if key != "_links"})
+                fixture["spinitron"]["spins"][str(playlist["id"])] = await engine.get_spins(playlist)
+                result = await engine.evaluate(playlist)
+                for track in result["tracks"]:
+                    if track["status"] != cogs.popularity.ERROR:
+                        fixture["expected"][str(track["spin_id"])] = track["track_id"]
+                print(f"Recorded {playlist['title']} ({len(result['tracks'])} spins)")
+        finally:
+            await cogs.popularity.close_standalone_engine(engine)
+    return fixture
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the popularity check against local Spinitron and Spotify stand-ins")
+    parser.add_argument("command", choices=["run", "generate", "record"], nargs="?", default="run")
+    parser.add_argument("dates", nargs="*", help="START END local dates (YYYY-MM-DD), for record")
+    parser.add_argument("--fixture", default=DEFAULT_FIXTURE_PATH)
+    parser.add_argument("--latency", type=float, default=0.05, help="Seconds added to every upstream response")
+    parser.add_argument("--jitter", type=float, default=0.02, help="Up to this many more seconds added at random")
+    parser.add_argument("--rate-limited", type=float, default=0.0, help="Fraction of upstream requests answered 429")
+    parser.add_argument("--retry-after", type=float, default=1.0, help="Retry-After sent with injected 429s")
+    parser.add_argument("--rate-share", type=float, default=1.0, help="Fraction of the configured rate limits the engine may use")
+    parser.add_argument("--sets", type=int, default=6, help="Sets to generate")
+    parser.add_argument("--spins", type=int, default=30, help="Spins per generated set")
+    args = parser.parse_args()
+
+    if args.command == "generate":
+        fixture = generate(args.sets, args.spins)
+    elif args.command == "record":
+        if len(args.dates) != 2:
+            parser.error("record needs a START and END date")
+        fixture = asyncio.run(record(*args.dates))
+    else:
+        with open(args.fixture, encoding="utf-8") as file:
+            fixture = json.load(file)
+        asyncio.run(benchmark(fixture, args))
+        return
+
+    with open(args.fixture, "w", encoding="utf-8") as file:
+        json.dump(fixture, file, indent=1)
+        file.write("\n")
+    print(f"Wrote {args.fixture}")
+
+
+if __name__ == "__main__":
+    main()
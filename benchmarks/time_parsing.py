@@ -0,0 +1,47 @@
+"""
+Micro-benchmark for the Spinitron date helpers in cogs/timeutil.py
+
+Times the old way (dateutil's general purpose parser, a timezone lookup and both local midnights recomputed for
+every spin) against the helpers, over 10,000 spins. Run it from the root of the repository: python -m benchmarks.time_parsing
+"""
+from datetime import datetime, timedelta, timezone
+from dateutil import parser, tz
+from dotenv import load_dotenv
+import time
+
+load_dotenv()
+import cogs.shared
+import cogs.timeutil
+
+SPIN_COUNT = 10000
+
+
+def old_is_today(date: str) -> bool:
+    indate = parser.parse(date)
+    nextmidnight = datetime.now(tz.gettz(cogs.shared.LOCAL_TIMEZONE)).replace(hour=23, minute=59, second=59, microsecond=59).astimezone(tz.UTC)
+    lastmidnight = datetime.now(tz.gettz(cogs.shared.LOCAL_TIMEZONE)).replace(hour=0, minute=0, second=0, microsecond=0).astimezone(tz.UTC)
+    return indate < nextmidnight and lastmidnight <= indate
+
+def old_spin(date: str) -> tuple:
+    return parser.parse(date).astimezone(tz.gettz(cogs.shared.LOCAL_TIMEZONE)).hour, old_is_today(date)
+
+def new_spin(date: str) -> tuple:
+    return cogs.timeutil.to_local(date).hour, cogs.timeutil.is_today(date)
+
+def run(label: str, func, dates: list) -> tuple:
+    start = time.perf_counter()
+    results = [func(date) for date in dates]
+    elapsed = time.perf_counter() - start
+    print(f"{label}: {elapsed * 1000:.1f} ms ({elapsed / len(dates) * 1e6:.2f} us per spin)")
+    return elapsed, results
+
+
+if __name__ == "__main__":
+    # A spin every three minutes, ending now
+    now = datetime.now(timezone.utc).replace(microsecond=0)
+    dates = [(now - timedelta(minutes=3 * i)).strftime("%Y-%m-%dT%H:%M:%S+0000") for i in range(SPIN_COUNT)]
+
+    old_time, old_results = run("dateutil", old_spin, dates)
+    new_time, new_results = run("timeutil", new_spin, dates)
+    assert old_results == new_results, "the helpers disagree with dateutil"
+    print(f"{old_time / new_time:.1f}x faster, same results for all {SPIN_COUNT} spins")
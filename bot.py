@@ -12,6 +12,7 @@ import asyncio
 from discord import Intents, File
 from discord.ext import commands
 from dotenv import load_dotenv
+import inspect
 import logging
 import os
 import requests as r
@@ -28,8 +29,42 @@ BOT_ADMIN_DISCORD_ID = int(os.getenv("BOT_ADMIN_DISCORD_ID"))
 repo_cogs_raw_url = f"https://raw.githubusercontent.com/{GITHUB_REPO_OWNER}/{GITHUB_REPO_NAME}/main/{COGS_FOLDER_NAME}"
 repo_cogs_api_url = f"https://api.github.com/repos/{GITHUB_REPO_OWNER}/{GITHUB_REPO_NAME}/contents/{COGS_FOLDER_NAME}"
 
+# Objects the cogs share through the bot (see the get_*(bot) accessors in the cogs folder), in the order they're closed
+# on shutdown: each one before anything it uses
+SHARED_OBJECTS = (
+    "album_art_resolver",
+    "now_playing_poller",
+    "spin_history",
+    "persona_directory",
+    "schedule_index",
+    "binding_store",
+    "spotify_cache",
+    "spinitron_client",
+    "http_cache",
+)
+
+
+class WKNCBot(commands.Bot):
+    async def close(self):
+        """Unloads every cog (see commands.Bot.close), then stops the shared objects' background loops and closes them"""
+        await super().close()
+        for name in SHARED_OBJECTS:
+            shared_object = getattr(self, name, None)
+            if shared_object is None:
+                continue
+            delattr(self, name)
+            try:
+                closed = shared_object.close()
+                if inspect.isawaitable(closed):
+                    await closed
+            except Exception as e:
+                print(f"Error while closing {name}:")
+                print(e)
+                logging.error(e)
+
+
 intents = Intents.all()
-bot = commands.Bot(command_prefix="!", help_command = None, intents = intents)
+bot = WKNCBot(command_prefix="!", help_command = None, intents = intents)
 
 logging.basicConfig(level=logging.ERROR,
                     filename='error.log',
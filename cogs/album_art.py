@@ -0,0 +1,110 @@
+"""
+This module contains the album art resolver, which finds album art for spins that Spinitron has no image for
+
+Results are kept in a SQLite cache keyed by normalized artist and song, so each track only ever goes to Discogs once
+(tracks with no art are cached too, for a shorter time). The blocking Discogs search runs in a worker thread, and art
+for every new spin the now playing poller sees is resolved in the background, before anyone asks for it.
+"""
+import asyncio
+import discogs_client
+import logging
+import re
+import sqlite3
+import time
+import unicodedata
+
+import cogs.cache
+import cogs.now_playing
+import cogs.shared
+
+
+def art_key(artist: str, song: str) -> str:
+    """Returns the cache key for a track, ignoring case, accents and punctuation"""
+    def normalize(text: str) -> str:
+        text = unicodedata.normalize("NFKD", text or "").encode("ascii", "ignore").decode("ascii").lower()
+        return re.sub(r"[^a-z0-9]+", " ", text).strip()
+    return f"{normalize(artist)}|{normalize(song)}"
+
+
+class AlbumArtResolver:
+    """Finds album art for spins, caching every answer"""
+    def __init__(self, bot):
+        self.bot = bot
+        self.discogs = discogs_client.Client("WKNC-Bot/0.1", user_token=cogs.shared.DISCOGS_TOKEN)
+        self.db = sqlite3.connect(cogs.shared.ALBUM_ART_DB_PATH)
+        self.db.execute("CREATE TABLE IF NOT EXISTS album_art (key TEXT PRIMARY KEY, url TEXT, expires REAL NOT NULL)")
+        self.db.commit()
+        # A command asking for art that is already being searched for (e.g. in the background) just waits on that search
+        self.searches = cogs.cache.SingleFlight()
+        cogs.now_playing.get_poller(bot).add_listener(self.on_now_playing)
+
+    def get_cached(self, key: str) -> tuple:
+        """Returns (True, url or None) if the key has an unexpired cache entry, otherwise (False, None)"""
+        row = self.db.execute("SELECT url, expires FROM album_art WHERE key = ?", (key,)).fetchone()
+        if row is None or row[1] <= time.time():
+            return False, None
+        return True, row[0]
+
+    def set_cached(self, key: str, url: str):
+        ttl = cogs.shared.ALBUM_ART_CACHE_TTL if url else cogs.shared.ALBUM_ART_NEGATIVE_CACHE_TTL
+        self.db.execute("INSERT OR REPLACE INTO album_art (key, url, expires) VALUES (?, ?, ?)", (key, url, time.time() + ttl))
+        self.db.commit()
+
+    def search(self, artist: str, song: str) -> str:
+        """Searches Discogs for a track's album art (blocking, run it in a thread)"""
+        d_search = self.discogs.search("{} - {}".format(artist, song), type="release")
+        if len(d_search) > 0:
+            return d_search[0].thumb
+        return None
+
+    async def lookup(self, key: str, artist: str, song: str) -> str:
+        try:
+            url = await asyncio.to_thread(self.search, artist, song)
+            self.set_cached(key, url)
+            return url
+        except Exception as e:
+            # Don't cache errors, the next spin of the track will try again
+            logging.error(e)
+            print("Error while searching Discogs for album art:")
+            print(e)
+            return None
+
+    async def resolve(self, spin: dict) -> str:
+        """Returns the album art URL of a spin, or None if there is none
+        Args:
+            spin (dict): A spin as taken from the Spinitron API
+        Returns:
+            str: Spinitron's image for the spin if it has one, otherwise Discogs' (cached)
+        """
+        if spin["image"]:
+            return spin["image"]
+
+        key = art_key(spin["artist"], spin["song"])
+        found, url = self.get_cached(key)
+        if found:
+            return url
+
+        return await self.searches.run(key, self.lookup, key, spin["artist"], spin["song"])
+
+    def prefetch(self, spin: dict):
+        """Starts resolving a spin's album art in the background"""
+        if spin["image"]:
+            return
+        key = art_key(spin["artist"], spin["song"])
+        if not self.get_cached(key)[0]:
+            self.searches.start(key, self.lookup, key, spin["artist"], spin["song"])
+
+    async def on_now_playing(self, channel_num: int, snapshot, changes: dict):
+        for spin in changes["new_spins"]:
+            self.prefetch(spin)
+
+    def close(self):
+        cogs.now_playing.get_poller(self.bot).remove_listener(self.on_now_playing)
+        self.db.close()
+
+
+def get_album_art_resolver(bot) -> AlbumArtResolver:
+    """Returns the bot's shared album art resolver, creating it (and subscribing it to the now playing poller) on first use"""
+    if not hasattr(bot, "album_art_resolver"):
+        bot.album_art_resolver = AlbumArtResolver(bot)
+    return bot.album_art_resolver
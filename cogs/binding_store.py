@@ -0,0 +1,113 @@
+"""
+This module contains the binding store, the SQLite database of Discord - Spinitron bindings
+
+Each binding links one Discord user to one Spinitron DJ page, and both sides are uniquely indexed, so lookups either way
+are a single index search and every write only touches its own row. The bindings used to be kept in a shelf, which is
+copied over the first time the store is opened (and then left alone as a backup).
+"""
+import dbm
+import logging
+import shelve
+import sqlite3
+
+import cogs.shared
+
+
+COLUMNS = ("discord_id", "spinitron_id", "dj_name", "channel")
+
+
+class BindingStore:
+    """Discord - Spinitron bindings, as dicts with the keys in COLUMNS"""
+    def __init__(self):
+        self.db = sqlite3.connect(cogs.shared.BINDINGS_DB_PATH, timeout=30)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS bindings (
+                discord_id INTEGER,
+                spinitron_id INTEGER NOT NULL,
+                dj_name TEXT,
+                channel INTEGER
+            );
+            CREATE UNIQUE INDEX IF NOT EXISTS bindings_spinitron_id ON bindings (spinitron_id);
+            CREATE UNIQUE INDEX IF NOT EXISTS bindings_discord_id ON bindings (discord_id);
+            CREATE TABLE IF NOT EXISTS store_state (
+                key TEXT PRIMARY KEY,
+                value TEXT
+            );
+            """
+        )
+        self.db.commit()
+        self.version = 0 # Goes up with every change, so that anything rendered from the bindings knows when it's out of date
+        self.migrate_shelf(cogs.shared.BINDINGS_SHELF_PATH)
+
+    def migrate_shelf(self, path: str):
+        """Copies every binding from the old shelf into the store, once"""
+        if self.db.execute("SELECT 1 FROM store_state WHERE key = 'shelf_migrated'").fetchone():
+            return
+        rows = []
+        if dbm.whichdb(path):
+            with shelve.open(path, flag="r") as shelf:
+                for key, binding in shelf.items():
+                    # The shelf was keyed by Spinitron ID, so the key is the ID even if the binding itself is broken
+                    rows.append((binding.get("discord_id"), int(key), binding.get("dj_name"), binding.get("channel")))
+        with self.db:
+            # A Discord user bound twice (which the bot never allowed) keeps the first binding
+            migrated = self.db.executemany(f"INSERT OR IGNORE INTO bindings ({', '.join(COLUMNS)}) VALUES (?, ?, ?, ?)", rows).rowcount
+            self.db.execute("INSERT OR REPLACE INTO store_state (key, value) VALUES ('shelf_migrated', ?)", (str(migrated),))
+        self.version += 1
+        if rows:
+            print(f"Migrated {migrated} of {len(rows)} bindings from {path}")
+
+    def row_to_binding(self, row: tuple) -> dict:
+        return dict(zip(COLUMNS, row)) if row else None
+
+    def get_by_discord_id(self, discord_id: int) -> dict:
+        """Returns the binding of a Discord user, or None if they aren't bound"""
+        return self.row_to_binding(self.db.execute(f"SELECT {', '.join(COLUMNS)} FROM bindings WHERE discord_id = ?", (discord_id,)).fetchone())
+
+    def get_by_spinitron_id(self, spinitron_id: int) -> dict:
+        """Returns the binding of a Spinitron DJ page, or None if it isn't bound"""
+        return self.row_to_binding(self.db.execute(f"SELECT {', '.join(COLUMNS)} FROM bindings WHERE spinitron_id = ?", (int(spinitron_id),)).fetchone())
+
+    def get_all(self) -> list:
+        """Returns every binding, in the order they were made"""
+        return [self.row_to_binding(row) for row in self.db.execute(f"SELECT {', '.join(COLUMNS)} FROM bindings ORDER BY rowid")]
+
+    def add(self, discord_id: int, spinitron_id: int, dj_name: str, channel: int) -> bool:
+        """Binds a Discord user to a Spinitron DJ page
+        Returns:
+            bool: False if either of them is already bound (nothing is changed then)
+        """
+        try:
+            with self.db:
+                self.db.execute(f"INSERT INTO bindings ({', '.join(COLUMNS)}) VALUES (?, ?, ?, ?)", (discord_id, int(spinitron_id), dj_name, channel))
+            self.version += 1
+            return True
+        except sqlite3.IntegrityError as e:
+            logging.info(e)
+            return False
+
+    def remove(self, spinitron_id: int) -> bool:
+        """Removes the binding of a Spinitron DJ page, returns whether there was one"""
+        with self.db:
+            removed = self.db.execute("DELETE FROM bindings WHERE spinitron_id = ?", (int(spinitron_id),)).rowcount
+        self.version += 1
+        return removed > 0
+
+    def remove_broken(self) -> int:
+        """Removes any bindings that are incomplete or faulty, returns how many there were"""
+        with self.db:
+            removed = self.db.execute("DELETE FROM bindings WHERE discord_id IS NULL OR channel IS NULL OR channel NOT IN (1, 2)").rowcount
+        self.version += 1
+        return removed
+
+    def close(self):
+        self.db.close()
+
+
+def get_binding_store(bot) -> BindingStore:
+    """Returns the bot's shared binding store, opening it (and migrating the old shelf) on first use"""
+    if not hasattr(bot, "binding_store"):
+        bot.binding_store = BindingStore()
+    return bot.binding_store
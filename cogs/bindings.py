@@ -6,40 +6,27 @@ from discord import Embed, User, app_commands
 from discord.ext import commands
 from importlib import reload
 import random
-import requests as r
-import shelve
 
+import cogs.binding_store
+import cogs.paging
+import cogs.personas
 import cogs.shared
-
-# The 'database' that python uses to bind the discord id to the spinitron id
-# It might not be the best method but it's simple to use, may change in the future
-dj_bindings = shelve.open("dj-bindings", writeback=True)
-
-
-def whois_user(discord_id: int) -> any:
-    if (dj_bindings.values()):
-        for binding in dj_bindings.values():
-            if discord_id == binding["discord_id"]:
-                return binding
-    return None
+import cogs.spinitron
 
 
 class Bindings(commands.Cog):
     """Commands related to the binding system, linking discord users to their Spinitron DJ page"""
     def __init__(self, bot):
         self.bot = bot
-    
-    async def cog_unload(self):
-        dj_bindings.close()
+        self.spinitron = cogs.spinitron.get_client(bot)
+        self.persona_directory = cogs.personas.get_persona_directory(bot)
+        self.binding_store = cogs.binding_store.get_binding_store(bot)
+        self.rendered_bindings = (None, None) # (binding store version, embeds) of the last !bindings listing
         
     @commands.command(name="clean", hidden=True)
     async def clean_bot(self, ctx: commands.Context):
         """Hidden command - Remove any bindings that are incomplete or faulty"""
-        count = 0
-        for i in dj_bindings:
-            if dj_bindings[i]["discord_id"] == None or dj_bindings[i]["spinitron_id"] == None or not (dj_bindings[i]["channel"] == 1 or dj_bindings[i]["channel"] == 2):
-                del dj_bindings[i]
-                count += 1
+        count = self.binding_store.remove_broken()
         await ctx.send(f"removed {count} broken bindings")
 
 
@@ -60,11 +47,9 @@ class Bindings(commands.Cog):
     async def bind_query(self, ctx: commands.Context, user: User, djname: str, channel: str, thirdperson: bool):
         # Interpret channel argument
         if (channel.upper() == "HD1" or channel.upper() == "HD-1" or channel.upper() == "1"):
-            headers = cogs.shared.HEADERS_HDX[1]
             channelstr = cogs.shared.SPINITRON_URL_CHANNEL_HDX[1]
             channelnum = 1
         elif (channel.upper() == "HD2" or channel.upper() == "HD-2" or channel.upper() == "2"):
-            headers = cogs.shared.HEADERS_HDX[2]
             channelstr = cogs.shared.SPINITRON_URL_CHANNEL_HDX[2]
             channelnum = 2
         else:
@@ -72,7 +57,7 @@ class Bindings(commands.Cog):
             return
         
         # If user binding already exists, respond appropriately
-        current_binding = whois_user(user.id)
+        current_binding = self.binding_store.get_by_discord_id(user.id)
         if current_binding:
             if (current_binding["dj_name"] == djname and current_binding["channel"] == channelnum):
                 response_message = (
@@ -88,18 +73,16 @@ class Bindings(commands.Cog):
             return
         
         # Get spinitron page
-        response = r.get(
-            "https://spinitron.com/api/personas?name={}".format(djname.replace(" ", "%20")),
-            headers=headers,
-        ).json()["items"]
+        persona, suggestions = await self.persona_directory.lookup(channelnum, djname)
 
         response_message: str
-        if not response:
+        if not persona:
             response_message = (
                 f"Huh, I couldn't seem to find {djname} on HD-{channelnum}. Are you sure that's the right DJ Name?"
+                + cogs.personas.format_suggestions(suggestions)
             )
         else:
-            spinitron_id = response[0]["id"]
+            spinitron_id = persona["id"]
 
             # If user trying to bind to DJ AV, respond appropriately
             if (str(spinitron_id) == cogs.shared.DJ_AV_SPINITRON_ID_HDX[1] or spinitron_id == cogs.shared.DJ_AV_SPINITRON_ID_HDX[2]):
@@ -114,9 +97,10 @@ class Bindings(commands.Cog):
                 )
                 return
 
-            if str(spinitron_id) in dj_bindings:
+            existing_binding = self.binding_store.get_by_spinitron_id(spinitron_id)
+            if existing_binding:
                 # If spinitron page already bound to another user, respond appropriately
-                currentuser = await self.bot.fetch_user(dj_bindings[str(spinitron_id)].get("discord_id"))
+                currentuser = await self.bot.fetch_user(existing_binding["discord_id"])
                 response_message = "That spinitron page is already bound to {}. If this page belongs to {}, you can {}".format(currentuser.mention, "someone else" if thirdperson else "you", "!adminunbind them" if thirdperson else "ask them to unbind themselves or you can contact the server admin.")
             else:
                 # Create DJ binding and respond
@@ -127,13 +111,9 @@ class Bindings(commands.Cog):
                     )
                     + f"\nhttps://spinitron.com/{channelstr}/dj/{spinitron_id}"
                 )
-                dj_bindings[str(spinitron_id)] = {
-                    "discord_id": user.id,
-                    "spinitron_id": spinitron_id,
-                    "dj_name": response[0]["name"],
-                    "channel": channelnum
-                }
-                dj_bindings.sync()
+                if not self.binding_store.add(user.id, spinitron_id, persona["name"], channelnum):
+                    # Someone else got to the page (or the user) between the checks above and now
+                    response_message = "Looks like that binding was just made by someone else, try !whoami or !bindings"
 
         await ctx.send(response_message)
 
@@ -155,11 +135,9 @@ class Bindings(commands.Cog):
     async def bind_id_query(self, ctx: commands.Context, user: User, id: int, channel: str, thirdperson: bool):
         # Interpret channel argument
         if (channel.upper() == "HD1" or channel.upper() == "HD-1" or channel.upper() == "1"):
-            headers = cogs.shared.HEADERS_HDX[1]
             channelstr = cogs.shared.SPINITRON_URL_CHANNEL_HDX[1]
             channelnum = 1
         elif (channel.upper() == "HD2" or channel.upper() == "HD-2" or channel.upper() == "2"):
-            headers = cogs.shared.HEADERS_HDX[2]
             channelstr = cogs.shared.SPINITRON_URL_CHANNEL_HDX[2]
             channelnum = 2
         else:
@@ -167,7 +145,7 @@ class Bindings(commands.Cog):
             return
 
         # If user binding already exists, respond appropriately
-        current_binding = whois_user(user.id)
+        current_binding = self.binding_store.get_by_discord_id(user.id)
         if current_binding:
             if current_binding["spinitron_id"] == id:
                 response_message = (
@@ -183,10 +161,7 @@ class Bindings(commands.Cog):
             return
         
         # Get spinitron page
-        response = r.get(
-            "https://spinitron.com/api/personas/{}".format(id),
-            headers=headers,
-        ).json()
+        response = await self.spinitron.get_persona(channelnum, id)
 
         if ("id" not in response or response["name"] == "Not Found" or response["name"] == "Forbidden"):
             response_message = (
@@ -208,9 +183,10 @@ class Bindings(commands.Cog):
                 )
                 return
             
-            if str(spinitron_id) in dj_bindings:
+            existing_binding = self.binding_store.get_by_spinitron_id(spinitron_id)
+            if existing_binding:
                 # If spinitron page already bound to another user, respond appropriately
-                currentuser = await self.bot.fetch_user(dj_bindings[str(spinitron_id)].get("discord_id"))
+                currentuser = await self.bot.fetch_user(existing_binding["discord_id"])
                 response_message = "That spinitron page is already bound to {}. If this page belongs to {}, you can {}".format(currentuser.mention, "someone else" if thirdperson else "you", "!adminunbind them" if thirdperson else "ask them to unbind themselves or you can contact the server admin.")
             else:
                 # Create DJ binding and respond
@@ -221,13 +197,9 @@ class Bindings(commands.Cog):
                     )
                     + f"\nhttps://spinitron.com/{channelstr}/dj/{spinitron_id}"
                 )
-                dj_bindings[str(spinitron_id)] = {
-                    "discord_id": user.id,
-                    "spinitron_id": spinitron_id,
-                    "dj_name": response["name"],
-                    "channel": channelnum
-                }
-                dj_bindings.sync()
+                if not self.binding_store.add(user.id, spinitron_id, response["name"], channelnum):
+                    # Someone else got to the page (or the user) between the checks above and now
+                    response_message = "Looks like that binding was just made by someone else, try !whoami or !bindings"
 
         await ctx.send(response_message)
 
@@ -235,42 +207,57 @@ class Bindings(commands.Cog):
     @commands.hybrid_command(name="bindings", brief="Shows the current Discord - Spinitron bindings")
     async def bindings(self, ctx: commands.Context):
         async with ctx.typing():
-            response_message: str = ""
-            embed = Embed(title = "Current Bindings:", color = cogs.shared.EMBED_COLOR)
-
-            binding_list_hd1 = []
-            binding_list_hd2 = []
-            if dj_bindings:
-                #response_message = "Current Bindings:\n"
-                for key in dj_bindings:
-                    # Skip any cached records w/o dj name
-                    if not dj_bindings[key]["discord_id"]:
-                        continue
-                    discord_name = (await self.bot.fetch_user(dj_bindings[key]["discord_id"])).mention
-                    spinitron_id = dj_bindings[key]["spinitron_id"]
-                    if (dj_bindings[key]["channel"] == 1):
-                        binding_list_hd1.append("{} - [{}]({})".format(discord_name, dj_bindings[key]["dj_name"], "https://spinitron.com/WKNC/dj/" + str(spinitron_id)))
-                    elif (dj_bindings[key]["channel"] == 2):
-                        binding_list_hd2.append("{} - [{}]({})".format(discord_name, dj_bindings[key]["dj_name"], "https://spinitron.com/WKNC-HD2/dj/" + str(spinitron_id)))
-                response_message = response_message + "**HD-1\n**" + "\n".join(binding_list_hd1)
-                if (binding_list_hd2):
-                    response_message = response_message + "\n**HD-2**\n" + "\n".join(binding_list_hd2)
-
-            if (binding_list_hd1 or binding_list_hd2):
-                embed.description = response_message
-                await ctx.send(embed = embed)
+            # The listing only changes when a binding does
+            version, embeds = self.rendered_bindings
+            if version != self.binding_store.version:
+                embeds = self.render_bindings()
+                self.rendered_bindings = (self.binding_store.version, embeds)
+
+            if embeds:
+                await cogs.paging.send_pages(ctx, embeds)
             else:
                 await ctx.send("There are currently no DJ bindings")
 
+    def render_bindings(self) -> list:
+        """Returns the embeds listing every binding, split into pages when they don't fit in one, or an empty list if there are none
+        Users are listed as mentions, which Discord renders from the ID alone, so no user has to be looked up
+        """
+        # Skip any cached records w/o dj name
+        all_bindings = [binding for binding in self.binding_store.get_all() if binding["discord_id"]]
+
+        binding_list_hd1 = []
+        binding_list_hd2 = []
+        for binding in all_bindings:
+            discord_name = f"<@{binding['discord_id']}>"
+            spinitron_id = binding["spinitron_id"]
+            if (binding["channel"] == 1):
+                binding_list_hd1.append("{} - [{}]({})\n".format(discord_name, binding["dj_name"], "https://spinitron.com/WKNC/dj/" + str(spinitron_id)))
+            elif (binding["channel"] == 2):
+                binding_list_hd2.append("{} - [{}]({})\n".format(discord_name, binding["dj_name"], "https://spinitron.com/WKNC-HD2/dj/" + str(spinitron_id)))
+        if not (binding_list_hd1 or binding_list_hd2):
+            return []
+
+        lines = ["**HD-1\n**"] + binding_list_hd1
+        if (binding_list_hd2):
+            lines += ["\n**HD-2**\n"] + binding_list_hd2
+        pages = cogs.paging.split_into_pages("", lines, cogs.shared.EMBED_DESCRIPTION_LIMIT)
+
+        embeds = []
+        for page_num, description in enumerate(pages, start=1):
+            embed = Embed(title = "Current Bindings:", description = description, color = cogs.shared.EMBED_COLOR)
+            if len(pages) > 1:
+                embed.set_footer(text=f"Page {page_num}/{len(pages)}")
+            embeds.append(embed)
+        return embeds
+
 
     @commands.hybrid_command(name="unbind", brief="Remove your bound DJ name")
     async def unbind(self, ctx: commands.Context):
         async with ctx.typing():
-            current_binding = whois_user(ctx.author.id)
+            current_binding = self.binding_store.get_by_discord_id(ctx.author.id)
             response_message: str
             if current_binding:
-                del dj_bindings[str(current_binding["spinitron_id"])]
-                dj_bindings.sync()
+                self.binding_store.remove(current_binding["spinitron_id"])
                 response_message = "You are no longer {}".format(current_binding["dj_name"])
             else:
                 response_message = "You're not anyone right now. You're *freeeeeeee*"
@@ -282,11 +269,10 @@ class Bindings(commands.Cog):
     @app_commands.default_permissions(administrator=True)
     async def admin_unbind(self, ctx: commands.Context, user: User):
         async with ctx.typing():
-            current_binding = whois_user(user.id)
+            current_binding = self.binding_store.get_by_discord_id(user.id)
             response_message: str
             if current_binding:
-                del dj_bindings[str(current_binding["spinitron_id"])]
-                dj_bindings.sync()
+                self.binding_store.remove(current_binding["spinitron_id"])
                 response_message = "{} is no longer {}".format(user.mention, current_binding["dj_name"])
             else:
                 response_message = f"{user.mention} is not bound to anything."
@@ -296,7 +282,7 @@ class Bindings(commands.Cog):
     @commands.hybrid_command(name="whoami", brief="Your associated DJ name and page")
     async def who_am_i(self, ctx: commands.Context):
         async with ctx.typing():
-            user_binding = whois_user(ctx.author.id)
+            user_binding = self.binding_store.get_by_discord_id(ctx.author.id)
             if user_binding:
                 if user_binding["channel"] == 2:
                     channelstr = cogs.shared.SPINITRON_URL_CHANNEL_HDX[2]
@@ -318,7 +304,7 @@ class Bindings(commands.Cog):
                 await ctx.send("https://youtu.be/BwLs22Hxi6Q?t=38")
                 return
 
-            user_binding = whois_user(user.id)
+            user_binding = self.binding_store.get_by_discord_id(user.id)
             if user_binding:
                 if user_binding["channel"] == 2:
                     channelstr = cogs.shared.SPINITRON_URL_CHANNEL_HDX[2]
@@ -2,24 +2,29 @@
 This module contains the Broadcast cog, and acts as an extension for bot.py
 Broadcast contains commands related WKNC's HD-1 and HD-2 broadcasts.
 """
-from collections import Counter
-from datetime import datetime, timedelta
-from dateutil import parser, tz
+import asyncio
+from datetime import datetime, timedelta, timezone
 import discord
 from discord import Embed, app_commands
 from discord_argparse import ArgumentConverter
 from discord_argparse.argparse import OptionalArgument
 from discord.ext import commands
 import discord.ui
-import discogs_client
 from enum import Enum
 from importlib import reload
 import random
 import re
-import requests as r
-import urllib.parse
 
+import cogs.album_art
+import cogs.cache
+import cogs.now_playing
+import cogs.paging
+import cogs.personas
+import cogs.schedule
 import cogs.shared
+import cogs.spin_history
+import cogs.spinitron
+import cogs.timeutil
 
 
 class ShowID(Enum):
@@ -42,8 +47,7 @@ def my_parser(date: str, space: bool = True, ampm: bool = True) -> str:
     spacechar = ""
     if space:
         spacechar = " "
-    dt = parser.parse(date)
-    dt = dt.replace(tzinfo=tz.UTC).astimezone(tz.gettz(cogs.shared.LOCAL_TIMEZONE)).hour
+    dt = cogs.timeutil.to_local(date).hour
     ampm_str = ""
     if (ampm):
         if (dt < 12):
@@ -74,8 +78,7 @@ def is_in_past(date: str) -> bool:
     Returns:
         bool: True, if the date is in the past. Otherwise false
     """
-    date = parser.parse(date)
-    return datetime.utcnow().replace(tzinfo=tz.UTC) > date.replace(tzinfo=tz.UTC)
+    return cogs.timeutil.is_in_past(date)
 
 def is_today(date: str) -> bool:
     """Returns true if the Provided UTC datestring has or will occur today
@@ -84,18 +87,7 @@ def is_today(date: str) -> bool:
     Returns:
         bool: True, if the date is before or at UTC midnight
     """
-    indate = parser.parse(date)
-    nextmidnight = (
-        datetime.now(tz.gettz(cogs.shared.LOCAL_TIMEZONE))
-        .replace(hour=23, minute=59, second=59, microsecond=59)
-        .astimezone(tz.UTC)
-    )
-    lastmidnight = (
-        datetime.now(tz.gettz(cogs.shared.LOCAL_TIMEZONE))
-        .replace(hour=0, minute=0, second=0, microsecond=0)
-        .astimezone(tz.UTC)
-    )
-    return indate < nextmidnight and lastmidnight <= indate
+    return cogs.timeutil.is_today(date)
 
 def is_yesterday(date: str) -> bool:
     """Returns true if the Provided UTC datestring occured yesterday
@@ -104,18 +96,7 @@ def is_yesterday(date: str) -> bool:
     Returns:
         bool: True, if the date is before or at UTC midnight
     """
-    indate = parser.parse(date) + timedelta(days = 1)
-    nextmidnight = (
-        datetime.now(tz.gettz(cogs.shared.LOCAL_TIMEZONE))
-        .replace(hour=23, minute=59, second=59, microsecond=59)
-        .astimezone(tz.UTC)
-    )
-    lastmidnight = (
-        datetime.now(tz.gettz(cogs.shared.LOCAL_TIMEZONE))
-        .replace(hour=0, minute=0, second=0, microsecond=0)
-        .astimezone(tz.UTC)
-    )
-    return indate < nextmidnight and lastmidnight <= indate
+    return cogs.timeutil.is_yesterday(date)
 
 def get_next_show(upcoming_shows: list, channel: int = 1) -> dict:
     """Takes a list of shows (ascending) and returns the next scheduled show that is not automated
@@ -136,28 +117,11 @@ def to_enum(argument: str) -> str:
 def to_lower(argument: str) -> str:
     return argument.lower()
 
-def get_dj_name(spinitron_id: str, headers) -> str:
-    dj_name = r.get(
-        "https://spinitron.com/api/personas/{}".format(spinitron_id.replace(" ", "%20")),
-        headers=headers,
-    ).json()["name"]
+async def get_dj_name(spinitron: cogs.spinitron.SpinitronClient, spinitron_id: str, channel_num: int) -> str:
+    dj_name = (await spinitron.get_persona(channel_num, spinitron_id))["name"]
 
     return dj_name
 
-def get_album_art(last_spin):
-    discogs = discogs_client.Client("WKNC-Bot/0.1", user_token=cogs.shared.DISCOGS_TOKEN)
-
-    img_art: str = None
-    if last_spin["image"]:
-        img_art = last_spin["image"]
-    else:
-        d_search = discogs.search(
-            "{} - {}".format(last_spin["artist"], last_spin["song"]), type="release"
-        )
-        if len(d_search) > 0:
-            img_art = d_search[0].thumb
-    return img_art
-
 
 summary_param_converter = ArgumentConverter(
     show=OptionalArgument(
@@ -175,6 +139,12 @@ class Broadcast(commands.Cog):
     """Commands related to WKNC's HD-1 and HD-2 broadcasts | *The channel for Broadcast commands can be specified by adding 1 or 2 to the command (e.g. !np1)"""
     def __init__(self, bot):
         self.bot = bot
+        self.spinitron = cogs.spinitron.get_client(bot)
+        self.now_playing = cogs.now_playing.get_poller(bot)
+        self.spin_history = cogs.spin_history.get_spin_history(bot)
+        self.schedule_index = cogs.schedule.get_schedule_index(bot)
+        self.persona_directory = cogs.personas.get_persona_directory(bot)
+        self.album_art = cogs.album_art.get_album_art_resolver(bot)
 
 
     @commands.hybrid_command(name="djset", brief="All songs played on the last, non automated show")
@@ -199,18 +169,19 @@ class Broadcast(commands.Cog):
     
     async def djset_query(self, ctx: commands.Context, channel_num, djname):
         async with ctx.typing():
-            # Get embed - choose function based on whether djname argument was entered
+            # Get embeds - choose function based on whether djname argument was entered
             if not djname:
-                embed = await self.last_set_embed_builder(ctx, channel_num)
+                embeds = await self.last_set_embed_builder(ctx, channel_num)
             else:
-                embed = await self.dj_last_set_embed_builder(ctx, channel_num, djname)
+                embeds = await self.dj_last_set_embed_builder(ctx, channel_num, djname)
 
-            if (embed):
-                await ctx.send(embed=embed)
+            if (embeds):
+                # If the set is too long for one embed, the other pages are behind buttons
+                await cogs.paging.send_pages(ctx, embeds)
 
     async def last_set_embed_builder(self, ctx: commands.Context, channel_num):
         # Get list of last playlists from Spinitron
-        last_playlists = r.get(f"https://spinitron.com/api/playlists?count={cogs.shared.LAST_SET_RANGE}", headers=cogs.shared.HEADERS_HDX[channel_num]).json()["items"]
+        last_playlists = await self.spinitron.get_items(channel_num, "playlists", count=cogs.shared.LAST_SET_RANGE)
 
         # Count up to closest non automated set
         i = 0
@@ -222,55 +193,38 @@ class Broadcast(commands.Cog):
             await ctx.send("No recent dj sets detected")
         else:
             lastset = last_playlists[i]
-            return self.make_set_embed(lastset, channel_num)
+            return await self.make_set_embeds(lastset, channel_num)
 
         return None
 
     async def dj_last_set_embed_builder(self, ctx: commands.Context, channel_num, dj_name):
 
         # Get Spinitron persona page of the DJ
-        response = r.get(
-            "https://spinitron.com/api/personas?name={}".format(dj_name.replace(" ", "%20")),
-            headers=cogs.shared.HEADERS_HDX[channel_num],
-        ).json()["items"]
-        
-        # WKNC DJ names do not follow a consistent naming scheme. Some include "DJ " at the beginning and others do not
-        # A common user error for this command is to falsely include or omit the opening "DJ " before a DJ name
-        if not response:
-            # If the user included "DJ" in their argument, try without
-            if dj_name.lower()[:3] == "dj ":
-                response = r.get(
-                    "https://spinitron.com/api/personas?name={}".format(dj_name[3:].replace(" ", "%20")),
-                    headers=cogs.shared.HEADERS_HDX[channel_num],
-                ).json()["items"]
-            # If the user did not include "DJ" in their argument, try including
-            else:
-                response = r.get(
-                    "https://spinitron.com/api/personas?name={}".format(f"DJ {dj_name}".replace(" ", "%20")),
-                    headers=cogs.shared.HEADERS_HDX[channel_num],
-                ).json()["items"]
+        # The directory ignores case, punctuation and a leading "DJ ", since a common user error for this command is
+        # to falsely include or omit the opening "DJ " before a DJ name
+        persona, suggestions = await self.persona_directory.lookup(channel_num, dj_name)
 
-        if not response:
-            await ctx.send(f"Huh, I couldn't seem to find {dj_name} on HD-{channel_num}. Are you sure that's the right DJ Name?")
+        if not persona:
+            await ctx.send(f"Huh, I couldn't seem to find {dj_name} on HD-{channel_num}. Are you sure that's the right DJ Name?" + cogs.personas.format_suggestions(suggestions))
         else:
-            spinitron_id = response[0]["id"]
+            spinitron_id = persona["id"]
 
             # Get DJ's last playlists
-            last_playlists = r.get(f"https://spinitron.com/api/playlists?persona_id={spinitron_id}", headers=cogs.shared.HEADERS_HDX[channel_num]).json()["items"]
+            last_playlists = await self.spinitron.get_items(channel_num, "playlists", persona_id=spinitron_id)
 
             # Make embed from most recent playlist
             if (last_playlists):
-                return self.make_set_embed(last_playlists[0], channel_num)
+                return await self.make_set_embeds(last_playlists[0], channel_num)
             
             # If no playlists, say so
             await ctx.send(f"It doesn't look like {dj_name} has had any HD-{channel_num} sets yet!")
 
         return None
 
-    def make_set_embed(self, lastset, channel_num):
+    async def make_set_embeds(self, lastset, channel_num) -> list:
         # Get beginning time of set and parse
         utcstring = lastset["start"]
-        starttime =  parser.parse(lastset["start"]).astimezone(tz.gettz(cogs.shared.LOCAL_TIMEZONE))
+        starttime = cogs.timeutil.to_local(lastset["start"])
         ltstring = starttime.isoformat()
         
         # Default values for vars
@@ -310,56 +264,52 @@ class Broadcast(commands.Cog):
         else:
             timemessage += "am"
 
-        # Get list of songs from the set (first page)
-        set_items = r.get(lastset["_links"]["spins"]["href"], headers=cogs.shared.HEADERS_HDX[channel_num]).json()["items"]
+        spinitron_id = lastset["persona_id"]
+
+        # Get every song from the set (all pages at once) along with the DJ's name
+        set_items, dj_name = await asyncio.gather(
+            self.spinitron.get_all_items(channel_num, lastset["_links"]["spins"]["href"], count=200),
+            get_dj_name(self.spinitron, str(spinitron_id), channel_num),
+        )
 
-        # Generate list of spin strings
+        # Generate list of spin strings, oldest first
         set_spin_list = []
-        moreitems = True
-        j = 1;
-        while (set_items):
-            for i in set_items:
-                # Get start time of song and parse
-                utcstring = i["start"]
-                starttime =  parser.parse(i["start"]).astimezone(tz.gettz(cogs.shared.LOCAL_TIMEZONE))
-                ltstring = starttime.isoformat()
-                hour = ltstring[11:13]
-                minute = utcstring[14:16]
-                if (int(hour) >= 13):
-                    hour = str(int(hour) - 12)
-
-                # Add song string to set_spin_list
-                set_spin_list.insert(0, f"`{hour}:{minute}`  **{i['artist'].replace('`', '')}** - {i['song'].replace('`', '')}" + "\n")
-            
-            # Check for limit on pages
-            j += 1
-            if (j > cogs.shared.MAX_PAGES_FOR_DJSET):
-                break
+        for i in reversed(set_items):
+            # Get start time of song and parse
+            utcstring = i["start"]
+            starttime = cogs.timeutil.to_local(i["start"])
+            ltstring = starttime.isoformat()
+            hour = ltstring[11:13]
+            minute = utcstring[14:16]
+            if (int(hour) >= 13):
+                hour = str(int(hour) - 12)
 
-            # Get next page of songs
-            set_items = r.get(lastset["_links"]["spins"]["href"]+f"&page={j}", headers=cogs.shared.HEADERS_HDX[channel_num]).json()["items"]
+            # Add song string to set_spin_list
+            set_spin_list.append(f"`{hour}:{minute}`  **{i['artist'].replace('`', '')}** - {i['song'].replace('`', '')}" + "\n")
         
-        # Put together string of songs, with time at the beginning
-        set_spins_string = "".join(set_spin_list)
-        message = timemessage + "\n\n" + set_spins_string
-
-        spinitron_id = lastset["persona_id"]
+        # Put together strings of songs, with time at the beginning, split across as many embeds as needed
+        pages = cogs.paging.split_into_pages(timemessage + "\n\n", set_spin_list, cogs.shared.EMBED_DESCRIPTION_LIMIT)
 
         # Get image for the set if there is one
         img_art: str = None
         if lastset["image"]:
             img_art = lastset["image"]
         
-        # Generate embed
-        embed = Embed(
-            title=lastset["title"], description=message, color=cogs.shared.EMBED_COLOR
-        ).set_author(
-            name=get_dj_name(str(spinitron_id), cogs.shared.HEADERS_HDX[channel_num]), url=f"https://spinitron.com/{cogs.shared.SPINITRON_URL_CHANNEL_HDX[channel_num]}/dj/{spinitron_id}"
-        )
-        if img_art:
-            embed.set_thumbnail(url=img_art)
+        # Generate embeds
+        embeds = []
+        for page_num, message in enumerate(pages, start=1):
+            embed = Embed(
+                title=lastset["title"], description=message, color=cogs.shared.EMBED_COLOR
+            ).set_author(
+                name=dj_name, url=f"https://spinitron.com/{cogs.shared.SPINITRON_URL_CHANNEL_HDX[channel_num]}/dj/{spinitron_id}"
+            )
+            if img_art:
+                embed.set_thumbnail(url=img_art)
+            if len(pages) > 1:
+                embed.set_footer(text=f"Page {page_num}/{len(pages)}")
+            embeds.append(embed)
 
-        return embed
+        return embeds
 
 
     @commands.hybrid_command(name="lp", brief="The last played song")
@@ -381,23 +331,21 @@ class Broadcast(commands.Cog):
 
     async def last_played_query(self, ctx: commands.Context, channel_num):
         async with ctx.typing():
-            # Get last spin
-            last_spin = r.get("https://spinitron.com/api/spins?count=2", headers=cogs.shared.HEADERS_HDX[channel_num]).json()["items"][1]
+            # Get last spin from the now playing snapshot
+            snapshot = await self.now_playing.get_snapshot(channel_num)
+            last_spin = snapshot.spins[1]
 
-            # Get Spinitron ID of DJ
-            spinitron_id = r.get(
-                "https://spinitron.com/api/playlists/{}".format(last_spin["playlist_id"]),
-                headers=cogs.shared.HEADERS_HDX[channel_num],
-            ).json()["persona_id"]
+            # Get Spinitron ID and name of DJ
+            spinitron_id, djname = snapshot.playlist_djs[last_spin["playlist_id"]]
 
             # Get album art of spin
-            img_art = get_album_art(last_spin)
+            img_art = await self.album_art.resolve(last_spin)
 
             # Generate embed
             embed = Embed(
                 title=last_spin["song"], description=last_spin["artist"], color=cogs.shared.EMBED_COLOR
             ).set_author(
-                name=get_dj_name(str(spinitron_id), cogs.shared.HEADERS_HDX[channel_num]), url=f"https://spinitron.com/{cogs.shared.SPINITRON_URL_CHANNEL_HDX[channel_num]}/dj/{spinitron_id}"
+                name=djname, url=f"https://spinitron.com/{cogs.shared.SPINITRON_URL_CHANNEL_HDX[channel_num]}/dj/{spinitron_id}"
             )
             if img_art:
                 embed.set_image(url=img_art)
@@ -426,9 +374,11 @@ class Broadcast(commands.Cog):
         async with ctx.typing(): 
             # Send thinking message to be shown while generating embed
             message = await ctx.send(":thinking: thinking...")
-        # Generate and send embed (with button)
-        embed = self.last_played_songs_embed_builder(channel_num, page=1)
-        await message.edit(content=f"The last played songs on HD-{channel_num}:", embed=embed, view=self.LPS_Button(outer_instance=self, channel_num=channel_num, message=message))
+        # Generate and send embed (with button), then get the next page ready in the background
+        view = self.LPS_Button(outer_instance=self, channel_num=channel_num, message=message)
+        embed = await view.get_page(1)
+        await message.edit(content=f"The last played songs on HD-{channel_num}:", embed=embed, view=view)
+        view.prefetch(2)
 
     class LPS_Button(discord.ui.View):
         """Class to use as the view in the lps command response message (implements button)"""
@@ -439,12 +389,68 @@ class Broadcast(commands.Cog):
             self.page = 1
             self.timeout=cogs.shared.BUTTON_TIMEOUT
             self.message = message
+
+            # Rendered pages, valid for as long as the newest spin stays the same (a new spin shifts every page by one)
+            # Every page is counted back from the same snapshot, so that pages line up with each other
+            self.pages = cogs.cache.TTLCache(cogs.shared.LPS_PAGE_CACHE_SIZE)
+            self.newest_spin_id = None
+            self.snapshot = None
+            self.fetching = {} # page -> task currently rendering it
         
         # On timeout - disable button
         async def on_timeout(self) -> None:
+            for task in self.fetching.values():
+                task.cancel()
             for button in self.children:
                 button.disabled = True
             await self.message.edit(view=self)
+
+        async def cached_page(self, page: int) -> Embed:
+            """Returns the rendered page if it is cached and still lines up with the latest spins, otherwise None"""
+            snapshot = await self.outer_instance.now_playing.get_snapshot(self.channel_num)
+            newest_spin_id = snapshot.spins[0]["id"] if snapshot.spins else None
+            if self.snapshot is None or newest_spin_id != self.newest_spin_id:
+                # Page boundaries have moved, nothing cached or in progress is right anymore
+                self.newest_spin_id = newest_spin_id
+                self.snapshot = snapshot
+                self.pages.clear()
+                for task in self.fetching.values():
+                    task.cancel()
+                self.fetching = {}
+            return self.pages.get(page)
+
+        async def render_page(self, page: int, snapshot) -> Embed:
+            try:
+                embed = await self.outer_instance.last_played_songs_embed_builder(channel_num=self.channel_num, page=page, snapshot=snapshot)
+                # Only keep the page if no new spin arrived while it was being rendered
+                if snapshot is self.snapshot:
+                    self.pages.set(page, embed)
+                return embed
+            finally:
+                if self.fetching.get(page) is asyncio.current_task():
+                    del self.fetching[page]
+
+        def fetch(self, page: int) -> asyncio.Task:
+            """Returns the task rendering a page, starting one if the page isn't already being rendered"""
+            task = self.fetching.get(page)
+            if task is None:
+                task = asyncio.ensure_future(self.render_page(page, self.snapshot))
+                self.fetching[page] = task
+            return task
+
+        async def get_page(self, page: int) -> Embed:
+            embed = await self.cached_page(page)
+            if embed is None:
+                embed = await self.fetch(page)
+            return embed
+
+        def prefetch(self, page: int):
+            """Starts rendering a page in the background, so it's ready by the time it is asked for"""
+            if page in self.pages or page in self.fetching:
+                return
+            task = self.fetch(page)
+            # Nobody may ever await this task, so retrieve its exception here so that it's not reported as unhandled
+            task.add_done_callback(lambda t: t.cancelled() or t.exception())
         
         # Back button
         @discord.ui.button(label='<', disabled = True)
@@ -457,13 +463,15 @@ class Broadcast(commands.Cog):
                 if (self.page <= 1):
                     button.disabled = True
             
-            # Show thinking and defer until ready
-            thinkingEmbed = Embed(description = ":thinking: thinking...")
             await interaction.response.defer()
-            await interaction.edit_original_response(view=self, embed=thinkingEmbed)
+            embed = await self.cached_page(self.page)
+            if embed is None:
+                # Show thinking until ready
+                thinkingEmbed = Embed(description = ":thinking: thinking...")
+                await interaction.edit_original_response(view=self, embed=thinkingEmbed)
+                embed = await self.get_page(self.page)
 
             # Update with text for the new page
-            embed = self.outer_instance.last_played_songs_embed_builder(channel_num=self.channel_num, page=self.page)
             await interaction.edit_original_response(view=self, embed=embed)
         
         # Forward button
@@ -475,40 +483,53 @@ class Broadcast(commands.Cog):
                 # If page > 1, enable back button
                 self.children[0].disabled = False
 
-            # Show thinking message (throw in a little random emoji sometimes for fun :) )
-            if (self.page > cogs.shared.LPS_RAND_THRESH and random.randint(1,cogs.shared.LPS_RAND_POOL) == 1):
-                try:
-                    thinkMessage = random.choice(self.bot.get_guild(cogs.shared.DEV_SERVER_DISCORD_ID).emojis)
-                except:
-                    thinkMessage = ":thinking: thinking..."
-            else:
-                thinkMessage = ":thinking: thinking..."
-            
-            # Show thinking and defer until ready
-            thinkingEmbed = Embed(description = thinkMessage)
             await interaction.response.defer()
-            await interaction.edit_original_response(view=self, embed=thinkingEmbed)
+            embed = await self.cached_page(self.page)
+            if embed is None:
+                # Show thinking message (throw in a little random emoji sometimes for fun :) )
+                if (self.page > cogs.shared.LPS_RAND_THRESH and random.randint(1,cogs.shared.LPS_RAND_POOL) == 1):
+                    try:
+                        thinkMessage = random.choice(self.bot.get_guild(cogs.shared.DEV_SERVER_DISCORD_ID).emojis)
+                    except:
+                        thinkMessage = ":thinking: thinking..."
+                else:
+                    thinkMessage = ":thinking: thinking..."
 
-            # Update with text for the new page
-            embed = self.outer_instance.last_played_songs_embed_builder(channel_num=self.channel_num, page=self.page)
+                # Show thinking until ready
+                thinkingEmbed = Embed(description = thinkMessage)
+                await interaction.edit_original_response(view=self, embed=thinkingEmbed)
+                embed = await self.get_page(self.page)
+
+            # Update with text for the new page, then get the one after it ready
             await interaction.edit_original_response(view=self, embed=embed)
+            self.prefetch(self.page + 1)
+
+    async def last_played_songs_embed_builder(self, channel_num, page, snapshot=None):
+        """Renders a page of lps. Pages after the first are counted back from the oldest spin on the first page of
+        the now playing snapshot, so spins logged since the snapshot was taken don't shift them"""
+        if snapshot is None:
+            snapshot = await self.now_playing.get_snapshot(channel_num)
+        if page == 1:
+            # The first page is always in the now playing snapshot
+            last_spins = snapshot.spins[:10]
+            playlist_djs = snapshot.playlist_djs
+        else:
+            # Get list of last spins (with given page), from before the last spin of the first page
+            last_spins = []
+            if snapshot.spins:
+                anchor_start = cogs.timeutil.parse_spinitron_time(snapshot.spins[:10][-1]["start"])
+                before = (anchor_start - timedelta(seconds=1)).astimezone(timezone.utc).strftime("%Y-%m-%dT%H:%M:%S+0000")
+                last_spins = await self.spinitron.get_items(channel_num, "spins", count=10, page=page - 1, end=before)
 
-    def last_played_songs_embed_builder(self, channel_num, page):
-        # Get list of last spins (with given page)
-        last_spins = r.get(f"https://spinitron.com/api/spins?count=10&page={page}", headers=cogs.shared.HEADERS_HDX[channel_num]).json()["items"]
+            # Resolve the DJ of each distinct playlist on the page, all at once
+            playlist_djs = await self.spinitron.resolve_playlist_djs(channel_num, [i["playlist_id"] for i in last_spins])
 
         # Get list of strings for last played songs
         last_played_list = []
         count = 0
         for i in last_spins:
-            # Get Spinitron ID of song
-            spinitron_id = r.get(
-                "https://spinitron.com/api/playlists/{}".format(i["playlist_id"]),
-                headers=cogs.shared.HEADERS_HDX[channel_num],
-            ).json()["persona_id"]
-
             # Get name and link to their page
-            djname = get_dj_name(str(spinitron_id), cogs.shared.HEADERS_HDX[channel_num])
+            spinitron_id, djname = playlist_djs[i["playlist_id"]]
             djlink = f"https://spinitron.com/{cogs.shared.SPINITRON_URL_CHANNEL_HDX[channel_num]}/dj/{spinitron_id}"
 
             # Show playing now next to the currently playing song
@@ -518,7 +539,7 @@ class Broadcast(commands.Cog):
 
             # Get and parse starting time of song
             utcstring = i["start"]
-            starttime =  parser.parse(i["start"]).astimezone(tz.gettz(cogs.shared.LOCAL_TIMEZONE))
+            starttime = cogs.timeutil.to_local(i["start"])
             ltstring = starttime.isoformat()
             hour = ltstring[11:13]
             minute = utcstring[14:16]
@@ -557,15 +578,14 @@ class Broadcast(commands.Cog):
 
     async def next_show_query(self, ctx: commands.Context, channel_num):
         async with ctx.typing():
-            # Find next show and send
-            upcoming_shows = r.get(
-                "https://spinitron.com/api/shows",
-                headers=cogs.shared.HEADERS_HDX[channel_num],
-            ).json()["items"]
-            next_dj_show = get_next_show(upcoming_shows, channel_num)
-            response_message = "Coming up next is {} at {}".format(
-                next_dj_show["title"], my_parser(next_dj_show["start"], True)
-            )
+            # Find next show from the schedule index and send
+            next_dj_show = await self.schedule_index.next_live_show(channel_num)
+            if next_dj_show:
+                response_message = "Coming up next is {} at {}".format(
+                    next_dj_show.show["title"], my_parser(next_dj_show.show["start"], True)
+                )
+            else:
+                response_message = f"I don't see any upcoming shows on HD-{channel_num} this week"
 
             await ctx.send(response_message)
 
@@ -589,20 +609,18 @@ class Broadcast(commands.Cog):
 
     async def now_playing_query(self, ctx: commands.Context, channel_num):
         async with ctx.typing():
-            # Get last spin and spinitron id of DJ
-            last_spin = r.get("https://spinitron.com/api/spins?count=1", headers=cogs.shared.HEADERS_HDX[channel_num]).json()["items"][0]
-            spinitron_id = r.get(
-                "https://spinitron.com/api/playlists/{}".format(last_spin["playlist_id"]),
-                headers=cogs.shared.HEADERS_HDX[channel_num],
-            ).json()["persona_id"]
+            # Get last spin and spinitron id of DJ from the now playing snapshot
+            snapshot = await self.now_playing.get_snapshot(channel_num)
+            last_spin = snapshot.spins[0]
+            spinitron_id, djname = snapshot.playlist_djs[last_spin["playlist_id"]]
 
-            img_art = get_album_art(last_spin)
+            img_art = await self.album_art.resolve(last_spin)
 
             # Generate embed and send
             embed = Embed(
                 title=last_spin["song"], description=last_spin["artist"], color=cogs.shared.EMBED_COLOR# Add url?
             ).set_author(
-                name=get_dj_name(str(spinitron_id), cogs.shared.HEADERS_HDX[channel_num]), url=f"https://spinitron.com/{cogs.shared.SPINITRON_URL_CHANNEL_HDX[channel_num]}/dj/{spinitron_id}"
+                name=djname, url=f"https://spinitron.com/{cogs.shared.SPINITRON_URL_CHANNEL_HDX[channel_num]}/dj/{spinitron_id}"
             )
             if img_art:
                 embed.set_image(url=img_art)
@@ -681,7 +699,7 @@ class Broadcast(commands.Cog):
                         return
                 
                 # Generate embed (day specified)
-                embed = self.day_show_schedule(channel_num, date)
+                embed = await self.day_show_schedule(channel_num, date)
                 if (embed):
                     await ctx.send(embed = embed)
                 else:
@@ -689,72 +707,66 @@ class Broadcast(commands.Cog):
 
             else:
                 # Generate embed for today
-                embed = self.upcoming_show_schedule(channel_num)
+                embed = await self.upcoming_show_schedule(channel_num)
                 if (embed):
                     await ctx.send(embed = embed)
                 else:
                     await ctx.send("No more shows today! Check back tomorrow")
 
-    def day_show_schedule(self, channel_num, date: datetime.date):
-        
-        # Get beginning and end of the day as datetimes and strings
-        starttime = datetime.combine(date, datetime.min.time())
-        endtime = starttime.replace(hour = 23, minute = 59, second = 59)
-        starttimestr = urllib.parse.quote(starttime.isoformat())
-        endtimestr = urllib.parse.quote(endtime.isoformat())
-
-        # Get list of upcoming shows within that day
-        upcoming_shows = r.get(
-            "https://spinitron.com/api/shows?count=24&start={}&end={}".format(starttimestr, endtimestr),
-            headers=cogs.shared.HEADERS_HDX[channel_num],
-        ).json()["items"]
+    def schedule_line(self, channel_num, show: cogs.schedule.ScheduledShow) -> str:
+        """Returns the line representing a show in a schedule embed"""
+        return "`{}-{}`  {}: [{}]({})".format(
+            my_parser(show.show["start"], False, False), my_parser(show.show["end"], False, True), show.show["title"], show.persona_name,
+            f"https://spinitron.com/{cogs.shared.SPINITRON_URL_CHANNEL_HDX[channel_num]}/dj/{show.persona_id}"
+        )
+
+    async def day_show_schedule(self, channel_num, date: datetime.date):
+        day = date.date() if isinstance(date, datetime) else date
+
+        # Reuse the embed if this day has already been rendered since the last schedule refresh
+        channel_schedule = await self.schedule_index.get(channel_num)
+        embed = channel_schedule.rendered.get(("day", day))
+        if embed is not None:
+            return embed
+
+        # Get list of shows within that day from the schedule index
+        day_shows = await self.schedule_index.shows_on(channel_num, day)
 
         embed = Embed()
 
         # Generate schedule - list of strings, each with a non automated show
-        schedule = []
-        for show in upcoming_shows:
-            if not is_automated(show, channel_num):
-                persona_data = r.get(show["_links"]["personas"][0]["href"], headers=cogs.shared.HEADERS_HDX[channel_num]).json()
-                show_persona = persona_data["name"]
-                persona_id = persona_data["id"]
-                schedule.append(
-                    "`{}-{}`  {}: [{}]({})".format(my_parser(show["start"], False, False), my_parser(show["end"], False, True), show["title"], show_persona, f"https://spinitron.com/{cogs.shared.SPINITRON_URL_CHANNEL_HDX[channel_num]}/dj/{persona_id}")
-                )
+        schedule = [self.schedule_line(channel_num, show) for show in day_shows if not show.automated]
         
         # Finish embed
         if schedule:
-            embed.title = f"{cogs.shared.WEEKDAY_LIST[date.weekday()]}'s Schedule (HD-{channel_num})"
+            embed.title = f"{cogs.shared.WEEKDAY_LIST[day.weekday()]}'s Schedule (HD-{channel_num})"
             embed.description = "\n".join(schedule)
             embed.color = cogs.shared.EMBED_COLOR
 
+        if channel_schedule.covers(day):
+            channel_schedule.rendered[("day", day)] = embed
         return embed
 
-    def upcoming_show_schedule(self, channel_num):
+    async def upcoming_show_schedule(self, channel_num):
+
+        upcoming_shows = await self.schedule_index.upcoming_today(channel_num)
 
-        upcoming_shows = r.get(
-            "https://spinitron.com/api/shows",
-            headers=cogs.shared.HEADERS_HDX[channel_num],
-        ).json()["items"]
+        # The rest of today only changes when a show ends, so reuse the embed until then
+        channel_schedule = await self.schedule_index.get(channel_num)
+        key = ("today", upcoming_shows[0].start if upcoming_shows else None)
+        embed = channel_schedule.rendered.get(key)
+        if embed is not None:
+            return embed
 
         embed = Embed()
 
-        schedule = []
-        for show in upcoming_shows:
-            if not is_today(show["start"]):
-                break
-            if not is_automated(show, channel_num):
-                persona_data = r.get(show["_links"]["personas"][0]["href"], headers=cogs.shared.HEADERS_HDX[channel_num]).json()
-                show_persona = persona_data["name"]
-                persona_id = persona_data["id"]
-                schedule.append(
-                    "`{}-{}`  {}: [{}]({})".format(my_parser(show["start"], False, False), my_parser(show["end"], False), show["title"], show_persona, f"https://spinitron.com/{cogs.shared.SPINITRON_URL_CHANNEL_HDX[channel_num]}/dj/{persona_id}")
-                )
+        schedule = [self.schedule_line(channel_num, show) for show in upcoming_shows if not show.automated]
         if schedule:
             embed.title = f"Today's Schedule (HD-{channel_num})"
             embed.description = "\n".join(schedule)
             embed.color = cogs.shared.EMBED_COLOR
 
+        channel_schedule.rendered[key] = embed
         return embed
 
 
@@ -778,48 +790,26 @@ class Broadcast(commands.Cog):
     async def summary_query(self, ctx: commands.Context, channel_num, params):
         async with ctx.typing():
             days = params["days"]
-            start_date = (datetime.utcnow() - timedelta(days=days)).strftime("%x")
             show_id = ShowID[params["show"].replace(" ", "_").upper()]
             by = params["by"]
 
-            if days > 30:
-                await ctx.send(
-                    "For summaries more than 30 days please use https://spinitron.com/m/spin/chart"
-                )
-                return
-
-            page = 1
-            response = True
-            song_dict = {}
-            artist_dict = {}
-
             message = await ctx.send("Just a moment, let me get that for you...")
 
-            while response:
-                response = r.get(
-                    f"https://spinitron.com/api/spins?start={start_date}&count=200&page={page}&show_id={show_id.value}",
-                    headers=cogs.shared.HEADERS_HDX[channel_num],
-                ).json()["items"]
-                for spin in response:
-                    key = "{} by {}".format(spin["song"], spin["artist"])
-                    artist = spin["artist"]
-                    if key not in song_dict:
-                        song_dict[key] = 0
-                        artist_dict[artist] = 0
-                    song_dict[key] += 1
-                    artist_dict[artist] += 1
-                page += 1
-
-            if by == "artist":
-                counter = Counter(artist_dict).most_common(params["top"])
-            else:
-                counter = Counter(song_dict).most_common(params["top"])
+            # Count from the local spin history
+            counter = await self.spin_history.top(channel_num, by, days, show_id=show_id.value, limit=params["top"])
 
             summary_list = []
             for key, value in counter:
                 summary_list.append(f"    -{key} | {value} times")
             response_message = f"**Top {by}s of the past {days} days**\n" + "\n".join(summary_list)
 
+            # Let the user know if the history isn't complete yet, or doesn't go back as far as they asked
+            earliest_spin = self.spin_history.earliest_spin(channel_num)
+            if not self.spin_history.is_synced(channel_num):
+                response_message += "\n*(My spin history is still being downloaded, so these counts are incomplete. Try again in a bit)*"
+            elif earliest_spin is not None and earliest_spin > datetime.utcnow() - timedelta(days=days):
+                response_message += f"\n*(My spin history only goes back to {earliest_spin.strftime('%m/%d/%y')})*"
+
             await message.edit(content=response_message)
             await ctx.send(ctx.author.mention)
 
@@ -0,0 +1,91 @@
+"""
+This module contains the in-memory caching utilities used by the other modules
+"""
+import asyncio
+from collections import OrderedDict
+import time
+
+import cogs.rate_limit
+
+
+class TTLCache:
+    """Least-recently-used cache where every entry also expires after a time to live (in seconds, None to never expire)"""
+    def __init__(self, maxsize: int, ttl: float = None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.entries = OrderedDict() # key -> (expiry time, value), ordered from least to most recently used
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def __contains__(self, key) -> bool:
+        entry = self.entries.get(key)
+        return entry is not None and entry[0] > time.monotonic()
+
+    def get(self, key, default=None) -> any:
+        """Returns the cached value for key, or default if it is missing or expired"""
+        entry = self.entries.get(key)
+        if entry is None or entry[0] <= time.monotonic():
+            if entry is not None:
+                del self.entries[key]
+            self.misses += 1
+            return default
+
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return entry[1]
+
+    def set(self, key, value, ttl: float = None):
+        """Stores value under key, evicting the least recently used entry if the cache is full"""
+        ttl = ttl if ttl is not None else self.ttl
+        self.entries[key] = (time.monotonic() + ttl if ttl is not None else float("inf"), value)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+
+    def pop(self, key, default=None) -> any:
+        entry = self.entries.pop(key, None)
+        return entry[1] if entry is not None else default
+
+    def clear(self):
+        self.entries.clear()
+
+
+class SingleFlight:
+    """Coalesces concurrent calls for the same key, so that only one of them actually runs at a time
+    While a call for a key is in flight, every other call for that key waits on the same result instead of
+    starting its own. Results are shared between callers, so they should be treated as read-only.
+    A call runs at the rate limit priority of the caller that started it, so an interactive caller never waits on a
+    background call: it starts its own, which later callers for the key then join instead.
+    """
+    def __init__(self):
+        self.in_flight = {} # key -> (task, rate limit priority it runs at)
+        self.hits = 0 # Calls that joined a call already in flight
+        self.misses = 0 # Calls that had to start one
+
+    def start(self, key, coro_func, *args) -> asyncio.Task:
+        """Returns the task running coro_func(*args) for key, starting it if there isn't one in flight"""
+        priority = cogs.rate_limit.current_priority.get()
+        task, task_priority = self.in_flight.get(key, (None, None))
+        if task is not None and task_priority <= priority:
+            self.hits += 1
+            return task
+
+        self.misses += 1
+        task = asyncio.ensure_future(coro_func(*args))
+        self.in_flight[key] = (task, priority)
+        task.add_done_callback(lambda _: self.forget(key, task))
+        return task
+
+    def forget(self, key, task: asyncio.Task):
+        # A background call that was overtaken by an interactive one may finish after it was replaced
+        if self.in_flight.get(key, (None,))[0] is task:
+            del self.in_flight[key]
+
+    async def run(self, key, coro_func, *args) -> any:
+        """Awaits the call for key (see start)
+        The wait is shielded, so one caller being cancelled doesn't cancel the call for the others
+        """
+        return await asyncio.shield(self.start(key, coro_func, *args))
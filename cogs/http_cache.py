@@ -0,0 +1,175 @@
+"""
+This module contains the shared HTTP cache, an on-disk cache of upstream GET responses
+
+How long a response is trusted depends on the endpoint (see HTTP_CACHE_TTLS), and once it goes stale it is
+revalidated with a conditional request if the upstream gave an ETag or Last-Modified date, so an unchanged resource
+only costs a 304. Bodies are stored compressed in SQLite, so the cache survives restarts. The database is used from
+the event loop, so when another process has it locked for more than a moment, the cache is skipped rather than waited on.
+"""
+import aiohttp
+import asyncio
+import logging
+import sqlite3
+import time
+from urllib.parse import urlencode
+import zlib
+
+import cogs.rate_limit
+import cogs.shared
+
+
+def ttl_for(url: str) -> float:
+    """Returns how many seconds a response from url is trusted for (the longest matching prefix in HTTP_CACHE_TTLS), or None if it isn't cached"""
+    matches = [prefix for prefix in cogs.shared.HTTP_CACHE_TTLS if url.startswith(prefix)]
+    if not matches:
+        return None
+    return cogs.shared.HTTP_CACHE_TTLS[max(matches, key=len)]
+
+
+class HTTPCache:
+    """Caches GET responses on disk, revalidating them with conditional requests once they go stale"""
+    def __init__(self):
+        self.db = sqlite3.connect(cogs.shared.HTTP_CACHE_DB_PATH, timeout=30)
+        # Popularity backfill processes share the cache with the bot
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute(
+            """
+            CREATE TABLE IF NOT EXISTS responses (
+                key TEXT PRIMARY KEY,
+                body BLOB NOT NULL,
+                etag TEXT,
+                last_modified TEXT,
+                expires REAL NOT NULL
+            )
+            """
+        )
+        self.db.commit()
+        self.session = None
+        self.last_prune = 0
+        self.hits = 0 # Fresh responses served from disk
+        self.revalidated = 0 # Stale responses confirmed unchanged by a 304
+        self.misses = 0 # Full downloads
+        self.prune()
+        # Only wait long at startup, after that a locked database counts as a miss (see read and write)
+        self.db.execute(f"PRAGMA busy_timeout = {int(cogs.shared.HTTP_CACHE_BUSY_TIMEOUT)}")
+
+    def read(self, key: str) -> tuple:
+        """Returns the stored (body, etag, last_modified, expires) of a key, or None if there is none or the database is locked"""
+        try:
+            return self.db.execute("SELECT body, etag, last_modified, expires FROM responses WHERE key = ?", (key,)).fetchone()
+        except sqlite3.OperationalError as e:
+            logging.warning(f"HTTP cache: Skipping read, {e}")
+            return None
+
+    def write(self, query: str, args: tuple) -> bool:
+        """Runs a write on the database, giving up if it is locked
+        Returns:
+            bool: Whether the write went through
+        """
+        try:
+            self.db.execute(query, args)
+            self.db.commit()
+            return True
+        except sqlite3.OperationalError as e:
+            self.db.rollback()
+            logging.warning(f"HTTP cache: Skipping write, {e}")
+            return False
+
+    def get_session(self) -> aiohttp.ClientSession:
+        """Returns the cache's own pooled session, for requests that don't need any particular credentials"""
+        if self.session is None or self.session.closed:
+            self.session = aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=cogs.shared.HTTP_CACHE_REQUEST_TIMEOUT))
+        return self.session
+
+    async def request(self, session: aiohttp.ClientSession, url: str, params: dict, headers: dict, limiter: cogs.rate_limit.RateLimiter) -> tuple:
+        """Sends a GET request through the rate limiter (if any), retrying when the upstream answers 429
+        Returns:
+            tuple: (HTTP status, response headers, body bytes)
+        """
+        attempt = 0
+        while True:
+            if limiter:
+                await limiter.acquire()
+            async with session.get(url, params=params or None, headers=headers) as response:
+                body = await response.read()
+                if response.status != 429:
+                    if limiter:
+                        limiter.succeeded()
+                    return response.status, response.headers, body
+                if limiter:
+                    limiter.rate_limited(response.headers.get("Retry-After"))
+                attempt += 1
+                if attempt > cogs.shared.RATE_LIMIT_MAX_RETRIES:
+                    return response.status, response.headers, body
+                if not limiter:
+                    await asyncio.sleep(cogs.shared.RATE_LIMIT_DEFAULT_PAUSE)
+
+    async def get(self, url: str, params: dict = None, headers: dict = None, session: aiohttp.ClientSession = None, scope: str = "", limiter: cogs.rate_limit.RateLimiter = None, max_age: float = None) -> tuple:
+        """Performs a GET request, going through the cache if the url has a TTL policy
+        Args:
+            url (str): The url to request
+            params (dict): Query parameters to add to the request
+            headers (dict): Headers to add to the request
+            session (aiohttp.ClientSession): The session to send the request with, defaults to the cache's own
+            scope (str): Kept apart from other scopes in the cache, for sessions whose credentials change the response
+            limiter (RateLimiter): The rate limiter for the upstream, only used when a request actually goes out
+            max_age (float): If given, a cached response older than this many seconds is revalidated even if its TTL hasn't run out
+        Returns:
+            tuple: (HTTP status, body bytes). Only 200 responses are cached
+        """
+        session = session or self.get_session()
+        ttl = ttl_for(url)
+        if ttl is None:
+            status, _, body = await self.request(session, url, params, headers, limiter)
+            return status, body
+
+        key = f"{scope} {url}?{urlencode(sorted((params or {}).items()))}"
+        row = self.read(key)
+        # A response was stored (or last revalidated) ttl seconds before it expires
+        if row is not None and row[3] > time.time() and (max_age is None or row[3] - ttl + max_age > time.time()):
+            self.hits += 1
+            return 200, zlib.decompress(row[0])
+
+        request_headers = dict(headers or {})
+        if row is not None:
+            if row[1]:
+                request_headers["If-None-Match"] = row[1]
+            if row[2]:
+                request_headers["If-Modified-Since"] = row[2]
+
+        status, response_headers, body = await self.request(session, url, params, request_headers, limiter)
+        if status == 304 and row is not None:
+            self.revalidated += 1
+            self.write("UPDATE responses SET expires = ? WHERE key = ?", (time.time() + ttl, key))
+            return 200, zlib.decompress(row[0])
+
+        self.misses += 1
+        if status == 200:
+            self.store(key, body, response_headers.get("ETag"), response_headers.get("Last-Modified"), ttl)
+        return status, body
+
+    def store(self, key: str, body: bytes, etag: str, last_modified: str, ttl: float):
+        self.write(
+            "INSERT OR REPLACE INTO responses (key, body, etag, last_modified, expires) VALUES (?, ?, ?, ?, ?)",
+            (key, zlib.compress(body), etag, last_modified, time.time() + ttl),
+        )
+        if time.time() - self.last_prune > cogs.shared.HTTP_CACHE_PRUNE_INTERVAL:
+            self.prune()
+
+    def prune(self):
+        """Deletes responses that have been stale for longer than HTTP_CACHE_KEEP_STALE (they're unlikely to be asked for again)"""
+        # Tried again after HTTP_CACHE_PRUNE_INTERVAL even if the database was locked, it can wait
+        self.write("DELETE FROM responses WHERE expires < ?", (time.time() - cogs.shared.HTTP_CACHE_KEEP_STALE,))
+        self.last_prune = time.time()
+
+    async def close(self):
+        if self.session is not None:
+            await self.session.close()
+        self.db.close()
+
+
+def get_http_cache(bot) -> HTTPCache:
+    """Returns the bot's shared HTTP cache, creating it on first use"""
+    if not hasattr(bot, "http_cache"):
+        bot.http_cache = HTTPCache()
+    return bot.http_cache
@@ -0,0 +1,105 @@
+"""
+This module contains the name matching used by the popularity check to pick a Spotify track for a spin
+
+Names are simplified with precompiled patterns, and both simplified names and similarity scores are memoized,
+since the same artists come up over and over. Candidates are scored with difflib's SequenceMatcher, exactly as before,
+but a candidate whose upper bound (the same bound as SequenceMatcher's quick_ratio) can't beat the best candidate so far is skipped
+without computing its full ratio. The candidate picked, and so every accept/reject decision, is unchanged.
+"""
+from collections import Counter
+from difflib import SequenceMatcher
+from functools import lru_cache
+import re
+import unicodedata
+
+import cogs.shared
+
+
+BRACKETED_PATTERN = re.compile(r'[\[\(].+[\]\)]')
+AFTER_DASH_PATTERN = re.compile(r' - .+$')
+AFTER_AMPERSAND_PATTERN = re.compile(r' & .+$')
+AFTER_COMMA_PATTERN = re.compile(r', .+$')
+FEATURE_PATTERN = re.compile(r'feat\. .+$')
+NON_ALPHANUMERIC_PATTERN = re.compile(r'[^a-z0-9 ]')
+
+
+@lru_cache(maxsize=8192)
+def simplify_string(in_string, remove_bracketed_and_dash=False, remove_listed=False, remove_spaces=True):
+    """Utility function to simplify artist or song names to only essential components, for compatibility and comparison"""
+    simplified_string = in_string
+    simplified_string = unicodedata.normalize("NFKD", simplified_string) # Normalize
+    simplified_string = simplified_string.encode('ascii', 'ignore').decode('ascii') # Filter to only ASCII characters
+    simplified_string = simplified_string.lower() # Lowercase
+    if remove_bracketed_and_dash:
+        simplified_string = BRACKETED_PATTERN.sub('', simplified_string) # Remove bracketed text
+        simplified_string = AFTER_DASH_PATTERN.sub('', simplified_string) # Remove text after dash
+    if remove_listed:
+        simplified_string = AFTER_AMPERSAND_PATTERN.sub('', simplified_string) # Remove text after an ambersand
+        simplified_string = AFTER_COMMA_PATTERN.sub('', simplified_string) # Remove text after a comma
+    simplified_string = FEATURE_PATTERN.sub('', simplified_string) # Remove feature text
+    simplified_string = NON_ALPHANUMERIC_PATTERN.sub('', simplified_string) # Remove non-alphanumeric
+    if remove_spaces:
+        simplified_string = simplified_string.replace(' ', '') # Remove spaces
+    return simplified_string
+
+def simplify_artist(name: str) -> str:
+    return simplify_string(name, remove_bracketed_and_dash=True, remove_listed=True)
+
+def simplify_track(name: str) -> str:
+    return simplify_string(name, remove_bracketed_and_dash=True)
+
+
+@lru_cache(maxsize=16384)
+def similarity(a: str, b: str) -> float:
+    """SequenceMatcher ratio of two strings (note that it is not symmetric, a is always the Spinitron side)"""
+    return SequenceMatcher(None, a, b).ratio()
+
+@lru_cache(maxsize=8192)
+def character_counts(text: str) -> Counter:
+    return Counter(text)
+
+@lru_cache(maxsize=16384)
+def similarity_upper_bound(a: str, b: str) -> float:
+    """A cheap upper bound on similarity(a, b), the same as SequenceMatcher's quick_ratio but without building a matcher"""
+    length = len(a) + len(b)
+    if not length:
+        return 1.0
+    a_counts, b_counts = character_counts(a), character_counts(b)
+    matches = sum(min(count, b_counts[character]) for character, count in a_counts.items() if character in b_counts)
+    return 2.0 * matches / length
+
+
+def pick_candidate(spinitron_artist: str, spinitron_track: str, candidates: list) -> tuple:
+    """Picks the Spotify track most similar to a spin, by the sum of artist and track name similarity
+    Args:
+        spinitron_artist (str): The spin's artist, already simplified with simplify_artist
+        spinitron_track (str): The spin's song, already simplified with simplify_track
+        candidates (list): Track objects from a Spotify search
+    Returns:
+        tuple: (index of the strongest candidate, its artist similarity, its track similarity). Ties go to the earliest
+            candidate, and (0, 0.0, 0.0) is returned if no candidate is similar at all
+    """
+    simplified = [(simplify_artist(candidate['artists'][0]['name']), simplify_track(candidate['name'])) for candidate in candidates]
+    bounds = [similarity_upper_bound(spinitron_artist, artist) + similarity_upper_bound(spinitron_track, track) for artist, track in simplified]
+
+    # Score the most promising candidates first, so that the rest can usually be ruled out by their bound alone
+    strongest_candidate = (0, 0.0, 0.0)
+    strongest_sum = 0.0
+    for i in sorted(range(len(candidates)), key=lambda i: (-bounds[i], i)):
+        if bounds[i] < strongest_sum:
+            break
+        if bounds[i] == strongest_sum and i > strongest_candidate[0]:
+            continue
+        artist_similarity = similarity(spinitron_artist, simplified[i][0])
+        track_similarity = similarity(spinitron_track, simplified[i][1])
+        candidate_sum = artist_similarity + track_similarity
+        # Ties go to the earlier candidate, as they did when candidates were scored in order
+        if candidate_sum > strongest_sum or (candidate_sum == strongest_sum and i < strongest_candidate[0]):
+            strongest_candidate = (i, artist_similarity, track_similarity)
+            strongest_sum = candidate_sum
+    return strongest_candidate
+
+def is_match(artist_similarity: float, track_similarity: float) -> bool:
+    """Whether a candidate is similar enough to be accepted: one name must be a close match and the other at least a loose one"""
+    return ((artist_similarity > cogs.shared.NAME_SIMILARITY_UPPER_MINIMUM and track_similarity > cogs.shared.NAME_SIMILARITY_LOWER_MINIMUM) or
+            (artist_similarity > cogs.shared.NAME_SIMILARITY_LOWER_MINIMUM and track_similarity > cogs.shared.NAME_SIMILARITY_UPPER_MINIMUM))
@@ -11,9 +11,9 @@ from discord import Embed, app_commands, AllowedMentions
 from discord.ext import commands
 from importlib import reload
 import random
-import requests as r
 import time
 
+import cogs.http_cache
 import cogs.shared
 
 
@@ -165,6 +165,7 @@ class Misc(commands.Cog):
     """Miscellaneous commands"""
     def __init__(self, bot):
         self.bot = bot
+        self.http_cache = cogs.http_cache.get_http_cache(bot)
         bot.help_command = MyHelpCommand()
         #self.help_command.cog = self
 
@@ -230,13 +231,13 @@ class Misc(commands.Cog):
                 starting_date = date.today()
             
 
-            embed = self.sports_schedule_month(starting_date)
+            embed = await self.sports_schedule_month(starting_date)
             if embed:
                 await ctx.send(embed = embed)
             else:
                 await ctx.send("I wasn't able to find any sports {} month. It's possible that this is an issue on my end, so please double check on the calendar! https://calendar.google.com/calendar/embed?src=usduo697rg31jshu4h4nn38obk%40group.calendar.google.com&ctz=America%2FNew_York".format("that" if month else "this"))
 
-    def sports_schedule_month(self, starting_date: date):        
+    async def sports_schedule_month(self, starting_date: date):
         WBB_calendar_ics_url = "https://gopack.com/api/v2/Calendar/subscribe?type=ics&sportId=14&scheduleId=714"
         MBB_calendar_ics_url = "https://gopack.com/api/v2/Calendar/subscribe?type=ics&sportId=1&scheduleId=724"
         WKNC_google_calendar_url = "https://calendar.google.com/calendar/embed?src=usduo697rg31jshu4h4nn38obk%40group.calendar.google.com&ctz=America%2FNew_York"
@@ -248,12 +249,14 @@ class Misc(commands.Cog):
         else:
             ending_date = date(starting_date.year, starting_date.month + 1, 1)
 
-        # Get Women's BasketBall and Men's BaseBall calendar files
-        response_WBB = r.get(WBB_calendar_ics_url, headers={"Accept": "text/calendar", "User-Agent": "WKNCdjbot (https://github.com/elijahwe/wknc-bot)", "Referer": "https://gopack.com/sports/womens-basketball/schedule"})
-        response_MBB = r.get(MBB_calendar_ics_url, headers={"Accept": "text/calendar", "User-Agent": "WKNCdjbot (https://github.com/elijahwe/wknc-bot)", "Referer": "https://gopack.com/sports/baseball/schedule"})
+        # Get Women's BasketBall and Men's BaseBall calendar files (at once, through the HTTP cache)
+        (status_WBB, body_WBB), (status_MBB, body_MBB) = await asyncio.gather(
+            self.http_cache.get(WBB_calendar_ics_url, headers={"Accept": "text/calendar", "User-Agent": "WKNCdjbot (https://github.com/elijahwe/wknc-bot)", "Referer": "https://gopack.com/sports/womens-basketball/schedule"}),
+            self.http_cache.get(MBB_calendar_ics_url, headers={"Accept": "text/calendar", "User-Agent": "WKNCdjbot (https://github.com/elijahwe/wknc-bot)", "Referer": "https://gopack.com/sports/baseball/schedule"}),
+        )
         
         # Handle request issues
-        if response_WBB.status_code != 200 or response_MBB.status_code != 200:
+        if status_WBB != 200 or status_MBB != 200:
             return Embed(description=f"Sorry, I wasn't able to retrieve that information from the server. For now, please refer to the [WKNC Calendar]({WKNC_google_calendar_url})")
 
         # Generate list of games within the time bounds
@@ -263,9 +266,9 @@ class Misc(commands.Cog):
             # Repeat for each sport, choose appropriate file text
             response_text = ""
             if sport == "WBB":
-                response_text = response_WBB.text
+                response_text = body_WBB.decode("utf-8", errors="replace")
             elif sport == "MBB":
-                response_text = response_MBB.text
+                response_text = body_MBB.decode("utf-8", errors="replace")
             
             for line in response_text.splitlines():
                 # Find each line containing a starting time datetime for a game
@@ -351,6 +354,51 @@ class Misc(commands.Cog):
         await ctx.send(f"Discord py version {discord.__version__}")
         await ctx.send(f"Current system time: {datetime.now()}")
 
+    @commands.command(name="cachestats", hidden=True)
+    async def cache_stats(self, ctx: commands.Context):
+        """Hidden command - Hit and miss counts of the shared caches and request coalescing"""
+        counters = []
+        spinitron = getattr(self.bot, "spinitron_client", None)
+        if spinitron:
+            counters.append(("Spinitron requests coalesced", spinitron.requests))
+            counters.append(("Persona cache", spinitron.personas))
+            counters.append(("Playlist DJ cache", spinitron.playlist_personas))
+        album_art = getattr(self.bot, "album_art_resolver", None)
+        if album_art:
+            counters.append(("Discogs searches coalesced", album_art.searches))
+        http_cache = getattr(self.bot, "http_cache", None)
+        if http_cache:
+            counters.append(("HTTP cache", http_cache))
+
+        if not counters:
+            await ctx.send("Nothing has been cached yet")
+            return
+        lines = []
+        for name, counter in counters:
+            total = counter.hits + counter.misses
+            rate = f"{counter.hits / total:.0%}" if total else "n/a"
+            lines.append(f"{name}: {counter.hits} hits, {counter.misses} misses ({rate})")
+        if http_cache:
+            lines.append(f"HTTP cache revalidations (304s): {http_cache.revalidated}")
+        await ctx.send("\n".join(lines))
+
+
+    @commands.command(name="ratelimits", hidden=True)
+    async def rate_limits(self, ctx: commands.Context):
+        """Hidden command - Current rate and queue depth of each upstream rate limiter"""
+        limiters = getattr(self.bot, "rate_limiters", {})
+        if not limiters:
+            await ctx.send("No rate limiters in use yet")
+            return
+        lines = []
+        for limiter in limiters.values():
+            depth = limiter.queue_depth()
+            lines.append(
+                f"{limiter.name}: {limiter.rate:.1f}/{limiter.max_rate:.1f} per second, "
+                f"{depth['interactive']} interactive and {depth['background']} background queued, {limiter.rate_limited_count} 429s"
+            )
+        await ctx.send("\n".join(lines))
+
 
 async def setup(bot):
     await bot.add_cog(Misc(bot))
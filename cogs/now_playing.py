@@ -0,0 +1,216 @@
+"""
+This module contains the shared now playing poller, which keeps an in-memory snapshot of what is on air on each channel
+
+Commands and tasks read the snapshot instead of querying Spinitron themselves, so upstream load stays the same
+no matter how often they are used.
+
+Spins are polled every time, but the current show and playlist only change at boundaries. The show is looked up in
+the schedule index, and the playlist is only fetched again around its scheduled end, when a spin from another playlist
+shows up, or after NOW_PLAYING_PLAYLIST_MAX_AGE.
+"""
+import asyncio
+from datetime import datetime
+from dateutil import tz
+from discord.ext import tasks
+import logging
+import time
+
+import cogs.rate_limit
+import cogs.schedule
+import cogs.shared
+import cogs.spinitron
+import cogs.timeutil
+
+
+class NowPlayingSnapshot:
+    """What was on air on a channel as of one poll"""
+    def __init__(self, spins: list, playlist: dict, show: dict, playlist_djs: dict, playlist_fetched: float = None):
+        self.spins = spins # The most recent spins, newest first
+        self.playlist = playlist # The current playlist
+        self.show = show # The current scheduled show
+        self.playlist_djs = playlist_djs # playlist ID -> (persona ID, DJ name), for the current playlist and every playlist in spins
+        self.created = time.monotonic()
+        self.playlist_fetched = playlist_fetched if playlist_fetched is not None else self.created # When the playlist was last fetched (monotonic)
+
+    def age(self) -> float:
+        """Seconds since this snapshot was taken"""
+        return time.monotonic() - self.created
+
+    def dj(self) -> tuple:
+        """(persona ID, DJ name) of the current playlist, or None if there is no current playlist"""
+        if not self.playlist:
+            return None
+        return self.playlist_djs.get(self.playlist["id"])
+
+
+def diff_snapshots(old: NowPlayingSnapshot, new: NowPlayingSnapshot) -> dict:
+    """Returns what changed between two snapshots of the same channel
+    Args:
+        old (NowPlayingSnapshot): The previous snapshot, or None if this is the first one
+        new (NowPlayingSnapshot): The new snapshot
+    Returns:
+        dict: 'new_spins' - list of spins not in the old snapshot (newest first),
+            'playlist_changed' and 'show_changed' - bools
+    """
+    old_spin_ids = {spin["id"] for spin in old.spins} if old else set()
+    return {
+        "new_spins": [spin for spin in new.spins if spin["id"] not in old_spin_ids],
+        "playlist_changed": old is None or old.playlist.get("id") != new.playlist.get("id"),
+        "show_changed": old is None or old.show.get("id") != new.show.get("id") or old.show.get("start") != new.show.get("start"),
+    }
+
+
+def playlist_due(old: NowPlayingSnapshot, spins: list, show: dict, now: datetime) -> bool:
+    """Returns whether the current playlist should be fetched again, rather than carried over from the old snapshot
+    Args:
+        old (NowPlayingSnapshot): The previous snapshot, or None if this is the first one
+        spins (list): The spins just polled, newest first
+        show (dict): The show on air now
+        now (datetime): The current time
+    """
+    if old is None or not old.playlist:
+        return True
+    if time.monotonic() - old.playlist_fetched > cogs.shared.NOW_PLAYING_PLAYLIST_MAX_AGE:
+        return True
+    # A new spin from another playlist means a new playlist has started
+    old_spin_ids = {spin["id"] for spin in old.spins}
+    if any(spin["playlist_id"] != old.playlist["id"] for spin in spins if spin["id"] not in old_spin_ids):
+        return True
+    # So does a new show, usually
+    if old.show.get("id") != show.get("id") or old.show.get("start") != show.get("start"):
+        return True
+    # Keep checking for a while after the playlist was meant to end, until the next one shows up
+    if old.playlist.get("end"):
+        since_end = (now - cogs.timeutil.parse_spinitron_time(old.playlist["end"])).total_seconds()
+        if 0 <= since_end <= cogs.shared.NOW_PLAYING_BOUNDARY_WINDOW:
+            return True
+    return False
+
+
+class NowPlayingPoller:
+    """Polls Spinitron for the latest spins, playlist and show of every channel, and keeps the results in memory"""
+    def __init__(self, bot):
+        self.bot = bot
+        self.spinitron = cogs.spinitron.get_client(bot)
+        self.schedule_index = cogs.schedule.get_schedule_index(bot)
+        self.snapshots = {}
+        self.locks = {channel_num: asyncio.Lock() for channel_num in cogs.shared.HEADERS_HDX}
+        self.listeners = []
+        self.listener_tasks = set() # Running listener calls, kept so they aren't garbage collected mid-run
+        self.poll.start()
+
+    def add_listener(self, callback):
+        """Registers a coroutine function to be called as callback(channel_num, snapshot, changes) whenever a poll finds changes
+        Each call runs in its own task, so a slow listener holds up neither the poll nor the other listeners
+        Cogs should remove their listeners in cog_unload, otherwise a reloaded cog would be notified twice
+        """
+        if callback not in self.listeners:
+            self.listeners.append(callback)
+
+    def remove_listener(self, callback):
+        if callback in self.listeners:
+            self.listeners.remove(callback)
+
+    async def get_show(self, channel_num: int, now: datetime) -> dict:
+        """Returns the show on air, from the schedule index if it has one there, otherwise from Spinitron"""
+        try:
+            scheduled_show = await self.schedule_index.show_at(channel_num, now)
+        except Exception as e:
+            logging.error(e)
+            scheduled_show = None
+        if scheduled_show is not None:
+            return scheduled_show.show
+        shows = await self.spinitron.get_items(channel_num, "shows", count=1)
+        return shows[0] if shows else {}
+
+    async def refresh(self, channel_num: int, max_age: float = None, fetch_playlist: bool = False) -> NowPlayingSnapshot:
+        """Polls Spinitron for a channel and stores the new snapshot
+        Args:
+            channel_num (int): An int representing a WKNC channel: 1 for HD-1, 2 for HD-2
+            max_age (float): If given, skip the poll when the current snapshot is at most this many seconds old
+            fetch_playlist (bool): Fetch the current playlist even if it isn't due (see playlist_due)
+        Returns:
+            NowPlayingSnapshot: The channel's snapshot
+        """
+        async with self.locks[channel_num]:
+            old = self.snapshots.get(channel_num)
+            # Someone else may have refreshed while we were waiting for the lock
+            if max_age is not None and old is not None and old.age() <= max_age:
+                return old
+
+            now = datetime.now(tz.UTC)
+            spins, show = await asyncio.gather(
+                self.spinitron.get_items(channel_num, "spins", count=cogs.shared.NOW_PLAYING_SPIN_COUNT),
+                self.get_show(channel_num, now),
+            )
+            if fetch_playlist or playlist_due(old, spins, show, now):
+                # The playlist is only fetched when it's likely to have changed, so don't settle for a cached response
+                playlists = await self.spinitron.get_items(channel_num, "playlists", max_age=0, count=1)
+                playlist = playlists[0] if playlists else {}
+                playlist_fetched = time.monotonic()
+            else:
+                playlist, playlist_fetched = old.playlist, old.playlist_fetched
+
+            # The current playlist already says who its DJ is, so seed the resolver rather than fetching it again
+            playlist_ids = [spin["playlist_id"] for spin in spins]
+            if playlist:
+                self.spinitron.playlist_personas.set((channel_num, str(playlist["id"])), playlist["persona_id"])
+                playlist_ids.append(playlist["id"])
+            playlist_djs = await self.spinitron.resolve_playlist_djs(channel_num, playlist_ids)
+
+            new = NowPlayingSnapshot(spins, playlist, show, playlist_djs, playlist_fetched)
+            self.snapshots[channel_num] = new
+
+        changes = diff_snapshots(old, new)
+        if changes["new_spins"] or changes["playlist_changed"] or changes["show_changed"]:
+            for callback in list(self.listeners):
+                task = asyncio.create_task(self.run_listener(callback, channel_num, new, changes))
+                self.listener_tasks.add(task)
+                task.add_done_callback(self.listener_tasks.discard)
+
+        return new
+
+    async def run_listener(self, callback, channel_num: int, snapshot: NowPlayingSnapshot, changes: dict):
+        try:
+            await callback(channel_num, snapshot, changes)
+        except Exception as e:
+            logging.error(e)
+            print("Error in now playing listener:")
+            print(e)
+
+    async def get_snapshot(self, channel_num: int) -> NowPlayingSnapshot:
+        """Returns the channel's snapshot, only polling if there is none yet or it has gone stale (e.g. the poller is stopped)"""
+        snapshot = self.snapshots.get(channel_num)
+        if snapshot is None or snapshot.age() > cogs.shared.NOW_PLAYING_MAX_AGE:
+            snapshot = await self.refresh(channel_num, max_age=cogs.shared.NOW_PLAYING_MAX_AGE)
+        return snapshot
+
+    @tasks.loop(seconds=cogs.shared.NOW_PLAYING_POLL_INTERVAL)
+    async def poll(self):
+        with cogs.rate_limit.background_priority():
+            await asyncio.gather(*(self.poll_channel(channel_num) for channel_num in cogs.shared.HEADERS_HDX))
+
+    async def poll_channel(self, channel_num: int):
+        try:
+            await self.refresh(channel_num)
+        except Exception as e:
+            # Keep serving the previous snapshot, it'll be replaced on the next successful poll
+            logging.error(e)
+            print(f"Error while polling now playing on HD-{channel_num}:")
+            print(e)
+
+    @poll.before_loop
+    async def before_poll(self):
+        await self.bot.wait_until_ready()
+
+    def close(self):
+        self.poll.cancel()
+        for task in self.listener_tasks:
+            task.cancel()
+
+
+def get_poller(bot) -> NowPlayingPoller:
+    """Returns the bot's shared now playing poller, creating (and starting) it on first use"""
+    if not hasattr(bot, "now_playing_poller"):
+        bot.now_playing_poller = NowPlayingPoller(bot)
+    return bot.now_playing_poller
@@ -0,0 +1,72 @@
+"""
+This module contains helpers for responses that don't fit in one embed: splitting text into pages, and a view
+with buttons to flip through the resulting embeds
+"""
+import discord
+import discord.ui
+
+import cogs.shared
+
+
+def split_into_pages(header: str, lines: list, limit: int) -> list:
+    """Joins lines into as few strings as possible, each starting with header and no longer than limit
+    Args:
+        header (str): Text to start every page with
+        lines (list): Strings to split across the pages, in order
+        limit (int): Max number of characters in a page
+    Returns:
+        list: The page strings
+    """
+    pages = []
+    current_page = header
+    for line in lines:
+        if len(current_page) + len(line) > limit and current_page != header:
+            pages.append(current_page)
+            current_page = header
+        current_page += line
+    pages.append(current_page)
+    return pages
+
+
+class EmbedPages(discord.ui.View):
+    """View for a response that takes more than one embed (implements buttons)"""
+    def __init__(self, embeds):
+        super().__init__()
+        self.embeds = embeds
+        self.page = 0
+        self.timeout = cogs.shared.BUTTON_TIMEOUT
+        self.message = None
+
+    # On timeout - disable buttons
+    async def on_timeout(self) -> None:
+        for button in self.children:
+            button.disabled = True
+        if self.message:
+            await self.message.edit(view=self)
+
+    # Back button
+    @discord.ui.button(label='<', disabled = True)
+    async def down_page(self, interaction: discord.Interaction, button: discord.ui.Button):
+        if self.page > 0:
+            self.page -= 1
+        button.disabled = self.page <= 0
+        self.children[1].disabled = False
+        await interaction.response.edit_message(embed=self.embeds[self.page], view=self)
+
+    # Forward button
+    @discord.ui.button(label='>')
+    async def up_page(self, interaction: discord.Interaction, button: discord.ui.Button):
+        if self.page < len(self.embeds) - 1:
+            self.page += 1
+        button.disabled = self.page >= len(self.embeds) - 1
+        self.children[0].disabled = False
+        await interaction.response.edit_message(embed=self.embeds[self.page], view=self)
+
+
+async def send_pages(ctx, embeds: list):
+    """Sends the first of one or more embeds, with buttons for the rest if there are more"""
+    if len(embeds) == 1:
+        await ctx.send(embed=embeds[0])
+    else:
+        view = EmbedPages(embeds)
+        view.message = await ctx.send(embed=embeds[0], view=view)
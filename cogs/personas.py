@@ -0,0 +1,153 @@
+"""
+This module contains the persona directory, a periodically synced local copy of every Spinitron persona (DJ) on each channel
+
+Names are indexed both exactly (after normalizing away case, punctuation and any leading "DJ ") and by trigram,
+so that a lookup by DJ name takes one in-memory step and a typo can still be answered with suggestions.
+"""
+import asyncio
+from collections import Counter
+from discord.ext import tasks
+import logging
+import re
+import unicodedata
+
+import cogs.rate_limit
+import cogs.shared
+import cogs.spinitron
+
+
+def normalize_name(name: str) -> str:
+    """Simplifies a DJ name for comparison, so that e.g. 'DJ Café-Bar' and 'cafe bar' are equal"""
+    name = unicodedata.normalize("NFKD", name).encode("ascii", "ignore").decode("ascii").lower()
+    name = re.sub(r"[^a-z0-9]+", " ", name).strip()
+    # WKNC DJ names do not follow a consistent naming scheme. Some include "DJ " at the beginning and others do not
+    if name.startswith("dj "):
+        name = name[3:]
+    return name
+
+def trigrams(normalized_name: str) -> set:
+    """Returns the set of three character sequences in a normalized name (padded, so short names still have some)"""
+    padded = f"  {normalized_name} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class ChannelPersonaDirectory:
+    """The persona directory of a single channel"""
+    def __init__(self, personas: list):
+        self.personas = {}
+        self.by_name = {} # normalized name -> list of persona IDs
+        self.by_trigram = {} # trigram -> set of persona IDs
+        for persona in personas:
+            self.add(persona)
+
+    def add(self, persona: dict):
+        if persona["id"] in self.personas:
+            return
+        self.personas[persona["id"]] = persona
+        normalized_name = normalize_name(persona["name"])
+        self.by_name.setdefault(normalized_name, []).append(persona["id"])
+        for trigram in trigrams(normalized_name):
+            self.by_trigram.setdefault(trigram, set()).add(persona["id"])
+
+    def find(self, name: str) -> dict:
+        """Returns the persona with exactly this name (after normalizing), or None"""
+        persona_ids = self.by_name.get(normalize_name(name))
+        if not persona_ids:
+            return None
+        # If several personas share a name, the most recently created one is most likely the one meant
+        return self.personas[max(persona_ids)]
+
+    def suggest(self, name: str, limit: int = None) -> list:
+        """Returns the personas with names most similar to name (by trigram similarity), most similar first"""
+        query_trigrams = trigrams(normalize_name(name))
+        shared_counts = Counter()
+        for trigram in query_trigrams:
+            shared_counts.update(self.by_trigram.get(trigram, ()))
+
+        scored = []
+        for persona_id, shared in shared_counts.items():
+            candidate_trigram_count = len(trigrams(normalize_name(self.personas[persona_id]["name"])))
+            similarity = shared / (len(query_trigrams) + candidate_trigram_count - shared)
+            if similarity >= cogs.shared.PERSONA_SUGGESTION_MIN_SIMILARITY:
+                scored.append((similarity, persona_id))
+        scored.sort(reverse=True)
+        return [self.personas[persona_id] for _, persona_id in scored[:limit or cogs.shared.PERSONA_SUGGESTION_COUNT]]
+
+
+class PersonaDirectory:
+    """Keeps the persona directory of every channel in sync with Spinitron"""
+    def __init__(self, bot):
+        self.bot = bot
+        self.spinitron = cogs.spinitron.get_client(bot)
+        self.channels = {}
+        self.locks = {channel_num: asyncio.Lock() for channel_num in cogs.shared.HEADERS_HDX}
+        self.sync_all.start()
+
+    async def sync(self, channel_num: int) -> ChannelPersonaDirectory:
+        async with self.locks[channel_num]:
+            personas = await self.spinitron.get_all_items(channel_num, "personas", count=200)
+            directory = ChannelPersonaDirectory(personas)
+            self.channels[channel_num] = directory
+            # The persona cache might as well benefit from the download too
+            for persona in personas:
+                self.spinitron.personas.set((channel_num, str(persona["id"])), persona)
+            return directory
+
+    async def get(self, channel_num: int) -> ChannelPersonaDirectory:
+        directory = self.channels.get(channel_num)
+        if directory is None:
+            directory = await self.sync(channel_num)
+        return directory
+
+    async def lookup(self, channel_num: int, name: str) -> tuple:
+        """Finds a persona by DJ name
+        Args:
+            channel_num (int): An int representing a WKNC channel: 1 for HD-1, 2 for HD-2
+            name (str): The DJ name, with or without a leading "DJ "
+        Returns:
+            tuple: (the persona or None, list of suggested personas if it was not found)
+        """
+        directory = await self.get(channel_num)
+        persona = directory.find(name)
+        if persona:
+            return persona, []
+
+        # The persona may have been created since the last sync (e.g. a new DJ binding right away), so ask Spinitron once
+        for persona in await self.spinitron.get_items(channel_num, "personas", name=name):
+            directory.add(persona)
+        persona = directory.find(name)
+        if persona:
+            return persona, []
+        return None, directory.suggest(name)
+
+    @tasks.loop(hours=cogs.shared.PERSONA_DIRECTORY_SYNC_HOURS)
+    async def sync_all(self):
+        for channel_num in cogs.shared.HEADERS_HDX:
+            try:
+                with cogs.rate_limit.background_priority():
+                    await self.sync(channel_num)
+            except Exception as e:
+                logging.error(e)
+                print(f"Error while syncing the persona directory for HD-{channel_num}:")
+                print(e)
+
+    @sync_all.before_loop
+    async def before_sync_all(self):
+        await self.bot.wait_until_ready()
+
+    def close(self):
+        self.sync_all.cancel()
+
+
+def format_suggestions(suggestions: list) -> str:
+    """Returns a ' Did you mean ...?' sentence for a list of suggested personas, or an empty string if there are none"""
+    if not suggestions:
+        return ""
+    return " Did you mean {}?".format(", ".join(f"**{persona['name']}**" for persona in suggestions))
+
+
+def get_persona_directory(bot) -> PersonaDirectory:
+    """Returns the bot's shared persona directory, creating (and starting its sync job) on first use"""
+    if not hasattr(bot, "persona_directory"):
+        bot.persona_directory = PersonaDirectory(bot)
+    return bot.persona_directory
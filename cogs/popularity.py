@@ -0,0 +1,641 @@
+"""
+This module contains the popularity engine, which scores HD-1 sets by the Spotify popularity of their tracks and artists
+
+Scoring doesn't depend on Discord: the Tasks_Events cog uses the engine for its live check of each set that ends,
+and backfill() uses it to check any range of past sets from worker processes, either through the CLI
+(popularity_cli.py) or the !popularitybackfill admin command. Every set checked is stored in the results database,
+track by track, so that when the thresholds change, past sets can be re-scored (rescore()) without going back to
+Spinitron or Spotify.
+"""
+import asyncio
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+import datetime
+import functools
+import multiprocessing
+import os
+import spotipy
+from spotipy.exceptions import SpotifyException
+from spotipy.oauth2 import SpotifyClientCredentials
+import sqlite3
+import sys
+import threading
+import time
+
+import cogs.cache
+import cogs.http_cache
+import cogs.matching
+import cogs.rate_limit
+import cogs.shared
+import cogs.spinitron
+import cogs.spotify_cache
+import cogs.timeutil
+
+
+# Track outcomes, on top of the cogs.spotify_cache resolution outcomes
+ERROR = "error" # Checking the track failed
+
+CLI_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "popularity_cli.py")
+
+
+def resolution_key(spin: dict) -> str:
+    """Returns the Spotify cache key for a spin: its ISRC if it has one, otherwise its simplified artist and song"""
+    if spin['isrc']:
+        return f"isrc:{spin['isrc'].upper()}"
+    return "name:{}|{}".format(cogs.matching.simplify_string(spin['artist']), cogs.matching.simplify_string(spin['song']))
+
+def new_spotify_client() -> spotipy.Spotify:
+    spotify_auth_manager = SpotifyClientCredentials(client_id=cogs.shared.SPOTIFY_CLIENT_ID, client_secret=cogs.shared.SPOTIFY_CLIENT_SECRET)
+    spotify_client = spotipy.Spotify(auth_manager=spotify_auth_manager)
+    spotify_client.prefix = cogs.shared.SPOTIFY_API_URL
+    return spotify_client
+
+
+def playlist_summary(playlist: dict) -> dict:
+    """Takes a playlist from the Spinitron API and returns the parts of it that are stored with its results"""
+    return {
+        "id": playlist['id'],
+        "persona_id": playlist['persona_id'],
+        "title": playlist['title'],
+        "category": playlist['category'],
+        "start": playlist['start'],
+        "end": playlist['end'],
+    }
+
+def exemption(playlist: dict) -> str:
+    """Returns why a set is exempt from the popularity check, or None if it isn't"""
+    # Zetta sets
+    if playlist['persona_id'] in cogs.shared.POPULARITY_CHECK_EXCEPTION_SPINITRON_IDS:
+        return "excepted playlist"
+
+    # Sets between midnight and 2am on Friday (Bad Music Hour exception)
+    playlist_start_datetime = cogs.timeutil.to_local(playlist['start']).replace(tzinfo=None)
+    playlist_end_datetime = cogs.timeutil.to_local(playlist['end']).replace(tzinfo=None)
+    if (playlist_end_datetime.weekday() == 4 #Friday
+        and playlist_start_datetime.time() < datetime.time(1, 0) #Starting before 1am
+        and playlist_end_datetime.time() < datetime.time(2, 0) #Ending before 2am
+        ):
+        return "bad music hour"
+    return None
+
+def thresholds_for(category: str) -> tuple:
+    """Returns (average artist popularity threshold, track popularity threshold) for a genre block"""
+    if category in cogs.shared.AVERAGE_ARTIST_POPULARITY_THRESHOLDS:
+        average_artist_popularity_threshold = cogs.shared.AVERAGE_ARTIST_POPULARITY_THRESHOLDS[category]
+    else:
+        average_artist_popularity_threshold = cogs.shared.AVERAGE_ARTIST_POPULARITY_THRESHOLDS["Default"]
+    if category in cogs.shared.TRACK_POPULARITY_THRESHOLDS:
+        track_popularity_threshold = cogs.shared.TRACK_POPULARITY_THRESHOLDS[category]
+    else:
+        track_popularity_threshold = cogs.shared.TRACK_POPULARITY_THRESHOLDS['Default']
+    return average_artist_popularity_threshold, track_popularity_threshold
+
+def score_tracks(category: str, tracks: list) -> dict:
+    """Scores a set's tracks against the current thresholds for its genre block
+    Args:
+        category (str): The set's genre block
+        tracks (list): The set's track results (see PopularityEngine.evaluate)
+    Returns:
+        dict: Average artist and track popularity (-1 if no track was matched), the thresholds, which of them were passed,
+            and 'flagged'
+    """
+    artist_threshold, track_threshold = thresholds_for(category)
+    matched = [track for track in tracks if track['status'] == cogs.spotify_cache.MATCHED]
+    if matched:
+        average_artist_popularity = sum(track['artist_popularity'] for track in matched) / len(matched)
+        average_track_popularity = sum(track['track_popularity'] for track in matched) / len(matched)
+    else:
+        average_artist_popularity = average_track_popularity = -1
+    artist_threshold_passed = average_artist_popularity > artist_threshold
+    track_threshold_passed = any(track['track_popularity'] > track_threshold for track in matched)
+    return {
+        "average_artist_popularity": average_artist_popularity,
+        "average_track_popularity": average_track_popularity,
+        "artist_threshold": artist_threshold,
+        "track_threshold": track_threshold,
+        "artist_threshold_passed": artist_threshold_passed,
+        "track_threshold_passed": track_threshold_passed,
+        "flagged": artist_threshold_passed or track_threshold_passed,
+    }
+
+def flag_message(result: dict, dj_name: str) -> str:
+    """Returns the message sent for a flagged set
+    Args:
+        result (dict): The set's result (see PopularityEngine.evaluate)
+        dj_name (str): The name of the set's DJ
+    """
+    playlist = result['playlist']
+    score = result['score']
+
+    track_flag_message = ""
+    for track in result['tracks']:
+        if track['status'] == ERROR:
+            track_flag_message = "   - [Error while checking track]\n" + track_flag_message
+        elif track['status'] == cogs.spotify_cache.NO_MATCH:
+            track_flag_message = f"   - {track['artist']} - {track['song']} [could not find spotify track]\n" + track_flag_message
+        elif track['status'] == cogs.spotify_cache.MATCHED:
+            bolding = "**" if track['track_popularity'] > score['track_threshold'] else ""
+            track_flag_message = f"   - {bolding}[{track['artist']}]({track['artist_url']}) (`{track['artist_popularity']}`) - [{track['song']}]({track['track_url']}) (`{track['track_popularity']}`){bolding}\n" + track_flag_message
+
+    artist_flag_message = ""
+    if score['artist_threshold_passed']:
+        artist_flag_message += f"- Detected an average artist popularity across the set of `{score['average_artist_popularity']:.1f}`, passing the popularity threshold of `{score['artist_threshold']:.0f}` for the genre block \"{playlist['category']}\"\n"
+
+    track_flag_message = f"- Any tracks below that are **bolded** passed the track popularity threshold of `{score['track_threshold']}` for the genre block \"{playlist['category']}\":\n" + track_flag_message
+    track_flag_message += f"Average track popularity across set: `{score['average_track_popularity']:.1f}`"
+
+    flag_message = f"The playlist [{playlist['title']}](https://spinitron.com/WKNC/pl/{playlist['id']}) by [{dj_name}](https://spinitron.com/dj/{playlist['persona_id']}) has been flagged for the following reasons:\n"
+    return flag_message + artist_flag_message + track_flag_message
+
+
+class PopularityEngine:
+    """Checks sets against the popularity thresholds, resolving their spins to Spotify tracks through the Spotify cache
+    spotipy is blocking, so every Spotify call runs in the engine's worker threads, each with its own client (spotipy
+    clients, and the token refresh in their auth managers, aren't safe to share between threads)
+    """
+    def __init__(self, spinitron: cogs.spinitron.SpinitronClient, spotify_cache: cogs.spotify_cache.SpotifyCache, spotify_limiter: cogs.rate_limit.RateLimiter, workers: int = None):
+        self.spinitron = spinitron
+        self.spotify_cache = spotify_cache
+        self.spotify_limiter = spotify_limiter
+        self.spotify_client_factory = new_spotify_client
+        self.spotify_clients = threading.local()
+        workers = workers or cogs.shared.POPULARITY_CHECK_WORKERS
+        self.spotify_workers = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="spotify")
+        self.spotify_slots = asyncio.Semaphore(workers)
+        self.resolutions = cogs.cache.SingleFlight()
+
+    def get_spotify_client(self) -> spotipy.Spotify:
+        """Returns the current worker thread's spotipy client, creating it on the thread's first call"""
+        if not hasattr(self.spotify_clients, "client"):
+            self.spotify_clients.client = self.spotify_client_factory()
+        return self.spotify_clients.client
+
+    def call_spotify_client(self, method: str, *args, **kwargs) -> any:
+        return getattr(self.get_spotify_client(), method)(*args, **kwargs)
+
+    async def spotify_call(self, method: str, *args, **kwargs) -> any:
+        """Calls a spotipy client method (by name) in the worker pool once the Spotify rate limiter allows it, backing off if Spotify answers 429
+        spotipy is blocking, so it must never be called on the event loop itself
+        """
+        # Only take a rate limiter token once there is a free worker to use it
+        async with self.spotify_slots:
+            await self.spotify_limiter.acquire()
+            try:
+                result = await asyncio.get_running_loop().run_in_executor(self.spotify_workers, functools.partial(self.call_spotify_client, method, *args, **kwargs))
+            except SpotifyException as e:
+                if e.http_status == 429:
+                    self.spotify_limiter.rate_limited((e.headers or {}).get("Retry-After"))
+                raise
+            if result is None:
+                # spotipy hands back an empty result rather than raising when a 429 can't be retried
+                self.spotify_limiter.rate_limited()
+                raise SpotifyException(429, -1, "Empty response from Spotify (rate limited)")
+        self.spotify_limiter.succeeded()
+        return result
+
+    async def search_spin(self, spin: dict) -> tuple:
+        """Searches Spotify for the track of a spin
+        Returns:
+            tuple: (outcome - one of the cogs.spotify_cache outcomes, the Spotify track or None, match confidence from 0 to 1)
+        """
+        # Alternate simplified strings to avoid search issues
+        artist_name_simplified = cogs.matching.simplify_string(spin['artist'], remove_bracketed_and_dash=True, remove_spaces=False)
+        track_name_simplified = cogs.matching.simplify_string(spin['song'], remove_bracketed_and_dash=True, remove_spaces=False)[:15]
+
+        caution_flag = False # Flag to raise if ISRC is not carried to final result
+        if spin['isrc']:
+            # Search based on ISRC if available
+            search_q = f"isrc:{spin['isrc']}"
+        else:
+            caution_flag = True
+            if spin['upc']:
+                # If UPC but no ISRC, search using both UPC and artist/track names
+                search_q = f"upc:\"{spin['upc']}\" artist:\"{artist_name_simplified}\" track:\"{track_name_simplified}\""
+            else:
+                # If no ISRC or UPC, search just but artist and track name
+                search_q = f"artist:\"{spin['artist']}\" track:\"{spin['song']}\""
+
+        response = await self.spotify_call("search", search_q, limit=1, type="track")
+
+        # If search returns nothing, perform a more simplified search
+        if len(response['tracks']['items']) < 1:
+            caution_flag = True
+            search_q = f"{artist_name_simplified} {track_name_simplified}" 
+
+            response = await self.spotify_call("search", search_q, limit=1, type="track")
+
+            # If still returning nothing, skip
+            if len(response['tracks']['items']) < 1:
+                return cogs.spotify_cache.NO_RESULTS, None, 0.0
+        
+        spotify_track = response['tracks']['items'][0]
+
+        # Simplified strings for comparing against each other
+        spotify_artist_simplified = cogs.matching.simplify_artist(spotify_track['artists'][0]['name'])
+        spotify_track_simplified = cogs.matching.simplify_track(spotify_track['name'])
+        spinitron_artist_simplified = cogs.matching.simplify_artist(spin['artist'])
+        spinitron_track_simplified = cogs.matching.simplify_track(spin['song'])
+
+        # If current spotify track is not based on ISRC and does not exactly match spinitron artist and song names: Perform more extensive search
+        if caution_flag and (spinitron_artist_simplified != spotify_artist_simplified or spinitron_track_simplified != spotify_track_simplified):
+            # Same search query it was already using, but get 10 results instead of 1 to evaluate
+            response = (await self.spotify_call("search", search_q, limit=10, type="track"))['tracks']['items']
+
+            # Skip if no results for some reason
+            if len(response) < 1:
+                return cogs.spotify_cache.NO_RESULTS, None, 0.0
+
+            # Score every candidate in one pass and take the strongest (see cogs/matching.py)
+            index, artist_similarity, track_similarity = cogs.matching.pick_candidate(spinitron_artist_simplified, spinitron_track_simplified, response)
+
+            confidence = (artist_similarity + track_similarity) / 2
+            # Only accept the strongest candidate if it fits within thresholds - otherwise skip this track
+            if cogs.matching.is_match(artist_similarity, track_similarity):
+                return cogs.spotify_cache.MATCHED, response[index], confidence
+            return cogs.spotify_cache.NO_MATCH, None, confidence
+
+        # Matched by ISRC, or by exactly the same (simplified) names
+        return cogs.spotify_cache.MATCHED, spotify_track, 1.0
+
+    async def resolve_spin(self, spin: dict) -> tuple:
+        """Finds the Spotify track of a spin, searching only if the track has not been resolved before
+        Returns:
+            tuple: (outcome - one of the cogs.spotify_cache outcomes, the track's popularity snapshot or None)
+        """
+        # The same track may well come up more than once at a time, e.g. when several sets are checked at once
+        key = resolution_key(spin)
+        return await self.resolutions.run(key, self.lookup_spin, spin, key)
+
+    async def resolve_spin_safely(self, spin: dict) -> tuple:
+        """Same as resolve_spin(), but returns (spin, outcome, track snapshot), with the outcome None if checking the track failed"""
+        try:
+            status, spotify_track = await self.resolve_spin(spin)
+            return spin, status, spotify_track
+        except Exception as e:
+            print("Error during popularity check (specific track):")
+            print(e)
+            return spin, None, None
+
+    async def lookup_spin(self, spin: dict, key: str) -> tuple:
+        resolution = self.spotify_cache.get_resolution(key)
+        if resolution:
+            status, track_id, _ = resolution
+            if status != cogs.spotify_cache.MATCHED:
+                return status, None
+            track = self.spotify_cache.get_track(track_id)
+            if track is None:
+                # Known track, but its popularity is out of date
+                track = cogs.spotify_cache.track_snapshot(await self.spotify_call("track", track_id))
+                self.spotify_cache.set_tracks([track])
+            return status, track
+
+        status, spotify_track, confidence = await self.search_spin(spin)
+        track = cogs.spotify_cache.track_snapshot(spotify_track) if spotify_track else None
+        self.spotify_cache.set_resolution(key, status, track["id"] if track else None, confidence)
+        if track:
+            # Search results carry the track's popularity too, so no need to fetch it again
+            self.spotify_cache.set_tracks([track])
+        return status, track
+
+    async def get_artist_popularities(self, artist_ids: list) -> dict:
+        """Returns artist ID -> popularity, fetching the artists without an up to date snapshot in bulk
+        Artists that could not be fetched are left out
+        """
+        popularities = {}
+        missing = []
+        for artist_id in dict.fromkeys(artist_ids):
+            popularity = self.spotify_cache.get_artist_popularity(artist_id)
+            if popularity is None:
+                missing.append(artist_id)
+            else:
+                popularities[artist_id] = popularity
+
+        for i in range(0, len(missing), cogs.shared.SPOTIFY_MAX_ARTISTS_PER_REQUEST):
+            try:
+                response = await self.spotify_call("artists", missing[i:i + cogs.shared.SPOTIFY_MAX_ARTISTS_PER_REQUEST])
+            except Exception as e:
+                print("Error during popularity check (artist lookup):")
+                print(e)
+                continue
+            fetched = {artist['id']: artist['popularity'] for artist in response['artists'] if artist}
+            self.spotify_cache.set_artist_popularities(fetched)
+            popularities.update(fetched)
+        return popularities
+
+    async def get_spins(self, playlist: dict) -> list:
+        """Returns the spins of a set, up to MAX_PAGES_FOR_DJSET pages of them"""
+        spins = []
+        playlist_spins = await self.spinitron.get_items(1, playlist['_links']['spins']['href'])
+
+        playlist_page = 1;
+        while (playlist_spins):
+            spins.extend(playlist_spins)
+            
+            # Check for limit on pages
+            playlist_page += 1
+            if (playlist_page > cogs.shared.MAX_PAGES_FOR_DJSET):
+                break
+            
+            # Get next page
+            playlist_spins = await self.spinitron.get_items(1, playlist['_links']['spins']['href'], page=playlist_page)
+        return spins
+
+    async def evaluate(self, playlist: dict) -> dict:
+        """Checks a set against the popularity thresholds
+        Args:
+            playlist (dict): An HD-1 playlist as taken from the Spinitron API
+        Returns:
+            dict: The set's result: 'playlist' (see playlist_summary), 'exempt' (see exemption), 'tracks' - one dict per spin
+                with its outcome (a cogs.spotify_cache outcome, or ERROR) and popularity, and 'score' (see score_tracks,
+                None if the set is exempt)
+        """
+        result = {"playlist": playlist_summary(playlist), "exempt": exemption(playlist), "tracks": [], "score": None}
+        if result['exempt']:
+            return result
+
+        spins = await self.get_spins(playlist)
+
+        # Resolve every spin to a Spotify track (concurrently, in order) first, so that their artists can be looked up together
+        resolved_spins = await asyncio.gather(*(self.resolve_spin_safely(spin) for spin in spins))
+
+        # Get the popularity of every artist in the set at once
+        artist_popularities = await self.get_artist_popularities(
+            [spotify_track['artist_id'] for _, status, spotify_track in resolved_spins if status == cogs.spotify_cache.MATCHED]
+        )
+
+        for spin, status, spotify_track in resolved_spins:
+            track = {"spin_id": spin['id'], "artist": spin['artist'], "song": spin['song'], "status": status, "track_id": None,
+                     "track_popularity": None, "artist_popularity": None, "track_url": None, "artist_url": None}
+            if status is None or (status == cogs.spotify_cache.MATCHED and spotify_track['artist_id'] not in artist_popularities):
+                track['status'] = ERROR
+            elif status == cogs.spotify_cache.MATCHED:
+                track.update({
+                    "track_id": spotify_track['id'],
+                    "track_popularity": spotify_track['popularity'],
+                    "artist_popularity": artist_popularities[spotify_track['artist_id']],
+                    "track_url": spotify_track['url'],
+                    "artist_url": spotify_track['artist_url'],
+                })
+            result['tracks'].append(track)
+
+        result['score'] = score_tracks(playlist['category'], result['tracks'])
+        return result
+
+    def close(self):
+        self.spotify_workers.shutdown(wait=False, cancel_futures=True)
+
+
+class PopularityStore:
+    """Per-set and per-track popularity check results, in SQLite"""
+    def __init__(self):
+        self.db = sqlite3.connect(cogs.shared.POPULARITY_DB_PATH, timeout=30)
+        # The bot and backfills may have the database open at the same time
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS sets (
+                playlist_id INTEGER PRIMARY KEY,
+                persona_id INTEGER,
+                title TEXT,
+                category TEXT,
+                start_time TEXT NOT NULL,
+                end_time TEXT NOT NULL,
+                exempt TEXT,
+                average_artist_popularity REAL,
+                average_track_popularity REAL,
+                artist_threshold REAL,
+                track_threshold REAL,
+                flagged INTEGER NOT NULL DEFAULT 0,
+                checked_at REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS sets_end_time ON sets (end_time);
+            CREATE TABLE IF NOT EXISTS tracks (
+                playlist_id INTEGER NOT NULL,
+                position INTEGER NOT NULL,
+                spin_id INTEGER,
+                artist TEXT,
+                song TEXT,
+                status TEXT NOT NULL,
+                track_id TEXT,
+                track_popularity INTEGER,
+                artist_popularity INTEGER,
+                track_url TEXT,
+                artist_url TEXT,
+                PRIMARY KEY (playlist_id, position)
+            );
+            """
+        )
+        self.db.commit()
+
+    def save(self, result: dict):
+        """Stores a set's result (see PopularityEngine.evaluate), replacing any earlier result for the set"""
+        playlist = result['playlist']
+        score = result['score'] or {}
+        # Times are stored in UTC so that they sort
+        start = cogs.timeutil.parse_spinitron_time(playlist['start']).astimezone(datetime.timezone.utc).isoformat()
+        end = cogs.timeutil.parse_spinitron_time(playlist['end']).astimezone(datetime.timezone.utc).isoformat()
+        with self.db:
+            self.db.execute(
+                "INSERT OR REPLACE INTO sets VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (playlist['id'], playlist['persona_id'], playlist['title'], playlist['category'], start, end, result['exempt'],
+                 score.get('average_artist_popularity'), score.get('average_track_popularity'), score.get('artist_threshold'),
+                 score.get('track_threshold'), int(bool(score.get('flagged'))), time.time()),
+            )
+            self.db.execute("DELETE FROM tracks WHERE playlist_id = ?", (playlist['id'],))
+            self.db.executemany(
+                "INSERT INTO tracks VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                [(playlist['id'], position, track['spin_id'], track['artist'], track['song'], track['status'], track['track_id'],
+                  track['track_popularity'], track['artist_popularity'], track['track_url'], track['artist_url'])
+                 for position, track in enumerate(result['tracks'])],
+            )
+
+    def has_set(self, playlist_id: int) -> bool:
+        return self.db.execute("SELECT 1 FROM sets WHERE playlist_id = ?", (playlist_id,)).fetchone() is not None
+
+    def get_tracks(self, playlist_id: int) -> list:
+        """Returns a set's stored track results, in spin order"""
+        columns = ("spin_id", "artist", "song", "status", "track_id", "track_popularity", "artist_popularity", "track_url", "artist_url")
+        rows = self.db.execute(f"SELECT {', '.join(columns)} FROM tracks WHERE playlist_id = ? ORDER BY position", (playlist_id,)).fetchall()
+        return [dict(zip(columns, row)) for row in rows]
+
+    def get_sets(self, start: datetime.datetime, end: datetime.datetime, flagged_only: bool = False) -> list:
+        """Returns the stored sets that ended between two aware datetimes, in the order they ended"""
+        columns = ("playlist_id", "persona_id", "title", "category", "start_time", "end_time", "exempt", "average_artist_popularity",
+                   "average_track_popularity", "artist_threshold", "track_threshold", "flagged")
+        rows = self.db.execute(
+            f"SELECT {', '.join(columns)} FROM sets WHERE end_time >= ? AND end_time < ? {'AND flagged = 1' if flagged_only else ''} ORDER BY end_time",
+            (start.astimezone(datetime.timezone.utc).isoformat(), end.astimezone(datetime.timezone.utc).isoformat()),
+        ).fetchall()
+        return [dict(zip(columns, row)) for row in rows]
+
+    def rescore(self, playlist_id: int, category: str) -> dict:
+        """Re-scores a stored set against the current thresholds, from its stored tracks. Returns the new score"""
+        score = score_tracks(category, self.get_tracks(playlist_id))
+        with self.db:
+            self.db.execute(
+                "UPDATE sets SET average_artist_popularity = ?, average_track_popularity = ?, artist_threshold = ?, track_threshold = ?, flagged = ? WHERE playlist_id = ?",
+                (score['average_artist_popularity'], score['average_track_popularity'], score['artist_threshold'],
+                 score['track_threshold'], int(score['flagged']), playlist_id),
+            )
+        return score
+
+    def close(self):
+        self.db.close()
+
+
+def standalone_engine(rate_share: float) -> PopularityEngine:
+    """Returns an engine with its own Spinitron client, caches and rate limiters, for use outside the bot
+    Args:
+        rate_share (float): The fraction of each upstream's rate limit the engine may use
+    """
+    def limiter(upstream: str, key) -> cogs.rate_limit.RateLimiter:
+        rate, burst = cogs.shared.RATE_LIMITS[upstream]
+        return cogs.rate_limit.RateLimiter(f"{upstream} ({key}, standalone)", rate * rate_share, max(1, int(burst * rate_share)))
+
+    spinitron = cogs.spinitron.SpinitronClient(
+        cogs.http_cache.HTTPCache(), {channel_num: limiter("spinitron", channel_num) for channel_num in cogs.shared.HEADERS_HDX}
+    )
+    return PopularityEngine(spinitron, cogs.spotify_cache.SpotifyCache(), limiter("spotify", "app"))
+
+async def close_standalone_engine(engine: PopularityEngine):
+    engine.close()
+    await engine.spinitron.close()
+    await engine.spinitron.http_cache.close()
+    engine.spotify_cache.close()
+
+async def list_finished_sets(start: datetime.datetime, end: datetime.datetime) -> list:
+    """Returns every HD-1 playlist that ended between two aware datetimes (and before now), in the order they ended"""
+    engine = standalone_engine(cogs.shared.POPULARITY_BACKFILL_RATE_SHARE)
+    try:
+        # Playlists are matched by when they start, so look back far enough to find long sets that ended in the range
+        query_start = (start - datetime.timedelta(seconds=cogs.shared.POPULARITY_CHECK_LOOKBACK)).astimezone(cogs.timeutil.local_timezone()).replace(tzinfo=None)
+        query_end = end.astimezone(cogs.timeutil.local_timezone()).replace(tzinfo=None)
+        with cogs.rate_limit.background_priority():
+            playlists = await engine.spinitron.get_all_items(1, "playlists", start=query_start.isoformat(), end=query_end.isoformat())
+    finally:
+        await close_standalone_engine(engine)
+
+    now = datetime.datetime.now(datetime.timezone.utc)
+    finished = {}
+    for playlist in playlists:
+        playlist_end = cogs.timeutil.parse_spinitron_time(playlist['end'])
+        if start <= playlist_end < end and playlist_end <= now:
+            finished[playlist['id']] = (playlist_end, playlist)
+    return [playlist for _, playlist in sorted(finished.values(), key=lambda item: (item[0], item[1]['id']))]
+
+def evaluate_sets(playlists: list, rate_share: float) -> list:
+    """Process pool entry point: checks a partition of sets with a standalone engine
+    Returns:
+        list: The sets' results (see PopularityEngine.evaluate), or {'playlist': ..., 'error': ...} for sets that couldn't be checked
+    """
+    async def evaluate_all() -> list:
+        engine = standalone_engine(rate_share)
+        try:
+            with cogs.rate_limit.background_priority():
+                return await asyncio.gather(*(evaluate_safely(engine, playlist) for playlist in playlists))
+        finally:
+            await close_standalone_engine(engine)
+
+    async def evaluate_safely(engine: PopularityEngine, playlist: dict) -> dict:
+        try:
+            return await engine.evaluate(playlist)
+        except Exception as e:
+            return {"playlist": playlist_summary(playlist), "error": str(e)}
+
+    return asyncio.run(evaluate_all())
+
+def backfill(start: datetime.datetime, end: datetime.datetime, processes: int = None, refresh: bool = False, progress=None) -> dict:
+    """Checks and stores every HD-1 set that ended between two aware datetimes, spreading them across worker processes
+    Sets that already have stored results are only re-scored, unless refresh is set. Nothing is sent to Discord.
+    This blocks until it's done, so run it from the CLI (the bot runs it in a subprocess, see the !popularitybackfill command)
+    Args:
+        processes (int): Number of worker processes, defaults to POPULARITY_BACKFILL_PROCESSES
+        refresh (bool): Check sets that already have stored results again, rather than only re-scoring them
+        progress: Called as progress(sets done, sets to check) as partitions finish
+    Returns:
+        dict: Counts of sets 'checked', 'rescored', 'exempt', 'flagged' and 'errors', and 'elapsed' seconds
+    """
+    started = time.monotonic()
+    processes = processes or cogs.shared.POPULARITY_BACKFILL_PROCESSES
+    playlists = asyncio.run(list_finished_sets(start, end))
+    summary = {"checked": 0, "rescored": 0, "exempt": 0, "flagged": 0, "errors": 0}
+
+    store = PopularityStore()
+    try:
+        pending = []
+        for playlist in playlists:
+            if refresh or not store.has_set(playlist['id']):
+                pending.append(playlist)
+            elif exemption(playlist):
+                summary['exempt'] += 1
+            else:
+                summary['rescored'] += 1
+                summary['flagged'] += store.rescore(playlist['id'], playlist['category'])['flagged']
+
+        # Small partitions keep the processes evenly loaded, and let results be stored as they come in
+        partitions = [pending[i:i + cogs.shared.POPULARITY_BACKFILL_PARTITION_SIZE] for i in range(0, len(pending), cogs.shared.POPULARITY_BACKFILL_PARTITION_SIZE)]
+        if partitions:
+            # Worker processes are spawned rather than forked, so they don't inherit anything from a process with threads running
+            with ProcessPoolExecutor(max_workers=processes, mp_context=multiprocessing.get_context("spawn")) as pool:
+                futures = [pool.submit(evaluate_sets, partition, cogs.shared.POPULARITY_BACKFILL_RATE_SHARE / processes) for partition in partitions]
+                done = 0
+                for future in as_completed(futures):
+                    results = future.result()
+                    for result in results:
+                        if "error" in result:
+                            summary['errors'] += 1
+                            print(f"Error while checking playlist {result['playlist']['id']}: {result['error']}", file=sys.stderr)
+                            continue
+                        store.save(result)
+                        if result['exempt']:
+                            summary['exempt'] += 1
+                        else:
+                            summary['checked'] += 1
+                            summary['flagged'] += result['score']['flagged']
+                    done += len(results)
+                    if progress:
+                        progress(done, len(pending))
+    finally:
+        store.close()
+
+    summary['elapsed'] = time.monotonic() - started
+    return summary
+
+def rescore(start: datetime.datetime, end: datetime.datetime) -> dict:
+    """Re-scores every stored set that ended between two aware datetimes against the current thresholds, without any API calls
+    Returns:
+        dict: Counts of sets 'rescored' and 'flagged', and 'elapsed' seconds
+    """
+    started = time.monotonic()
+    summary = {"rescored": 0, "flagged": 0}
+    store = PopularityStore()
+    try:
+        for stored_set in store.get_sets(start, end):
+            if stored_set['exempt']:
+                continue
+            summary['rescored'] += 1
+            summary['flagged'] += store.rescore(stored_set['playlist_id'], stored_set['category'])['flagged']
+    finally:
+        store.close()
+    summary['elapsed'] = time.monotonic() - started
+    return summary
+
+def date_range(start: str, end: str) -> tuple:
+    """Takes two local dates (YYYY-MM-DD, both included) and returns the aware datetimes from the start of the first to the end of the last"""
+    start_day = datetime.date.fromisoformat(start)
+    end_day = datetime.date.fromisoformat(end)
+    if end_day < start_day:
+        raise ValueError("The end date is before the start date")
+    return cogs.timeutil.local_day_bounds(start_day)[0], cogs.timeutil.local_day_bounds(end_day)[1]
+
+def format_flagged_sets(flagged_sets: list, max_length: int = 1800) -> str:
+    """Lists stored flagged sets (see PopularityStore.get_sets) as Discord markdown, cut short at max_length characters"""
+    lines = []
+    length = 0
+    for i, flagged_set in enumerate(flagged_sets):
+        line = f"- [{flagged_set['title']}](https://spinitron.com/WKNC/pl/{flagged_set['playlist_id']}) ({cogs.timeutil.to_local(flagged_set['end_time']).strftime('%Y-%m-%d')})"
+        if length + len(line) > max_length:
+            lines.append(f"...and {len(flagged_sets) - i} more")
+            break
+        lines.append(line)
+        length += len(line) + 1
+    return "\n".join(lines)
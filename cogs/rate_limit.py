@@ -0,0 +1,139 @@
+"""
+This module contains the rate limiters used for upstream APIs (Spinitron and Spotify)
+
+Each upstream token gets a token bucket. Requests that have to wait for it are queued by priority, so a user waiting on
+a command goes ahead of background jobs sharing the same token. When the upstream answers 429, the bucket pauses for
+its Retry-After and halves its rate, then creeps back up to the configured rate as requests succeed again.
+
+Code runs at interactive priority unless it is inside a background_priority() block or a loop that called
+use_background_priority(), either of which carries over into any tasks it starts.
+"""
+import asyncio
+from contextlib import contextmanager
+from contextvars import ContextVar
+import heapq
+import itertools
+import time
+
+import cogs.shared
+
+
+INTERACTIVE = 0
+BACKGROUND = 1
+PRIORITY_NAMES = {INTERACTIVE: "interactive", BACKGROUND: "background"}
+
+current_priority = ContextVar("current_priority", default=INTERACTIVE)
+
+
+@contextmanager
+def background_priority():
+    """Runs the upstream requests made inside the block (including from tasks started in it) at background priority"""
+    reset_token = current_priority.set(BACKGROUND)
+    try:
+        yield
+    finally:
+        current_priority.reset(reset_token)
+
+
+def use_background_priority():
+    """Makes the rest of the current task run at background priority. Meant for tasks.loop loops, which each run in their own task"""
+    current_priority.set(BACKGROUND)
+
+
+class RateLimiter:
+    """Token bucket with a priority queue of waiters, which backs off when the upstream says it is being rate limited"""
+    def __init__(self, name: str, rate: float, burst: int):
+        self.name = name
+        self.max_rate = rate # Requests per second
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.paused_until = 0
+        self.waiters = [] # Heap of (priority, arrival, future)
+        self.arrivals = itertools.count()
+        self.dispatcher = None
+        self.rate_limited_count = 0
+
+    def refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def take(self) -> bool:
+        """Takes a token if one is available right now"""
+        self.refill()
+        if time.monotonic() < self.paused_until or self.tokens < 1:
+            return False
+        self.tokens -= 1
+        return True
+
+    def wait_time(self) -> float:
+        """Seconds until the next token is available"""
+        return max(self.paused_until - time.monotonic(), (1 - self.tokens) / self.rate, 0)
+
+    async def acquire(self, priority: int = None):
+        """Waits for a token
+        Args:
+            priority (int): INTERACTIVE or BACKGROUND, defaults to the priority of the current context
+        """
+        priority = current_priority.get() if priority is None else priority
+        # Only skip the queue if nobody is waiting, otherwise a background request could jump ahead of queued interactive ones
+        if not self.waiters and self.take():
+            return
+
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self.waiters, (priority, next(self.arrivals), future))
+        if self.dispatcher is None or self.dispatcher.done():
+            self.dispatcher = asyncio.ensure_future(self.dispatch())
+        await future
+
+    async def dispatch(self):
+        """Hands out tokens to the waiters, highest priority (then longest waiting) first"""
+        while self.waiters:
+            _, _, future = self.waiters[0]
+            if future.done():
+                # Its caller was cancelled
+                heapq.heappop(self.waiters)
+            elif self.take():
+                heapq.heappop(self.waiters)
+                future.set_result(None)
+            else:
+                await asyncio.sleep(self.wait_time())
+
+    def succeeded(self):
+        """Records a request that wasn't rate limited, letting the rate recover towards the configured one"""
+        if self.rate < self.max_rate:
+            self.rate = min(self.max_rate, self.rate + self.max_rate * cogs.shared.RATE_LIMIT_RECOVERY)
+
+    def rate_limited(self, retry_after=None):
+        """Records a 429 response, pausing for retry_after seconds (a Retry-After header value) and halving the rate"""
+        self.rate_limited_count += 1
+        try:
+            pause = float(retry_after)
+        except (TypeError, ValueError):
+            pause = cogs.shared.RATE_LIMIT_DEFAULT_PAUSE
+        self.paused_until = max(self.paused_until, time.monotonic() + pause)
+        self.rate = max(self.max_rate * cogs.shared.RATE_LIMIT_MIN_FRACTION, self.rate / 2)
+
+    def queue_depth(self) -> dict:
+        """Returns the number of requests waiting, by priority name"""
+        depth = {name: 0 for name in PRIORITY_NAMES.values()}
+        for priority, _, future in self.waiters:
+            if not future.done():
+                depth[PRIORITY_NAMES[priority]] += 1
+        return depth
+
+
+def get_rate_limiter(bot, upstream: str, key) -> RateLimiter:
+    """Returns the bot's rate limiter for one token of an upstream, creating it on first use
+    Args:
+        upstream (str): A key of RATE_LIMITS (e.g. "spinitron")
+        key: Identifies the token, e.g. the channel number for Spinitron
+    """
+    if not hasattr(bot, "rate_limiters"):
+        bot.rate_limiters = {}
+    if (upstream, key) not in bot.rate_limiters:
+        rate, burst = cogs.shared.RATE_LIMITS[upstream]
+        bot.rate_limiters[(upstream, key)] = RateLimiter(f"{upstream} ({key})", rate, burst)
+    return bot.rate_limiters[(upstream, key)]
@@ -0,0 +1,162 @@
+"""
+This module contains the schedule index, an in-memory copy of the upcoming show schedule of each channel
+
+The index is refreshed periodically. It holds the shows sorted by start time with their DJs already resolved,
+so that schedule lookups don't need the network.
+"""
+import asyncio
+from bisect import bisect_left, bisect_right
+from datetime import date, datetime, timedelta
+from dateutil import tz
+from discord.ext import tasks
+import logging
+
+import cogs.rate_limit
+import cogs.shared
+import cogs.spinitron
+import cogs.timeutil
+
+
+class ScheduledShow:
+    """One occurrence of a show on the schedule"""
+    def __init__(self, show: dict, persona: dict, channel_num: int):
+        self.show = show # The show as taken from the Spinitron API
+        self.start = cogs.timeutil.parse_spinitron_time(show["start"])
+        self.end = cogs.timeutil.parse_spinitron_time(show["end"])
+        self.persona_id = persona.get("id")
+        self.persona_name = persona.get("name", "")
+        self.automated = str(self.persona_id) == cogs.shared.ZETTA_SPINITRON_ID_HDX[channel_num]
+
+
+class ChannelSchedule:
+    """The indexed schedule of a single channel, covering the days from first_day up to (not including) last_day"""
+    def __init__(self, shows: list, first_day: date, last_day: date):
+        self.shows = sorted(shows, key=lambda show: show.start)
+        self.starts = [show.start for show in self.shows]
+        self.boundaries = sorted({show.start for show in self.shows} | {show.end for show in self.shows}) # Every time a show starts or ends
+        self.first_day = first_day
+        self.last_day = last_day
+
+        # next_live[i] is the index of the first non automated show at or after i (or None), so skipping automation is one lookup
+        self.next_live = [None] * (len(self.shows) + 1)
+        for i in range(len(self.shows) - 1, -1, -1):
+            self.next_live[i] = i if not self.shows[i].automated else self.next_live[i + 1]
+
+        self.rendered = {} # Memoized embeds, thrown away with the rest of the index on the next refresh
+
+    def covers(self, day: date) -> bool:
+        return self.first_day <= day < self.last_day
+
+    def shows_between(self, start: datetime, end: datetime) -> list:
+        """Returns the shows starting at or after start and before end"""
+        return self.shows[bisect_left(self.starts, start):bisect_left(self.starts, end)]
+
+    def next_live_show(self, now: datetime) -> ScheduledShow:
+        """Returns the next show that is not automated and has not started yet, or None"""
+        i = self.next_live[bisect_right(self.starts, now)]
+        return self.shows[i] if i is not None else None
+
+    def show_at(self, when: datetime) -> ScheduledShow:
+        """Returns the show on the schedule at a given time, or None if nothing is scheduled then"""
+        i = bisect_right(self.starts, when) - 1
+        if i >= 0 and self.shows[i].end > when:
+            return self.shows[i]
+        return None
+
+    def last_boundary(self, when: datetime) -> datetime:
+        """Returns the last time at or before when that a show started or ended, or None"""
+        i = bisect_right(self.boundaries, when)
+        return self.boundaries[i - 1] if i else None
+
+    def next_boundary(self, when: datetime) -> datetime:
+        """Returns the next time after when that a show starts or ends, or None if there is none in the index"""
+        i = bisect_right(self.boundaries, when)
+        return self.boundaries[i] if i < len(self.boundaries) else None
+
+
+class ScheduleIndex:
+    """Keeps the schedule index of every channel up to date"""
+    def __init__(self, bot):
+        self.bot = bot
+        self.spinitron = cogs.spinitron.get_client(bot)
+        self.channels = {}
+        self.locks = {channel_num: asyncio.Lock() for channel_num in cogs.shared.HEADERS_HDX}
+        self.refresh_all.start()
+
+    async def fetch_shows(self, channel_num: int, first_day: date, last_day: date) -> list:
+        """Fetches the shows from first_day up to last_day, with their DJs resolved"""
+        start, _ = cogs.timeutil.local_day_bounds(first_day)
+        end, _ = cogs.timeutil.local_day_bounds(last_day)
+        shows = []
+        async for _, items in self.spinitron.iter_pages(channel_num, "shows", start=start.isoformat(), end=end.isoformat(), count=200):
+            shows.extend(items)
+
+        # Resolve every DJ on the schedule in one batch
+        persona_ids = [cogs.spinitron.persona_id_from_href(show["_links"]["personas"][0]["href"]) for show in shows]
+        await self.spinitron.warm_personas(channel_num, persona_ids)
+        return [
+            ScheduledShow(show, await self.spinitron.get_persona(channel_num, persona_id), channel_num)
+            for show, persona_id in zip(shows, persona_ids)
+        ]
+
+    async def refresh(self, channel_num: int) -> ChannelSchedule:
+        """Rebuilds a channel's index, from the start of today up to SCHEDULE_INDEX_DAYS ahead"""
+        async with self.locks[channel_num]:
+            first_day = cogs.timeutil.local_today()
+            last_day = first_day + timedelta(days=cogs.shared.SCHEDULE_INDEX_DAYS)
+            schedule = ChannelSchedule(await self.fetch_shows(channel_num, first_day, last_day), first_day, last_day)
+            self.channels[channel_num] = schedule
+            return schedule
+
+    async def get(self, channel_num: int) -> ChannelSchedule:
+        """Returns a channel's index, building it first if there is none yet or today is no longer covered by it"""
+        schedule = self.channels.get(channel_num)
+        if schedule is None or not schedule.covers(cogs.timeutil.local_today()):
+            schedule = await self.refresh(channel_num)
+        return schedule
+
+    async def shows_on(self, channel_num: int, day: date) -> list:
+        """Returns every show on the schedule for a local day, only going to the network for days outside of the index"""
+        schedule = await self.get(channel_num)
+        if schedule.covers(day):
+            return schedule.shows_between(*cogs.timeutil.local_day_bounds(day))
+        return await self.fetch_shows(channel_num, day, day + timedelta(days=1))
+
+    async def upcoming_today(self, channel_num: int) -> list:
+        """Returns the shows today that have not ended yet"""
+        schedule = await self.get(channel_num)
+        now = datetime.now(tz.UTC)
+        return [show for show in schedule.shows_between(*cogs.timeutil.local_day_bounds(schedule.first_day)) if show.end > now]
+
+    async def next_live_show(self, channel_num: int) -> ScheduledShow:
+        """Returns the next show that is not automated, or None if there isn't one in the index"""
+        return (await self.get(channel_num)).next_live_show(datetime.now(tz.UTC))
+
+    async def show_at(self, channel_num: int, when: datetime) -> ScheduledShow:
+        """Returns the show on the schedule at a given time, or None if nothing is scheduled then"""
+        return (await self.get(channel_num)).show_at(when)
+
+    @tasks.loop(minutes=cogs.shared.SCHEDULE_REFRESH_MINUTES)
+    async def refresh_all(self):
+        for channel_num in cogs.shared.HEADERS_HDX:
+            try:
+                with cogs.rate_limit.background_priority():
+                    await self.refresh(channel_num)
+            except Exception as e:
+                logging.error(e)
+                print(f"Error while refreshing the schedule index for HD-{channel_num}:")
+                print(e)
+
+    @refresh_all.before_loop
+    async def before_refresh_all(self):
+        await self.bot.wait_until_ready()
+
+    def close(self):
+        self.refresh_all.cancel()
+
+
+def get_schedule_index(bot) -> ScheduleIndex:
+    """Returns the bot's shared schedule index, creating (and starting its refresh job) on first use"""
+    if not hasattr(bot, "schedule_index"):
+        bot.schedule_index = ScheduleIndex(bot)
+    return bot.schedule_index
@@ -7,6 +7,8 @@ import os
 ZETTA_SPINITRON_ID_HDX = {1:"188104", 2:"188105"}
 SPINITRON_URL_CHANNEL_HDX = {1:"WKNC", 2:"WKNC-HD2"}
 HEADERS_HDX = {1:{"Authorization": "Bearer {}".format(os.getenv("SPINITRON_TOKEN_HD1"))}, 2:{"Authorization": "Bearer {}".format(os.getenv("SPINITRON_TOKEN_HD2"))}}
+SPINITRON_API_URL = os.getenv("SPINITRON_API_URL", "https://spinitron.com/api") #Overridable so that the bot and tools can be pointed at a stand-in (see benchmarks/popularity.py)
+SPOTIFY_API_URL = os.getenv("SPOTIFY_API_URL", "https://api.spotify.com/v1/") #Same, for the Spotify Web API (spotipy's prefix)
 WEBSTREAM_URL_HDX = {1:"https://streaming.live365.com/a45877", 2:"https://streaming.live365.com/a30009"}
 DISCORD_TEXT_CHANNEL_ID_HDX = {1:int(os.getenv("HD1_DISCORD_TEXT_CHANNEL_ID")), 2:int(os.getenv("HD2_DISCORD_TEXT_CHANNEL_ID"))}
 DISCORD_VOICE_CHANNEL_ID_HDX = {1:int(os.getenv("HD1_DISCORD_VOICE_CHANNEL_ID")), 2:int(os.getenv("HD2_DISCORD_VOICE_CHANNEL_ID"))}
@@ -21,16 +23,81 @@ POPULAR_ARTISTS_LIST_URL = "https://docs.google.com/spreadsheets/d/15ZUXj0baHWNm
 EMBED_COLOR = 0xC3409D
 LAST_SET_RANGE = 100 #How far back the bot will look for the last set with the djset command
 BUTTON_TIMEOUT = 60 #Button timeout time in seconds
-MAX_PAGES_FOR_DJSET = 3 #Max pages the djset command will go through
+MAX_PAGES_FOR_DJSET = 3 #Max pages of a set the popularity check will go through
+EMBED_DESCRIPTION_LIMIT = 4096 #Max number of characters Discord allows in an embed description
 VALID_WEEKDAYS = ["sunday", "monday", "tuesday", "wednesday", "thursday", "friday", "saturday", "sun", "mon", "tue", "wed", "thu", "fri", "sat", "su", "mo", "tu", "we", "th", "fr", "sa", "m", "w", "f"]
 WEEKDAY_LIST = ["Monday", "Tuesday", "Wednesday", "Thursday", "Friday", "Saturday", "Sunday"]
 LPS_RAND_THRESH = 10 #What page LPS will start having a chance of randomizing the thinking text
 LPS_RAND_POOL = 10 #1/X - Chance LPS will choose a different thinking text
+LPS_PAGE_CACHE_SIZE = 10 #Max number of rendered pages each LPS message keeps
 AVERAGE_ARTIST_POPULARITY_THRESHOLDS = {"Default": 48.0, "Afterhours": 40.0, "Chainsaw": 40.0, "Daytime Rock": 48.0, "Specialty Show": 48.0, "Sunrise/Sunset": 40.0, "Underground": 48.0} #Maximum average spotify popularity index across artists in a set
 TRACK_POPULARITY_THRESHOLDS = {"Default": 65, "Afterhours": 65, "Chainsaw": 65, "Daytime Rock": 65, "Specialty Show": 65, "Sunrise/Sunset": 65, "Underground": 65} #Maximum spotify popularity index for an individual track
 NAME_SIMILARITY_UPPER_MINIMUM = 0.9 #Upper minimum for two strings to be considered equivalent when evaluating tracks for popularity checking
 NAME_SIMILARITY_LOWER_MINIMUM = 0.5 #Lower minimum for two strings to be considered equivalent when evaluating tracks for popularity checking
 POPULARITY_CHECK_EXCEPTION_SPINITRON_IDS = [10555, 175563, 188104] #Spinitron IDs to be exempt from popularity check
+SPINITRON_REQUEST_TIMEOUT = 30 #Seconds before a Spinitron request is abandoned
+SPINITRON_MAX_PAGES_IN_FLIGHT = 6 #Max number of pages of one collection requested from Spinitron at the same time
+PERSONA_CACHE_TTL = 6 * 60 * 60 #Seconds a cached Spinitron persona (DJ name) is trusted before being fetched again
+PERSONA_CACHE_SIZE = 1024 #Max number of personas kept in the persona cache
+PLAYLIST_PERSONA_CACHE_SIZE = 4096 #Max number of playlist -> persona mappings kept in memory
+NOW_PLAYING_POLL_INTERVAL = 20 #Seconds between now playing polls of Spinitron
+NOW_PLAYING_MAX_AGE = 60 #Seconds before a now playing snapshot is considered stale and commands poll for themselves
+NOW_PLAYING_SPIN_COUNT = 10 #Number of recent spins kept in the now playing snapshot (enough for the first page of lps)
+NOW_PLAYING_PLAYLIST_MAX_AGE = 10 * 60 #Max seconds the now playing poller goes without fetching the current playlist again (it's otherwise only fetched around boundaries)
+NOW_PLAYING_BOUNDARY_WINDOW = 3 * 60 #Seconds after a playlist's scheduled end during which the now playing poller keeps fetching the current playlist
+STATUS_BURST_INTERVAL = 5 #Seconds between status checks right after a show boundary, until the new playlist shows up
+STATUS_BURST_DURATION = 2 * 60 #Max seconds of burst status checks after a show boundary
+STATUS_MAX_SLEEP = 15 * 60 #Max seconds between status checks during live shows (playlist changes in between are caught by the now playing poller)
+STATUS_AUTOMATION_MAX_SLEEP = 60 * 60 #Max seconds between status checks during automation
+SPIN_HISTORY_DB_PATH = "spin-history-hd{}.db" #Local spin history database file for each channel
+SPIN_HISTORY_BACKFILL_DAYS = 180 #How far back the spin history goes when it is first created
+SPIN_HISTORY_BACKFILL_CHUNK_DAYS = 7 #Days of spins the first spin history sync downloads and saves at a time, so that a failed backfill resumes where it stopped
+SPIN_HISTORY_SYNC_MINUTES = 5 #Minutes between background spin history syncs
+SPIN_HISTORY_SYNC_OVERLAP = 6 * 60 * 60 #Seconds behind the watermark each spin history sync scans again, for spins logged after the fact
+SPIN_HISTORY_QUERY_SYNC_TIMEOUT = 5 #Max seconds a summary waits for the spin history to catch up before answering from what is already stored
+SCHEDULE_INDEX_DAYS = 8 #Number of days (starting today) held in the schedule index
+SCHEDULE_REFRESH_MINUTES = 60 #Minutes between schedule index refreshes
+HTTP_CACHE_DB_PATH = "http-cache.db" #Local HTTP response cache database file
+HTTP_CACHE_TTLS = { #Seconds a cached response is trusted before it is revalidated, by url prefix (the longest match wins). Urls not listed are not cached
+    f"{SPINITRON_API_URL}/spins": 10,
+    f"{SPINITRON_API_URL}/playlists": 30,
+    f"{SPINITRON_API_URL}/shows": 60 * 60,
+    f"{SPINITRON_API_URL}/personas": 6 * 60 * 60,
+    "https://gopack.com/api/v2/Calendar": 24 * 60 * 60,
+}
+HTTP_CACHE_KEEP_STALE = 7 * 24 * 60 * 60 #Seconds a stale response is kept around for revalidation before it is deleted
+HTTP_CACHE_PRUNE_INTERVAL = 60 * 60 #Min seconds between deletions of old responses
+HTTP_CACHE_REQUEST_TIMEOUT = 30 #Seconds before a request made through the HTTP cache's own session times out
+HTTP_CACHE_BUSY_TIMEOUT = 100 #Max milliseconds the HTTP cache waits on a database locked by another process before treating it as a miss (it runs on the event loop)
+RATE_LIMITS = { #(Requests per second, burst size) allowed for each upstream token
+    "spinitron": (10, 20),
+    "spotify": (5, 10),
+}
+RATE_LIMIT_RECOVERY = 0.05 #Fraction of the configured rate a rate limiter gets back for each request that isn't rate limited
+RATE_LIMIT_MIN_FRACTION = 0.1 #Lowest fraction of the configured rate a rate limiter backs off to
+RATE_LIMIT_DEFAULT_PAUSE = 1 #Seconds to pause after a 429 response without a usable Retry-After header
+RATE_LIMIT_MAX_RETRIES = 3 #Max times a request is retried after 429 responses
+SPOTIFY_CACHE_DB_PATH = "spotify-cache.db" #Local database of spin -> Spotify track resolutions and popularity snapshots
+SPOTIFY_POPULARITY_TTL = 24 * 60 * 60 #Seconds a track's or artist's Spotify popularity is trusted before being fetched again
+POPULARITY_CHECK_WORKERS = 8 #Max Spotify calls the popularity check has in flight at once (each runs in a worker thread)
+SPOTIFY_MAX_ARTISTS_PER_REQUEST = 50 #Max artist IDs Spotify accepts in one several-artists request
+SPOTIFY_UNRESOLVED_TTL = 7 * 24 * 60 * 60 #Seconds before a spin that couldn't be matched to a Spotify track is searched for again
+POPULARITY_CHECK_DELAY = 120 #Seconds after an HD-1 set ends before it is checked, so that its last spins are in Spinitron
+POPULARITY_CHECK_LOOKBACK = 6 * 60 * 60 #Seconds before the popularity check's watermark that playlists are queried from, so that long sets ending after it are still found
+POPULARITY_CHECK_MAX_CATCHUP = 7 * 24 * 60 * 60 #Max seconds of finished sets the popularity check catches up on (e.g. after the bot was down)
+POPULARITY_CHECK_STUCK_ALERT = 3 #Failed runs in a row on the same set before the popularity check posts an alert that it is stuck
+POPULARITY_DB_PATH = "popularity.db" #Local database of popularity check results, per set and per track
+POPULARITY_BACKFILL_PROCESSES = 4 #Worker processes a popularity backfill spreads sets across
+POPULARITY_BACKFILL_PARTITION_SIZE = 5 #Sets a backfill worker process checks at a time
+POPULARITY_BACKFILL_RATE_SHARE = 0.5 #Fraction of each upstream's rate limit a backfill may use (split between its processes), the rest is left to the bot
+ALBUM_ART_DB_PATH = "album-art.db" #Local album art cache database file
+ALBUM_ART_CACHE_TTL = 90 * 24 * 60 * 60 #Seconds album art found on Discogs is cached for
+ALBUM_ART_NEGATIVE_CACHE_TTL = 24 * 60 * 60 #Seconds a track with no album art on Discogs is cached for, before searching again
+BINDINGS_DB_PATH = "bindings.db" #Local database of Discord - Spinitron bindings
+BINDINGS_SHELF_PATH = "dj-bindings" #The shelf bindings used to be kept in, migrated into BINDINGS_DB_PATH on first run
+PERSONA_DIRECTORY_SYNC_HOURS = 6 #Hours between persona directory syncs
+PERSONA_SUGGESTION_COUNT = 3 #Max number of DJ names suggested when a DJ name is not found
+PERSONA_SUGGESTION_MIN_SIMILARITY = 0.3 #Min trigram similarity (0 to 1) for a DJ name to be suggested
 
 STATUS_MESSAGE = "2.1"
 
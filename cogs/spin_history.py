@@ -0,0 +1,267 @@
+"""
+This module contains the local spin history, a SQLite copy of every spin logged on each channel
+
+A background job keeps each channel's history up to date incrementally, starting from a watermark saved after
+every successful sync, so that summaries can run as SQL queries over local data instead of downloading every spin.
+"""
+import asyncio
+from datetime import datetime, timedelta
+from discord.ext import tasks
+import logging
+import sqlite3
+
+import cogs.rate_limit
+import cogs.shared
+import cogs.spinitron
+
+
+def spinitron_time(date: str) -> str:
+    """Takes a Spinitron UTC date string ('1970-01-01T00:00:00+0000') and returns it in the format stored in the
+    history ('1970-01-01T00:00:00'), which sorts and compares correctly as text"""
+    return date[:19]
+
+
+class ChannelSpinHistory:
+    """The spin history database of a single channel"""
+    def __init__(self, channel_num: int):
+        self.channel_num = channel_num
+        self.db = sqlite3.connect(cogs.shared.SPIN_HISTORY_DB_PATH.format(channel_num))
+        self.db.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS spins (
+                id INTEGER PRIMARY KEY,
+                playlist_id INTEGER NOT NULL,
+                start TEXT NOT NULL,
+                artist TEXT NOT NULL,
+                song TEXT NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS spins_start ON spins (start);
+            CREATE INDEX IF NOT EXISTS spins_playlist ON spins (playlist_id, start);
+            CREATE TABLE IF NOT EXISTS playlists (
+                id INTEGER PRIMARY KEY,
+                show_id INTEGER,
+                persona_id INTEGER,
+                start TEXT
+            );
+            CREATE INDEX IF NOT EXISTS playlists_show ON playlists (show_id);
+            CREATE TABLE IF NOT EXISTS sync_state (
+                key TEXT PRIMARY KEY,
+                value TEXT
+            );
+            """
+        )
+        self.db.commit()
+
+    def get_watermark(self) -> tuple:
+        """Returns (last spin ID, last spin start) as of the last successful sync, or (None, None) if there has not been one"""
+        state = dict(self.db.execute("SELECT key, value FROM sync_state WHERE key IN ('last_spin_id', 'last_spin_start')"))
+        last_spin_id = state.get("last_spin_id")
+        return (int(last_spin_id) if last_spin_id else None), state.get("last_spin_start")
+
+    def set_watermark(self, last_spin_id: int, last_spin_start: str):
+        self.db.executemany(
+            "INSERT OR REPLACE INTO sync_state (key, value) VALUES (?, ?)",
+            [("last_spin_id", str(last_spin_id)), ("last_spin_start", last_spin_start)],
+        )
+        self.db.commit()
+
+    def get_backfilled_until(self) -> str:
+        """Returns how far the first sync has stored every spin up to, or None if it has not stored any part yet"""
+        row = self.db.execute("SELECT value FROM sync_state WHERE key = 'backfilled_until'").fetchone()
+        return row[0] if row else None
+
+    def set_backfilled_until(self, backfilled_until: str):
+        self.db.execute("INSERT OR REPLACE INTO sync_state (key, value) VALUES ('backfilled_until', ?)", (backfilled_until,))
+        self.db.commit()
+
+    def latest_spin(self) -> tuple:
+        """Returns (highest spin ID, latest spin start) in the history, or (None, None) if it is empty"""
+        return self.db.execute("SELECT MAX(id), MAX(start) FROM spins").fetchone()
+
+    def add_spins(self, spins: list):
+        self.db.executemany(
+            "INSERT OR IGNORE INTO spins (id, playlist_id, start, artist, song) VALUES (?, ?, ?, ?, ?)",
+            [(spin["id"], spin["playlist_id"], spinitron_time(spin["start"]), spin["artist"] or "", spin["song"] or "") for spin in spins],
+        )
+        self.db.commit()
+
+    def add_playlists(self, playlists: list):
+        self.db.executemany(
+            "INSERT OR REPLACE INTO playlists (id, show_id, persona_id, start) VALUES (?, ?, ?, ?)",
+            [(playlist["id"], playlist.get("show_id"), playlist.get("persona_id"), spinitron_time(playlist["start"]) if playlist.get("start") else None) for playlist in playlists],
+        )
+        self.db.commit()
+
+    def missing_playlist_ids(self, playlist_ids) -> list:
+        """Returns the IDs out of playlist_ids that are not in the playlists table"""
+        return [
+            playlist_id for playlist_id in set(playlist_ids)
+            if self.db.execute("SELECT 1 FROM playlists WHERE id = ?", (playlist_id,)).fetchone() is None
+        ]
+
+    def earliest_spin(self) -> str:
+        """Returns the start of the oldest spin in the history, or None if it is empty"""
+        return self.db.execute("SELECT MIN(start) FROM spins").fetchone()[0]
+
+    def top(self, by: str, since: datetime, show_id=None, limit: int = 10) -> list:
+        """Returns the most played songs or artists
+        Args:
+            by (str): "artist" to count by artist, otherwise counts by song
+            since (datetime): Only count spins starting at or after this UTC time
+            show_id: Only count spins from playlists of this show, if given
+            limit (int): How many results to return
+        Returns:
+            list: (song or artist, count) tuples, most played first. Songs are in the format '<song> by <artist>'
+        """
+        key = "spins.artist" if by == "artist" else "spins.song || ' by ' || spins.artist"
+        query = f"SELECT {key} AS name, COUNT(*) AS plays FROM spins"
+        args = []
+        if show_id:
+            query += " JOIN playlists ON spins.playlist_id = playlists.id WHERE playlists.show_id = ? AND spins.start >= ?"
+            args.append(show_id)
+        else:
+            query += " WHERE spins.start >= ?"
+        args.append(since.strftime("%Y-%m-%dT%H:%M:%S"))
+        query += " GROUP BY name ORDER BY plays DESC, name LIMIT ?"
+        args.append(limit)
+        return self.db.execute(query, args).fetchall()
+
+    def close(self):
+        self.db.close()
+
+
+class SpinHistory:
+    """Keeps the spin history of every channel in sync with Spinitron"""
+    def __init__(self, bot):
+        self.bot = bot
+        self.spinitron = cogs.spinitron.get_client(bot)
+        self.channels = {channel_num: ChannelSpinHistory(channel_num) for channel_num in cogs.shared.HEADERS_HDX}
+        self.locks = {channel_num: asyncio.Lock() for channel_num in cogs.shared.HEADERS_HDX}
+        self.sync_all.start()
+
+    async def sync(self, channel_num: int) -> int:
+        """Downloads every spin logged since the channel's watermark (or the backfill window, on the first sync)
+        The first sync downloads the backfill window oldest first, SPIN_HISTORY_BACKFILL_CHUNK_DAYS at a time, and saves
+        how far it got after each chunk, so that a failed backfill picks up where it stopped. The watermark is only set
+        once the whole window has been stored
+        Returns:
+            int: The number of spins downloaded
+        """
+        async with self.locks[channel_num]:
+            history = self.channels[channel_num]
+            last_spin_id, last_spin_start = history.get_watermark()
+            # Fix the end of the range, so that spins logged during the sync can't shift the pages being fetched
+            sync_end = datetime.utcnow().strftime("%Y-%m-%dT%H:%M:%S")
+
+            if last_spin_start:
+                # Start a while before the watermark, since spins can be logged after the fact with an earlier start time. Duplicates are ignored
+                sync_start = (datetime.fromisoformat(last_spin_start) - timedelta(seconds=cogs.shared.SPIN_HISTORY_SYNC_OVERLAP)).strftime("%Y-%m-%dT%H:%M:%S")
+                count, new_last_spin_id, new_last_spin_start = await self.sync_range(channel_num, sync_start, sync_end)
+                # Only move the watermark once every page has been stored
+                if new_last_spin_start is not None:
+                    history.set_watermark(max(new_last_spin_id, last_spin_id or 0), max(new_last_spin_start, last_spin_start))
+                return count
+
+            chunk_start = history.get_backfilled_until() or (datetime.utcnow() - timedelta(days=cogs.shared.SPIN_HISTORY_BACKFILL_DAYS)).strftime("%Y-%m-%dT%H:%M:%S")
+            count = 0
+            while chunk_start < sync_end:
+                chunk_end = min((datetime.fromisoformat(chunk_start) + timedelta(days=cogs.shared.SPIN_HISTORY_BACKFILL_CHUNK_DAYS)).strftime("%Y-%m-%dT%H:%M:%S"), sync_end)
+                count += (await self.sync_range(channel_num, chunk_start, chunk_end))[0]
+                history.set_backfilled_until(chunk_end)
+                chunk_start = chunk_end
+
+            new_last_spin_id, new_last_spin_start = history.latest_spin()
+            if new_last_spin_start is not None:
+                history.set_watermark(new_last_spin_id, new_last_spin_start)
+            return count
+
+    async def sync_range(self, channel_num: int, start: str, end: str) -> tuple:
+        """Downloads and stores every spin between two UTC times, and the playlists they belong to
+        Returns:
+            tuple: (number of spins downloaded, highest spin ID, latest spin start), the last two None if there were no spins
+        """
+        history = self.channels[channel_num]
+        last_spin_id, last_spin_start = None, None
+        new_playlist_ids = set()
+        count = 0
+        async for _, spins in self.spinitron.iter_pages(channel_num, "spins", start=start + "+0000", end=end + "+0000", count=200):
+            history.add_spins(spins)
+            count += len(spins)
+            for spin in spins:
+                new_playlist_ids.add(spin["playlist_id"])
+                if last_spin_start is None or spinitron_time(spin["start"]) > last_spin_start:
+                    last_spin_start = spinitron_time(spin["start"])
+                if last_spin_id is None or spin["id"] > last_spin_id:
+                    last_spin_id = spin["id"]
+
+        # Spins are matched to shows through their playlists, so pick up any playlists the new spins belong to
+        # (a day before the range as well, for playlists that started before it)
+        playlists_start = (datetime.fromisoformat(start) - timedelta(days=1)).strftime("%Y-%m-%dT%H:%M:%S")
+        async for _, playlists in self.spinitron.iter_pages(channel_num, "playlists", start=playlists_start + "+0000", end=end + "+0000", count=200):
+            history.add_playlists(playlists)
+        for playlist_id in history.missing_playlist_ids(new_playlist_ids):
+            playlist = await self.spinitron.get(channel_num, f"playlists/{playlist_id}")
+            if "id" in playlist:
+                history.add_playlists([playlist])
+        return count, last_spin_id, last_spin_start
+
+    async def catch_up(self, channel_num: int) -> bool:
+        """Briefly tries to bring a channel's history up to date, without ever failing
+        Only histories that have already been backfilled are synced here, and only if no sync is running already (the
+        background job takes care of those), for at most SPIN_HISTORY_QUERY_SYNC_TIMEOUT seconds
+        Returns:
+            bool: Whether the history was brought up to date
+        """
+        if self.locks[channel_num].locked() or self.channels[channel_num].get_watermark()[1] is None:
+            return False
+        try:
+            await asyncio.wait_for(self.sync(channel_num), cogs.shared.SPIN_HISTORY_QUERY_SYNC_TIMEOUT)
+            return True
+        except Exception as e:
+            # The stored history is still good to answer from, the background job will catch up later
+            logging.error(e)
+            print(f"Could not bring the spin history for HD-{channel_num} up to date, answering from stored spins:")
+            print(repr(e))
+            return False
+
+    async def top(self, channel_num: int, by: str, days: int, show_id=None, limit: int = 10) -> list:
+        """Returns the channel's most played songs or artists over the past days from its stored history, after briefly
+        trying to catch up (see catch_up and ChannelSpinHistory.top)"""
+        await self.catch_up(channel_num)
+        since = datetime.utcnow() - timedelta(days=days)
+        return self.channels[channel_num].top(by, since, show_id, limit)
+
+    def is_synced(self, channel_num: int) -> bool:
+        """Returns whether the channel's history has finished its first sync, i.e. has everything up to its watermark"""
+        return self.channels[channel_num].get_watermark()[1] is not None
+
+    def earliest_spin(self, channel_num: int) -> datetime:
+        earliest = self.channels[channel_num].earliest_spin()
+        return datetime.fromisoformat(earliest) if earliest else None
+
+    @tasks.loop(minutes=cogs.shared.SPIN_HISTORY_SYNC_MINUTES)
+    async def sync_all(self):
+        for channel_num in self.channels:
+            try:
+                with cogs.rate_limit.background_priority():
+                    await self.sync(channel_num)
+            except Exception as e:
+                logging.error(e)
+                print(f"Error while syncing spin history for HD-{channel_num}:")
+                print(e)
+
+    @sync_all.before_loop
+    async def before_sync_all(self):
+        await self.bot.wait_until_ready()
+
+    def close(self):
+        self.sync_all.cancel()
+        for history in self.channels.values():
+            history.close()
+
+
+def get_spin_history(bot) -> SpinHistory:
+    """Returns the bot's shared spin history, creating (and starting its sync job) on first use"""
+    if not hasattr(bot, "spin_history"):
+        bot.spin_history = SpinHistory(bot)
+    return bot.spin_history
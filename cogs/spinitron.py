@@ -0,0 +1,191 @@
+"""
+This module contains the shared asynchronous Spinitron client used by the other modules
+"""
+import aiohttp
+import asyncio
+import json
+
+import cogs.cache
+import cogs.http_cache
+import cogs.rate_limit
+import cogs.shared
+
+
+def persona_id_from_href(href: str) -> str:
+    """Takes a Spinitron persona link (e.g. a show's '_links' persona href) and returns the persona ID at the end of it"""
+    return href.rstrip("/").rsplit("/", 1)[-1]
+
+
+class SpinitronClient:
+    """Non-blocking Spinitron API client, holding one pooled session per channel token"""
+    def __init__(self, http_cache: cogs.http_cache.HTTPCache, limiters: dict):
+        self.sessions = {}
+        self.http_cache = http_cache
+        self.limiters = limiters # channel -> RateLimiter for that channel's token
+        # Personas are keyed by (channel, persona ID), so both channels share one cache
+        self.personas = cogs.cache.TTLCache(cogs.shared.PERSONA_CACHE_SIZE, cogs.shared.PERSONA_CACHE_TTL)
+        # A playlist's persona never changes, so (channel, playlist ID) -> persona ID can be kept as long as the persona itself
+        self.playlist_personas = cogs.cache.TTLCache(cogs.shared.PLAYLIST_PERSONA_CACHE_SIZE, cogs.shared.PERSONA_CACHE_TTL)
+        # Identical requests made while one is already in flight share its response
+        self.requests = cogs.cache.SingleFlight()
+
+    def get_session(self, channel_num: int) -> aiohttp.ClientSession:
+        """Returns the pooled session for a channel, opening a new one if there is none yet or it was closed
+        Args:
+            channel_num (int): An int representing a WKNC channel: 1 for HD-1, 2 for HD-2
+        Returns:
+            aiohttp.ClientSession: A session carrying that channel's Spinitron token
+        """
+        session = self.sessions.get(channel_num)
+        if session is None or session.closed:
+            session = aiohttp.ClientSession(
+                headers=cogs.shared.HEADERS_HDX[channel_num],
+                timeout=aiohttp.ClientTimeout(total=cogs.shared.SPINITRON_REQUEST_TIMEOUT),
+            )
+            self.sessions[channel_num] = session
+        return session
+
+    async def get(self, channel_num: int, endpoint: str, max_age: float = None, **params) -> any:
+        """Performs a GET request against the Spinitron API and returns the parsed json
+        Args:
+            channel_num (int): An int representing a WKNC channel: 1 for HD-1, 2 for HD-2
+            endpoint (str): Either a path relative to the API root (e.g. 'spins') or a full url, such as an '_links' href
+            max_age (float): If given, don't accept a cached response older than this many seconds (see HTTPCache.get)
+            params: Query parameters to add to the request
+        Returns:
+            any: The parsed json response. It may be shared with other callers, so don't modify it
+        """
+        if endpoint.startswith("http"):
+            url = endpoint
+        else:
+            url = f"{cogs.shared.SPINITRON_API_URL}/{endpoint}"
+
+        # Each channel has its own token, so the channel stands in for the token in the key
+        key = (channel_num, url, max_age, tuple(sorted((name, str(value)) for name, value in params.items())))
+        return await self.requests.run(key, self.fetch, channel_num, url, params, max_age)
+
+    async def fetch(self, channel_num: int, url: str, params: dict, max_age: float = None) -> any:
+        # Responses depend on the channel's token, so each channel gets its own scope in the cache
+        _, body = await self.http_cache.get(url, params, session=self.get_session(channel_num), scope=f"hd{channel_num}", limiter=self.limiters[channel_num], max_age=max_age)
+        # Spinitron also returns json bodies for errors (e.g. {"name": "Not Found"}), so leave it to the caller to check
+        return json.loads(body)
+
+    async def get_items(self, channel_num: int, endpoint: str, max_age: float = None, **params) -> list:
+        """Same as get(), but returns only the list of items from a collection response"""
+        response = await self.get(channel_num, endpoint, max_age, **params)
+        if type(response) == dict:
+            return response.get("items", [])
+        return response
+
+    async def iter_pages(self, channel_num: int, endpoint: str, max_in_flight: int = None, **params):
+        """Async generator yielding (page number, items) for every page of a collection, fetching the pages concurrently
+        The first page is fetched alone to learn the page count from its pagination metadata, after which the remaining
+        pages are fetched with at most max_in_flight requests at a time. Pages are yielded in the order they arrive.
+        Args:
+            channel_num (int): An int representing a WKNC channel: 1 for HD-1, 2 for HD-2
+            endpoint (str): Either a path relative to the API root or a full url
+            max_in_flight (int): Max concurrent page requests, defaults to SPINITRON_MAX_PAGES_IN_FLIGHT
+            params: Query parameters to add to every request
+        """
+        first_page = await self.get(channel_num, endpoint, page=1, **params)
+        if type(first_page) != dict:
+            yield 1, first_page
+            return
+        yield 1, first_page.get("items", [])
+
+        page_count = first_page.get("_meta", {}).get("pageCount")
+        if page_count is None:
+            # No pagination metadata, fall back to walking the pages until an empty one
+            page = 2
+            while True:
+                items = await self.get_items(channel_num, endpoint, page=page, **params)
+                if not items:
+                    return
+                yield page, items
+                page += 1
+
+        semaphore = asyncio.Semaphore(max_in_flight or cogs.shared.SPINITRON_MAX_PAGES_IN_FLIGHT)
+
+        async def fetch_page(page: int) -> tuple:
+            async with semaphore:
+                return page, await self.get_items(channel_num, endpoint, page=page, **params)
+
+        pending = [asyncio.ensure_future(fetch_page(page)) for page in range(2, page_count + 1)]
+        try:
+            for next_page in asyncio.as_completed(pending):
+                yield await next_page
+        finally:
+            # Don't leave requests running if the caller stops early or fails
+            for task in pending:
+                task.cancel()
+
+    async def get_all_items(self, channel_num: int, endpoint: str, **params) -> list:
+        """Returns the items of every page of a collection, in page order (see iter_pages)"""
+        pages = {}
+        async for page, items in self.iter_pages(channel_num, endpoint, **params):
+            pages[page] = items
+        return [item for page in sorted(pages) for item in pages[page]]
+
+    async def get_persona(self, channel_num: int, persona_id) -> dict:
+        """Returns a Spinitron persona, from the persona cache if possible
+        Args:
+            channel_num (int): An int representing a WKNC channel: 1 for HD-1, 2 for HD-2
+            persona_id: The Spinitron ID of the persona
+        Returns:
+            dict: The persona as taken from the Spinitron API (or Spinitron's error response if it could not be found)
+        """
+        key = (channel_num, str(persona_id))
+        persona = self.personas.get(key)
+        if persona is None:
+            persona = await self.get(channel_num, f"personas/{persona_id}")
+            # Only cache actual personas, never error responses
+            if "id" in persona:
+                self.personas.set(key, persona)
+        return persona
+
+    async def warm_personas(self, channel_num: int, persona_ids):
+        """Fetches every persona in persona_ids that is not already cached, all at once"""
+        missing = {str(persona_id) for persona_id in persona_ids if (channel_num, str(persona_id)) not in self.personas}
+        await asyncio.gather(*(self.get_persona(channel_num, persona_id) for persona_id in missing))
+
+    async def resolve_playlist_dj(self, channel_num: int, playlist_id) -> tuple:
+        """Resolves a playlist to the DJ who hosted it, through the playlist and persona caches
+        Args:
+            channel_num (int): An int representing a WKNC channel: 1 for HD-1, 2 for HD-2
+            playlist_id: The Spinitron ID of the playlist
+        Returns:
+            tuple: (persona ID, DJ name)
+        """
+        key = (channel_num, str(playlist_id))
+        persona_id = self.playlist_personas.get(key)
+        if persona_id is None:
+            persona_id = (await self.get(channel_num, f"playlists/{playlist_id}"))["persona_id"]
+            self.playlist_personas.set(key, persona_id)
+
+        return persona_id, (await self.get_persona(channel_num, persona_id))["name"]
+
+    async def resolve_playlist_djs(self, channel_num: int, playlist_ids) -> dict:
+        """Resolves every distinct playlist in playlist_ids at once
+        Returns:
+            dict: playlist ID -> (persona ID, DJ name)
+        """
+        distinct_ids = list(dict.fromkeys(playlist_ids))
+        resolved = await asyncio.gather(*(self.resolve_playlist_dj(channel_num, playlist_id) for playlist_id in distinct_ids))
+        return dict(zip(distinct_ids, resolved))
+
+    async def close(self):
+        for session in self.sessions.values():
+            await session.close()
+        self.sessions = {}
+
+
+# Shared objects like this client (and the caches, pollers and stores in other modules) are kept on the bot object rather
+# than in their modules, so that they survive cog reloads. Always get them through their get_*(bot) accessor
+def get_client(bot) -> SpinitronClient:
+    """Returns the bot's shared Spinitron client, creating it on first use"""
+    if not hasattr(bot, "spinitron_client"):
+        bot.spinitron_client = SpinitronClient(
+            cogs.http_cache.get_http_cache(bot),
+            {channel_num: cogs.rate_limit.get_rate_limiter(bot, "spinitron", channel_num) for channel_num in cogs.shared.HEADERS_HDX},
+        )
+    return bot.spinitron_client
@@ -0,0 +1,138 @@
+"""
+This module contains the Spotify cache used by the popularity check
+
+It keeps two kinds of data in SQLite, so that a track that has been played before costs no Spotify calls:
+- Resolutions: which Spotify track (if any) a spin was matched to, keyed by ISRC or by normalized artist and song.
+  Matches are kept for good, failed matches only for SPOTIFY_UNRESOLVED_TTL, in case the track shows up on Spotify later.
+- Popularity snapshots of tracks and artists, trusted for SPOTIFY_POPULARITY_TTL before they are fetched again.
+It also keeps the popularity check's watermarks, the last playlist each check has gotten through.
+"""
+import sqlite3
+import time
+
+import cogs.shared
+
+
+# Resolution outcomes
+MATCHED = "matched"
+NO_RESULTS = "no_results" # Spotify's search found nothing at all
+NO_MATCH = "no_match" # Spotify's search found tracks, but none close enough
+
+
+def track_snapshot(spotify_track: dict) -> dict:
+    """Takes a track object from the Spotify API and returns the parts of it the popularity check uses"""
+    return {
+        "id": spotify_track["id"],
+        "popularity": spotify_track["popularity"],
+        "url": spotify_track["external_urls"]["spotify"],
+        "artist_id": spotify_track["artists"][0]["id"],
+        "artist_url": spotify_track["artists"][0]["external_urls"]["spotify"],
+    }
+
+
+class SpotifyCache:
+    """Persistent spin -> Spotify track resolutions and track/artist popularity snapshots"""
+    def __init__(self):
+        self.db = sqlite3.connect(cogs.shared.SPOTIFY_CACHE_DB_PATH, timeout=30)
+        # Popularity backfill processes share the cache with the bot
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS resolutions (
+                key TEXT PRIMARY KEY,
+                status TEXT NOT NULL,
+                track_id TEXT,
+                confidence REAL NOT NULL,
+                resolved_at REAL NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS tracks (
+                id TEXT PRIMARY KEY,
+                popularity INTEGER NOT NULL,
+                url TEXT NOT NULL,
+                artist_id TEXT NOT NULL,
+                artist_url TEXT NOT NULL,
+                fetched_at REAL NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS artists (
+                id TEXT PRIMARY KEY,
+                popularity INTEGER NOT NULL,
+                fetched_at REAL NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS watermarks (
+                name TEXT PRIMARY KEY,
+                playlist_id INTEGER NOT NULL,
+                playlist_end TEXT NOT NULL
+            );
+            """
+        )
+        self.db.commit()
+
+    def get_resolution(self, key: str) -> tuple:
+        """Returns (status, track ID, confidence) for a resolution key, or None if it has not been resolved (or a failed resolution has expired)"""
+        row = self.db.execute("SELECT status, track_id, confidence, resolved_at FROM resolutions WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        if row[0] != MATCHED and row[3] + cogs.shared.SPOTIFY_UNRESOLVED_TTL <= time.time():
+            return None
+        return row[0], row[1], row[2]
+
+    def set_resolution(self, key: str, status: str, track_id: str, confidence: float):
+        self.db.execute(
+            "INSERT OR REPLACE INTO resolutions (key, status, track_id, confidence, resolved_at) VALUES (?, ?, ?, ?, ?)",
+            (key, status, track_id, confidence, time.time()),
+        )
+        self.db.commit()
+
+    def get_track(self, track_id: str) -> dict:
+        """Returns a track's popularity snapshot (see track_snapshot), or None if there is none or it is out of date"""
+        row = self.db.execute(
+            "SELECT id, popularity, url, artist_id, artist_url FROM tracks WHERE id = ? AND fetched_at > ?",
+            (track_id, time.time() - cogs.shared.SPOTIFY_POPULARITY_TTL),
+        ).fetchone()
+        if row is None:
+            return None
+        return dict(zip(("id", "popularity", "url", "artist_id", "artist_url"), row))
+
+    def set_tracks(self, tracks: list):
+        self.db.executemany(
+            "INSERT OR REPLACE INTO tracks (id, popularity, url, artist_id, artist_url, fetched_at) VALUES (?, ?, ?, ?, ?, ?)",
+            [(track["id"], track["popularity"], track["url"], track["artist_id"], track["artist_url"], time.time()) for track in tracks],
+        )
+        self.db.commit()
+
+    def get_artist_popularity(self, artist_id: str) -> int:
+        """Returns an artist's popularity, or None if there is no snapshot of it or it is out of date"""
+        row = self.db.execute(
+            "SELECT popularity FROM artists WHERE id = ? AND fetched_at > ?",
+            (artist_id, time.time() - cogs.shared.SPOTIFY_POPULARITY_TTL),
+        ).fetchone()
+        return row[0] if row else None
+
+    def set_artist_popularities(self, popularities: dict):
+        """Stores artist ID -> popularity snapshots"""
+        self.db.executemany(
+            "INSERT OR REPLACE INTO artists (id, popularity, fetched_at) VALUES (?, ?, ?)",
+            [(artist_id, popularity, time.time()) for artist_id, popularity in popularities.items()],
+        )
+        self.db.commit()
+
+    def get_watermark(self, name: str) -> tuple:
+        """Returns (playlist ID, playlist end as an ISO date string) of the last playlist a check got through, or None if it never ran"""
+        return self.db.execute("SELECT playlist_id, playlist_end FROM watermarks WHERE name = ?", (name,)).fetchone()
+
+    def set_watermark(self, name: str, playlist_id: int, playlist_end: str):
+        self.db.execute(
+            "INSERT OR REPLACE INTO watermarks (name, playlist_id, playlist_end) VALUES (?, ?, ?)",
+            (name, playlist_id, playlist_end),
+        )
+        self.db.commit()
+
+    def close(self):
+        self.db.close()
+
+
+def get_spotify_cache(bot) -> SpotifyCache:
+    """Returns the bot's shared Spotify cache, opening it on first use"""
+    if not hasattr(bot, "spotify_cache"):
+        bot.spotify_cache = SpotifyCache()
+    return bot.spotify_cache
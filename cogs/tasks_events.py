@@ -4,67 +4,101 @@ Tasks_Events contains no commands, just tasks and events such as updating the bo
 """
 import asyncio
 import datetime
-from dateutil import tz
-import difflib
 import discord
 from discord.ext import commands, tasks
 from importlib import reload
+import json
 import logging
-import re
-import requests as r
-import spotipy
-from spotipy.oauth2 import SpotifyClientCredentials
-import unicodedata
-import urllib
+import sys
 
+import cogs.now_playing
+import cogs.popularity
+import cogs.rate_limit
+import cogs.schedule
 import cogs.shared
+import cogs.spinitron
+import cogs.spotify_cache
+import cogs.timeutil
 
 
 # Set default value for status listening text
 current_listening_text: str = "WKNC"
 
-
-def simplify_string(in_string, remove_bracketed_and_dash=False, remove_listed=False, remove_spaces=True):
-    """Utility function to simplify artist or song names to only essential components, for compatibility and comparison"""
-    simplified_string = in_string
-    simplified_string = unicodedata.normalize("NFKD", simplified_string) # Normalize
-    simplified_string = simplified_string.encode('ascii', 'ignore').decode('ascii') # Filter to only ASCII characters
-    simplified_string = simplified_string.lower() # Lowercase
-    if remove_bracketed_and_dash:
-        simplified_string = re.sub(r'[\[\(].+[\]\)]', '', simplified_string) # Remove bracketed text
-        simplified_string = re.sub(r' - .+$', '', simplified_string) # Remove text after dash
-    if remove_listed:
-        simplified_string = re.sub(r' & .+$', '', simplified_string) # Remove text after an ambersand
-        simplified_string = re.sub(r', .+$', '', simplified_string) # Remove text after a comma
-    simplified_string = re.sub(r'feat\. .+$', '', simplified_string) # Remove feature text
-    simplified_string = re.sub(r'[^a-z0-9 ]', '', simplified_string) # Remove non-alphanumeric
-    if remove_spaces:
-        simplified_string= re.sub(r' ', '', simplified_string) # Remove spaces
-    return simplified_string
+POPULARITY_WATERMARK = "hd1" # Name of the popularity check's watermark in the Spotify cache
 
 
 class Tasks_Events(commands.Cog):
     "Tasks and events/listeners"
     def __init__(self, bot):
         self.bot = bot
+        self.spinitron = cogs.spinitron.get_client(bot)
+        self.now_playing = cogs.now_playing.get_poller(bot)
+        self.schedule_index = cogs.schedule.get_schedule_index(bot)
+        self.spotify_cache = cogs.spotify_cache.get_spotify_cache(bot)
+        self.popularity = cogs.popularity.PopularityEngine(self.spinitron, self.spotify_cache, cogs.rate_limit.get_rate_limiter(bot, "spotify", "app"))
+        self.popularity_store = cogs.popularity.PopularityStore()
+        self.popularity_check_lock = asyncio.Lock()
+        self.pending_popularity_check = None
+        self.stuck_popularity_check = None # (playlist ID, failed runs in a row, first failure) of the set holding the watermark back
+        self.now_playing.add_listener(self.on_now_playing)
         self.changeStatus.start()
         self.checkSetPopularity.start()
 
     async def cog_unload(self):
+        self.now_playing.remove_listener(self.on_now_playing)
         self.changeStatus.cancel()
         self.checkSetPopularity.cancel()
+        self.cancel_pending_popularity_check()
+        self.popularity.close()
+        self.popularity_store.close()
 
-    @tasks.loop(seconds=60)
+    @tasks.loop(seconds=cogs.shared.STATUS_MAX_SLEEP)
     async def changeStatus(self):
-        """Every minute, check the currently playing set and update Discord status to it"""
+        """Checks the currently playing set and updates Discord status to it, then waits for the next show boundary
+        Right after a boundary it checks every few seconds until the new playlist shows up. In between, status is kept up to date
+        by on_now_playing, so this only needs to catch the transitions
+        """
+        cogs.rate_limit.use_background_priority()
+        snapshot = await self.now_playing.refresh(1, fetch_playlist=True)
+        await self.update_status(snapshot)
+        self.changeStatus.change_interval(seconds=await self.next_status_check(snapshot))
+
+    async def next_status_check(self, snapshot) -> float:
+        """Returns how many seconds changeStatus should wait before checking again"""
+        now = datetime.datetime.now(datetime.timezone.utc)
+        schedule = await self.schedule_index.get(1)
+
+        playlist_end = cogs.timeutil.parse_spinitron_time(snapshot.playlist["end"]) if snapshot.playlist.get("end") else None
+
+        # Burst right after a boundary, for as long as the playlist is over and the next one hasn't shown up yet
+        if playlist_end is None or playlist_end <= now:
+            boundary = max((time for time in (schedule.last_boundary(now), playlist_end) if time is not None), default=None)
+            if boundary is not None and (now - boundary).total_seconds() < cogs.shared.STATUS_BURST_DURATION:
+                return cogs.shared.STATUS_BURST_INTERVAL
+
+        # Otherwise sleep until the next show starts or ends (or the playlist is meant to end), backing off further during automation
+        automated = str(snapshot.playlist.get("persona_id")) == cogs.shared.ZETTA_SPINITRON_ID_HDX[1]
+        delay = cogs.shared.STATUS_AUTOMATION_MAX_SLEEP if automated else cogs.shared.STATUS_MAX_SLEEP
+        for boundary in (schedule.next_boundary(now), playlist_end):
+            if boundary is not None and boundary > now:
+                # Wake a second late, so the schedule index already has the new show on air
+                delay = min(delay, (boundary - now).total_seconds() + 1)
+        return max(delay, cogs.shared.STATUS_BURST_INTERVAL)
+
+    async def update_status(self, snapshot):
+        """Sets Discord status to the set in a HD-1 now playing snapshot, if it isn't already"""
         global current_listening_text
-        current_set = r.get("https://spinitron.com/api/playlists?count=1", headers=cogs.shared.HEADERS_HDX[1]).json()["items"][0]
+        current_set = snapshot.playlist
         listening_text: str
-        if (str(current_set["persona_id"]) == cogs.shared.ZETTA_SPINITRON_ID_HDX[1]):
+        # There may be no current playlist (the poller keeps an empty one then), in which case the show title is used
+        if (str(current_set.get("persona_id")) == cogs.shared.ZETTA_SPINITRON_ID_HDX[1]):
             # If zetta is currently playing, set status to genre block name instead
-            listening_text = r.get("https://spinitron.com/api/shows?count=1", headers=cogs.shared.HEADERS_HDX[1]).json()["items"][0]["category"]
+            listening_text = snapshot.show.get("category")
         else:
-            listening_text = r.get("https://spinitron.com/api/shows?count=1", headers=cogs.shared.HEADERS_HDX[1]).json()["items"][0]["title"]
+            listening_text = snapshot.show.get("title")
+        if not listening_text:
+            # Nothing on the schedule either, keep the current status
+            return
 
         if (current_listening_text != str(listening_text)):
             print("Updating status")
@@ -78,229 +112,158 @@ class Tasks_Events(commands.Cog):
 
     @tasks.loop(hours=1)
     async def checkSetPopularity(self):
-        """Every hour, flag any recent HD-1 sets that pass popularity threshold and notify admin"""
-
-        print("Performing popularity check")
-
-        spotify_auth_manager = SpotifyClientCredentials(client_id=cogs.shared.SPOTIFY_CLIENT_ID, client_secret=cogs.shared.SPOTIFY_CLIENT_SECRET)
-        spotify_client = spotipy.Spotify(auth_manager=spotify_auth_manager)
-
-        # Starting and ending times for playlists query
-        end_datetime = datetime.datetime.now(tz.gettz("America/New_York")).replace(tzinfo=None)
-        start_datetime = end_datetime - datetime.timedelta(hours=1)
-        end_datetime_str = urllib.parse.quote(end_datetime.isoformat())
-        start_datetime_str = urllib.parse.quote(start_datetime.isoformat())
-        
-        playlists_parsed_json = r.get(f"https://spinitron.com/api/playlists?start={start_datetime_str}&end={end_datetime_str}", headers=cogs.shared.HEADERS_HDX[1]).json()
-        if type(playlists_parsed_json) == dict:
-            playlists = playlists_parsed_json['items']
-        else:
-            playlists = playlists_parsed_json
-
-        for playlist in playlists:
+        """Every hour, check any HD-1 sets that have finished but haven't been checked yet
+        Sets are normally checked shortly after they end (see on_now_playing), so this only catches the ones that were missed
+        """
+        cogs.rate_limit.use_background_priority()
+        try:
+            await self.run_popularity_check()
+        except Exception as e:
+            # Keep the loop alive, the next run tries again
+            logging.error(e)
+            print("Error during popularity check:")
+            print(e)
+
+    async def on_now_playing(self, channel_num: int, snapshot, changes: dict):
+        """Updates status when the current HD-1 playlist or show changes, and schedules a popularity check when the playlist changes, i.e. a set has just ended"""
+        if channel_num != 1:
+            return
+        if (changes["playlist_changed"] or changes["show_changed"]) and self.changeStatus.is_running():
+            await self.update_status(snapshot)
+        if not changes["playlist_changed"] or not self.checkSetPopularity.is_running():
+            return
+        if self.pending_popularity_check is None or self.pending_popularity_check.done():
+            self.pending_popularity_check = asyncio.create_task(self.delayed_popularity_check())
+
+    async def delayed_popularity_check(self):
+        await asyncio.sleep(cogs.shared.POPULARITY_CHECK_DELAY)
+        try:
+            with cogs.rate_limit.background_priority():
+                await self.run_popularity_check()
+        except Exception as e:
+            logging.error(e)
+            print("Error during popularity check:")
+            print(e)
+
+    def cancel_pending_popularity_check(self):
+        if self.pending_popularity_check is not None:
+            self.pending_popularity_check.cancel()
+            self.pending_popularity_check = None
+
+    async def run_popularity_check(self):
+        """Checks every HD-1 set that has finished since the watermark, flagging any that pass the popularity thresholds
+        Sets are checked at once, then flagged and moved past in the order they ended, so that each set is checked exactly once
+        even across restarts. A set is only checked again if the bot stops before its flag message is sent, or if checking it
+        (or a set that ended before it) failed, in which case the watermark stays put and the next run retries from there
+        """
+        async with self.popularity_check_lock:
+            print("Performing popularity check")
+
+            now = datetime.datetime.now(cogs.timeutil.local_timezone())
+            watermark = self.spotify_cache.get_watermark(POPULARITY_WATERMARK)
+            if watermark is None:
+                # First run, start with the sets that ended in the last hour
+                watermark_id, watermark_end = 0, now - datetime.timedelta(hours=1)
+            else:
+                watermark_id, watermark_end = watermark[0], datetime.datetime.fromisoformat(watermark[1])
+                watermark_end = max(watermark_end, now - datetime.timedelta(seconds=cogs.shared.POPULARITY_CHECK_MAX_CATCHUP))
+
+            # Playlists are matched by when they start, so look back far enough to find long sets that ended after the watermark
+            start_datetime = (watermark_end - datetime.timedelta(seconds=cogs.shared.POPULARITY_CHECK_LOOKBACK)).astimezone(cogs.timeutil.local_timezone()).replace(tzinfo=None)
+            end_datetime = now.replace(tzinfo=None)
+            playlists = {}
+            async for _, items in self.spinitron.iter_pages(1, "playlists", start=start_datetime.isoformat(), end=end_datetime.isoformat()):
+                for playlist in items:
+                    playlists[playlist['id']] = playlist
+
+            # Only sets that have ended since the watermark, in the order they ended
+            finished = []
+            for playlist in playlists.values():
+                playlist_end = cogs.timeutil.parse_spinitron_time(playlist['end'])
+                if (playlist_end, playlist['id']) > (watermark_end, watermark_id) and playlist_end <= now:
+                    finished.append((playlist_end, playlist['id'], playlist))
+            finished.sort(key=lambda item: item[:2])
+
+            # Check every set at once, then send the flagged ones in order, moving the watermark past each set once it's done
+            flag_messages = await asyncio.gather(*(self.check_playlist(playlist) for _, _, playlist in finished), return_exceptions=True)
+            for (playlist_end, playlist_id, _), flag_message in zip(finished, flag_messages):
+                if isinstance(flag_message, Exception):
+                    # Stop at the first set that couldn't be checked, so the next run tries it (and every set after it) again
+                    print(f"Popularity check: Stopping at playlist {playlist_id}, it will be checked again on the next run")
+                    await self.note_stuck_popularity_check(playlist_id, playlist_end, flag_message)
+                    break
+                self.stuck_popularity_check = None
+                if flag_message:
+                    await self.send_flag_message(flag_message)
+                self.spotify_cache.set_watermark(POPULARITY_WATERMARK, playlist_id, playlist_end.isoformat())
+
+    async def note_stuck_popularity_check(self, playlist_id: int, playlist_end: datetime.datetime, error: Exception):
+        """Logs a set that is holding the watermark back, and alerts the flag channel once it has failed POPULARITY_CHECK_STUCK_ALERT runs in a row
+        No set after it is flagged until it goes through, or until it falls out of POPULARITY_CHECK_MAX_CATCHUP and is skipped
+        """
+        if self.stuck_popularity_check is None or self.stuck_popularity_check[0] != playlist_id:
+            self.stuck_popularity_check = (playlist_id, 0, datetime.datetime.now(cogs.timeutil.local_timezone()))
+        _, failures, first_failure = self.stuck_popularity_check
+        failures += 1
+        self.stuck_popularity_check = (playlist_id, failures, first_failure)
+
+        skipped_at = playlist_end + datetime.timedelta(seconds=cogs.shared.POPULARITY_CHECK_MAX_CATCHUP)
+        alert = (f"Popularity check is stuck on playlist {playlist_id}: it has failed {failures} runs in a row since {first_failure:%Y-%m-%d %H:%M} ({error!r}). "
+                 f"No later set will be flagged until it goes through, or until it is skipped at {skipped_at.astimezone(cogs.timeutil.local_timezone()):%Y-%m-%d %H:%M}")
+        if failures < cogs.shared.POPULARITY_CHECK_STUCK_ALERT:
+            logging.error(alert)
+            return
+        logging.critical(alert)
+        if failures == cogs.shared.POPULARITY_CHECK_STUCK_ALERT:
             try:
-                # Get datetimes for start and end of playlist
-                playlist_start_datetime_str = playlist['start']
-                playlist_start_datetime = datetime.datetime.fromisoformat(playlist_start_datetime_str).astimezone(tz.gettz(cogs.shared.LOCAL_TIMEZONE)).replace(tzinfo=None)
-                playlist_end_datetime_str = playlist['end']
-                playlist_end_datetime = datetime.datetime.fromisoformat(playlist_end_datetime_str).astimezone(tz.gettz(cogs.shared.LOCAL_TIMEZONE)).replace(tzinfo=None)
-                
-                # Skip if playlist is in future
-                if playlist_end_datetime > end_datetime:
-                    continue
-
-                # Skip Zetta sets
-                if playlist['persona_id'] in cogs.shared.POPULARITY_CHECK_EXCEPTION_SPINITRON_IDS:
-                    print("Popularity check: Skipping excepted playlist")
-                    continue
-
-                # Skip if playlist falls between midnight and 2am on Friday (Bad Music Hour exception)
-                if (playlist_end_datetime.weekday() == 4 #Friday
-                    and playlist_start_datetime.time() < datetime.time(1, 0) #Starting before 1am
-                    and playlist_end_datetime.time() < datetime.time(2, 0) #Ending before 2am
-                    ):
-                    print("Popularity check: Skipping bad music hour")
-                    continue
-
-                # Flags to indicate if thresholds have been passed
-                average_artist_threshold_passed = False
-                track_threshold_passed = False
-
-                # Initialize strings to be added to and sent if set is flagged
-                artist_flag_message = ""
-                track_flag_message = ""
-
-                # Get thresholds for average artist popularity and track popularity according to the playlist's category/"genre block"
-                if playlist['category'] in cogs.shared.AVERAGE_ARTIST_POPULARITY_THRESHOLDS:
-                    average_artist_popularity_threshold = cogs.shared.AVERAGE_ARTIST_POPULARITY_THRESHOLDS[playlist['category']]
-                else:
-                    average_artist_popularity_threshold = cogs.shared.AVERAGE_ARTIST_POPULARITY_THRESHOLDS["Default"]
-                if playlist['category'] in cogs.shared.TRACK_POPULARITY_THRESHOLDS:
-                    track_popularity_threshold = cogs.shared.TRACK_POPULARITY_THRESHOLDS[playlist['category']]
-                else:
-                    track_popularity_threshold = cogs.shared.TRACK_POPULARITY_THRESHOLDS['Default']
-
-                # Lists to hold popularity values for each artist/track in the set
-                artist_popularity_list = []
-                track_popularity_list = []
-
-                playlist_spins = r.get(playlist['_links']['spins']['href'], headers=cogs.shared.HEADERS_HDX[1]).json()['items']
-
-                playlist_page = 1;
-                while (playlist_spins):
-                    for spin in playlist_spins:
-                        try:
-                            # Short wait to prevent API ratelimiting
-                            await asyncio.sleep(0.1)
-
-                            # Alternate simplified strings to avoid search issues
-                            artist_name_simplified = simplify_string(spin['artist'], remove_bracketed_and_dash=True, remove_spaces=False)
-                            track_name_simplified = simplify_string(spin['song'], remove_bracketed_and_dash=True, remove_spaces=False)[:15]
-
-                            caution_flag = False # Flag to raise if ISRC is not carried to final result
-                            if spin['isrc']:
-                                # Search based on ISRC if available
-                                search_q = f"isrc:{spin['isrc']}"
-                            else:
-                                caution_flag = True
-                                if spin['upc']:
-                                    # If UPC but no ISRC, search using both UPC and artist/track names
-                                    search_q = f"upc:\"{spin['upc']}\" artist:\"{artist_name_simplified}\" track:\"{track_name_simplified}\""
-                                else:
-                                    # If no ISRC or UPC, search just but artist and track name
-                                    search_q = f"artist:\"{spin['artist']}\" track:\"{spin['song']}\""
-
-                            response = spotify_client.search(search_q, limit=1, type="track")
-
-                            # If search returns nothing, perform a more simplified search
-                            if len(response['tracks']['items']) < 1:
-                                caution_flag = True
-                                search_q = f"{artist_name_simplified} {track_name_simplified}" 
-
-                                response = spotify_client.search(search_q, limit=1, type="track")
-
-                                # If still returning nothing, skip
-                                if len(response['tracks']['items']) < 1:
-                                    continue
-                            
-                            spotify_track = response['tracks']['items'][0]
-
-                            # Simplified strings for comparing against each other
-                            spotify_artist_simplified = simplify_string(spotify_track['artists'][0]['name'], remove_bracketed_and_dash=True, remove_listed=True)
-                            spotify_track_simplified = simplify_string(spotify_track['name'], remove_bracketed_and_dash=True)
-                            spinitron_artist_simplified = simplify_string(spin['artist'], remove_bracketed_and_dash=True, remove_listed=True)
-                            spinitron_track_simplified = simplify_string(spin['song'], remove_bracketed_and_dash=True)
-
-                            # If current spotify track is not based on ISRC and does not exactly match spinitron artist and song names: Perform more extensive search
-                            if caution_flag and (spinitron_artist_simplified != spotify_artist_simplified or spinitron_track_simplified != spotify_track_simplified):
-                                # Same search query it was already using, but get 10 results instead of 1 to evaluate
-                                response = spotify_client.search(search_q, limit=10, type="track")['tracks']['items']
-
-                                # Skip if no results for some reason
-                                if len(response) < 1:
-                                    continue
-
-                                # Evaluate each candidate in search results using difflib's Sequence Matcher, determine strongest candidate
-                                strongest_candidate = [0, 0.0, 0.0] # [Index, Artist similarity, Track similarity]
-                                for i, candidate in enumerate(response):
-
-                                    candidate_artist_simplified = simplify_string(candidate['artists'][0]['name'], remove_bracketed_and_dash=True, remove_listed=True)
-                                    candidate_track_simplified = simplify_string(candidate['name'], remove_bracketed_and_dash=True)
-
-                                    artist_similarity = difflib.SequenceMatcher(None, spinitron_artist_simplified, candidate_artist_simplified).ratio()
-                                    track_similarity = difflib.SequenceMatcher(None, spinitron_track_simplified, candidate_track_simplified).ratio()
-
-                                    candidate = [i, artist_similarity, track_similarity]
-                                    if candidate[1]+candidate[2] > strongest_candidate[1]+strongest_candidate[2]:
-                                        strongest_candidate = candidate
-
-                                # Only accept the strongest candidate if it fits within thresholds - otherwise skip this track
-                                if ((strongest_candidate[1] > cogs.shared.NAME_SIMILARITY_UPPER_MINIMUM and strongest_candidate[2] > cogs.shared.NAME_SIMILARITY_LOWER_MINIMUM) or
-                                    (strongest_candidate[1] > cogs.shared.NAME_SIMILARITY_LOWER_MINIMUM and strongest_candidate[2] > cogs.shared.NAME_SIMILARITY_UPPER_MINIMUM)):
-                                    
-                                    spotify_track = response[strongest_candidate[0]]
-                                else:
-                                    track_flag_message = f"   - {spin['artist']} - {spin['song']} [could not find spotify track]\n" + track_flag_message
-                                    continue
-                            
-                            # Get artist popularity and add to list
-                            artist_popularity = spotify_client.artist(spotify_track['artists'][0]['id'])['popularity']
-                            artist_popularity_list.append(artist_popularity)
-                            
-                            # Get track popularity, add to list, and check if it crosses threshold
-                            track_popularity = spotify_track['popularity']
-                            track_popularity_list.append(track_popularity)
-                            bolding = ""
-                            if track_popularity > track_popularity_threshold:
-                                bolding = "**"
-                                track_threshold_passed = True
-                            track_flag_message = f"   - {bolding}[{spin['artist']}]({spotify_track['artists'][0]['external_urls']['spotify']}) (`{artist_popularity}`) - [{spin['song']}]({spotify_track['external_urls']['spotify']}) (`{track_popularity}`){bolding}\n" + track_flag_message
-                            
-                        except Exception as e:
-                            track_flag_message = "   - [Error while checking track]\n" + track_flag_message
-                            print("Error during popularity check (specific track):")
-                            print(e)
-                    
-                    # Check for limit on pages
-                    playlist_page += 1
-                    if (playlist_page > cogs.shared.MAX_PAGES_FOR_DJSET):
-                        break
-                    
-                    # Get next page
-                    playlist_spins = r.get(playlist['_links']['spins']['href']+f"&page={playlist_page}", headers=cogs.shared.HEADERS_HDX[1]).json()['items']
-                
-                # Calculate average artist and track popularity from lists. -1 indicates no artists in playlist
-                if len(artist_popularity_list) > 0:
-                    average_artist_popularity = sum(artist_popularity_list)/len(artist_popularity_list)
-                else:
-                    average_artist_popularity = -1
-                if len(track_popularity_list) > 0:
-                    average_track_popularity = sum(track_popularity_list)/len(track_popularity_list)
-                else:
-                    average_track_popularity = -1
-
-                # Check if average artist popularity crosses threshold
-                if average_artist_popularity > average_artist_popularity_threshold:
-                    average_artist_threshold_passed = True
-                    artist_flag_message += f"- Detected an average artist popularity across the set of `{average_artist_popularity:.1f}`, passing the popularity threshold of `{average_artist_popularity_threshold:.0f}` for the genre block \"{playlist['category']}\"\n"
-                
-                track_flag_message = f"- Any tracks below that are **bolded** passed the track popularity threshold of `{track_popularity_threshold}` for the genre block \"{playlist['category']}\":\n" + track_flag_message
-                track_flag_message += f"Average track popularity across set: `{average_track_popularity:.1f}`"
-
-                # If set is flagged, send to appropriate channel
-                if average_artist_threshold_passed or track_threshold_passed:
-                    print("Popularity check: Set flagged. Sending notification")
-
-                    dj_name = r.get(f"https://spinitron.com/api/personas/{playlist['persona_id']}", headers=cogs.shared.HEADERS_HDX[1]).json()['name']
-                    
-                    # Generate message to send for flagged set
-                    flag_message = f"The playlist [{playlist['title']}](https://spinitron.com/WKNC/pl/{playlist['id']}) by [{dj_name}](https://spinitron.com/dj/{playlist['persona_id']}) has been flagged for the following reasons:\n"
-                    if average_artist_threshold_passed or track_threshold_passed:
-                        flag_message += artist_flag_message + track_flag_message
-
-                    # Get channel to send notification to
-                    guild = self.bot.get_guild(802353283473211402)
-                    channel = guild.get_channel(1375177441336623215)
-
-                    if len(flag_message) < 4096:
-                        embed = discord.Embed(description=flag_message)
-                        await channel.send(embed=embed)
-                    else:
-                        remaining_flag_message = flag_message
-                        while len(remaining_flag_message) >= 4000:
-                            cut_index = remaining_flag_message.rfind('\n', 0, 4000)
-                            embed = discord.Embed(description=(remaining_flag_message[:cut_index] + "\n(continued in next message)"))
-                            await channel.send(embed=embed)
-                            remaining_flag_message = remaining_flag_message[cut_index:]
-                        embed = discord.Embed(description=("- (continued from previous message)" + remaining_flag_message))
-                        await channel.send(embed=embed)
-                else:
-                    print("Popularity check: Passed")
-
+                await self.send_flag_message(alert)
             except Exception as e:
                 logging.error(e)
-                print("Error during popularity check:")
-                print(e)
+
+    async def check_playlist(self, playlist: dict) -> str:
+        """Checks one set against the popularity thresholds, storing its results
+        Returns:
+            str: The message to send if the set was flagged, otherwise None
+        Raises:
+            Exception: Anything that kept the set from being checked, after logging it
+        """
+        try:
+            result = await self.popularity.evaluate(playlist)
+            self.popularity_store.save(result)
+            if result['exempt']:
+                print(f"Popularity check: Skipping {result['exempt']}")
+                return None
+            if not result['score']['flagged']:
+                print("Popularity check: Passed")
+                return None
+
+            print("Popularity check: Set flagged")
+            dj_name = (await self.spinitron.get_persona(1, playlist['persona_id']))['name']
+            return cogs.popularity.flag_message(result, dj_name)
+
+        except Exception as e:
+            logging.error(e)
+            print("Error during popularity check:")
+            print(e)
+            raise
+
+    async def send_flag_message(self, flag_message: str):
+        # Get channel to send notification to
+        guild = self.bot.get_guild(802353283473211402)
+        channel = guild.get_channel(1375177441336623215)
+
+        if len(flag_message) < 4096:
+            embed = discord.Embed(description=flag_message)
+            await channel.send(embed=embed)
+        else:
+            remaining_flag_message = flag_message
+            while len(remaining_flag_message) >= 4000:
+                cut_index = remaining_flag_message.rfind('\n', 0, 4000)
+                embed = discord.Embed(description=(remaining_flag_message[:cut_index] + "\n(continued in next message)"))
+                await channel.send(embed=embed)
+                remaining_flag_message = remaining_flag_message[cut_index:]
+            embed = discord.Embed(description=("- (continued from previous message)" + remaining_flag_message))
+            await channel.send(embed=embed)
 
     @checkSetPopularity.before_loop
     async def before_checkSetPopularity(self):
@@ -344,6 +307,7 @@ class Tasks_Events(commands.Cog):
                 self.changeStatus.cancel()
             if self.checkSetPopularity.is_running():
                 self.checkSetPopularity.cancel()
+            self.cancel_pending_popularity_check()
             
             await ctx.send("Tasks stopped.")
         else:
@@ -366,6 +330,59 @@ class Tasks_Events(commands.Cog):
         else:
             await ctx.send("Sorry, this command is only meant to be used by my administrator")
 
+    @commands.command(name="popularitybackfill", hidden=True)
+    async def popularity_backfill(self, ctx: commands.Context, start: str, end: str, refresh: bool = False):
+        """
+        Hidden bot admin command - Check every HD-1 set that ended between two dates (YYYY-MM-DD, both included) and store the
+        results, without sending any flags. Sets with stored results are only re-scored, unless refresh is set.
+
+        The backfill runs in its own process (see popularity_cli.py), so it can't slow the bot down
+        """
+        if (ctx.author.id == cogs.shared.BOT_ADMIN_DISCORD_ID):
+            try:
+                start_datetime, end_datetime = cogs.popularity.date_range(start, end)
+            except ValueError:
+                await ctx.send("Dates must be in the format YYYY-MM-DD, with the end date on or after the start date")
+                return
+
+            await ctx.send(f"Backfilling popularity results from {start} to {end}...")
+            args = ["backfill", start, end, "--json"] + (["--refresh"] if refresh else [])
+            process = await asyncio.create_subprocess_exec(
+                sys.executable, cogs.popularity.CLI_PATH, *args, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE
+            )
+            stdout, stderr = await process.communicate()
+            if process.returncode != 0:
+                logging.error(stderr.decode(errors="replace"))
+                await ctx.send(f"Backfill failed:\n```{stderr.decode(errors='replace')[-1500:]}```")
+                return
+
+            summary = json.loads(stdout.decode().strip().splitlines()[-1])
+            await ctx.send(
+                f"Backfill done in {summary['elapsed']:.0f}s: {summary['checked']} sets checked, {summary['rescored']} re-scored from stored results, "
+                f"{summary['exempt']} exempt, {summary['errors']} errors. {summary['flagged']} flagged:\n"
+                + cogs.popularity.format_flagged_sets(self.popularity_store.get_sets(start_datetime, end_datetime, flagged_only=True))
+            )
+        else:
+            await ctx.send("Sorry, this command is only meant to be used by my administrator")
+
+    @commands.command(name="popularityrescore", hidden=True)
+    async def popularity_rescore(self, ctx: commands.Context, start: str, end: str):
+        """Hidden bot admin command - Re-score the stored sets that ended between two dates (YYYY-MM-DD, both included) against the current thresholds"""
+        if (ctx.author.id == cogs.shared.BOT_ADMIN_DISCORD_ID):
+            try:
+                start_datetime, end_datetime = cogs.popularity.date_range(start, end)
+            except ValueError:
+                await ctx.send("Dates must be in the format YYYY-MM-DD, with the end date on or after the start date")
+                return
+
+            summary = await asyncio.to_thread(cogs.popularity.rescore, start_datetime, end_datetime)
+            await ctx.send(
+                f"Re-scored {summary['rescored']} sets in {summary['elapsed']:.1f}s. {summary['flagged']} flagged:\n"
+                + cogs.popularity.format_flagged_sets(self.popularity_store.get_sets(start_datetime, end_datetime, flagged_only=True))
+            )
+        else:
+            await ctx.send("Sorry, this command is only meant to be used by my administrator")
+
 
 async def setup(bot):
     await bot.add_cog(Tasks_Events(bot))
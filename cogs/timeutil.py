@@ -0,0 +1,94 @@
+"""
+This module contains the date and time helpers used by the other modules
+
+Spinitron always sends dates in the same fixed format ('1970-01-01T00:00:00+0000'), so they are parsed by slicing
+rather than with dateutil's general purpose parser. The local timezone and the bounds of the current local day
+are computed once and reused, instead of on every call.
+"""
+from datetime import date, datetime, time, timedelta, timezone
+from dateutil import parser, tz
+from functools import lru_cache
+
+import cogs.shared
+
+
+@lru_cache(maxsize=None)
+def local_timezone() -> tz.tzfile:
+    """Returns the station's local timezone (see LOCAL_TIMEZONE)"""
+    return tz.gettz(cogs.shared.LOCAL_TIMEZONE)
+
+@lru_cache(maxsize=32)
+def utc_offset(offset: str) -> timezone:
+    """Returns the timezone for an offset in the format '+0000'"""
+    sign = -1 if offset[0] == "-" else 1
+    return timezone(sign * timedelta(hours=int(offset[1:3]), minutes=int(offset[-2:])))
+
+def parse_spinitron_time(date_str: str) -> datetime:
+    """Takes a Spinitron date string and returns an aware datetime
+    Args:
+        date_str (str): Date string in the format '1970-01-01T00:00:00+0000'. Anything else is handed to dateutil
+    Returns:
+        datetime: The date, in the timezone of its offset (UTC if it has none)
+    """
+    if len(date_str) == 24 and date_str[10] == "T" and date_str[19] in "+-":
+        offset = date_str[19:]
+        return datetime(
+            int(date_str[0:4]), int(date_str[5:7]), int(date_str[8:10]),
+            int(date_str[11:13]), int(date_str[14:16]), int(date_str[17:19]),
+            tzinfo=timezone.utc if offset == "+0000" else utc_offset(offset),
+        )
+
+    parsed = parser.parse(date_str)
+    return parsed if parsed.tzinfo else parsed.replace(tzinfo=timezone.utc)
+
+def to_local(date_str: str) -> datetime:
+    """Takes a Spinitron date string and returns it as a datetime in the local timezone"""
+    return parse_spinitron_time(date_str).astimezone(local_timezone())
+
+@lru_cache(maxsize=16)
+def local_day_bounds(day: date) -> tuple:
+    """Returns the UTC datetimes of the start of a local day and the start of the next"""
+    start = datetime.combine(day, time.min, tzinfo=local_timezone())
+    end = datetime.combine(day + timedelta(days=1), time.min, tzinfo=local_timezone())
+    return start.astimezone(timezone.utc), end.astimezone(timezone.utc)
+
+def local_today() -> date:
+    return datetime.now(local_timezone()).date()
+
+
+class DayBounds:
+    """The bounds of yesterday and today (local time) in UTC, only recomputed once the day is over"""
+    def __init__(self):
+        self.yesterday_start = None
+        self.today_start = None
+        self.today_end = None
+
+    def refresh(self):
+        now = datetime.now(timezone.utc)
+        if self.today_end is None or now >= self.today_end or now < self.today_start:
+            today = now.astimezone(local_timezone()).date()
+            self.today_start, self.today_end = local_day_bounds(today)
+            self.yesterday_start, _ = local_day_bounds(today - timedelta(days=1))
+
+    def is_today(self, moment: datetime) -> bool:
+        self.refresh()
+        return self.today_start <= moment < self.today_end
+
+    def is_yesterday(self, moment: datetime) -> bool:
+        self.refresh()
+        return self.yesterday_start <= moment < self.today_start
+
+day_bounds = DayBounds()
+
+
+def is_in_past(date_str: str) -> bool:
+    """Returns true if the provided Spinitron date string has occured in the past"""
+    return parse_spinitron_time(date_str) < datetime.now(timezone.utc)
+
+def is_today(date_str: str) -> bool:
+    """Returns true if the provided Spinitron date string is on the current local day"""
+    return day_bounds.is_today(parse_spinitron_time(date_str))
+
+def is_yesterday(date_str: str) -> bool:
+    """Returns true if the provided Spinitron date string is on the previous local day"""
+    return day_bounds.is_yesterday(parse_spinitron_time(date_str))
@@ -0,0 +1,59 @@
+"""
+Command line interface for the popularity engine (cogs/popularity.py), to backfill and re-score sets without the bot
+
+Run it from the root of the repository, with the same .env as the bot:
+    python popularity_cli.py backfill 2025-08-18 2025-12-12 [--processes 4] [--refresh]
+    python popularity_cli.py rescore 2025-08-18 2025-12-12
+    python popularity_cli.py flagged 2025-08-18 2025-12-12
+
+Dates are local and both included. With --json, the summary is printed as a single json line (the bot's
+!popularitybackfill command reads it).
+"""
+import argparse
+from dotenv import load_dotenv
+import json
+import sys
+
+load_dotenv()
+import cogs.popularity
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Backfill, re-score and list popularity check results")
+    parser.add_argument("command", choices=["backfill", "rescore", "flagged"])
+    parser.add_argument("start", help="First local date, YYYY-MM-DD")
+    parser.add_argument("end", help="Last local date, YYYY-MM-DD")
+    parser.add_argument("--processes", type=int, default=None, help="Worker processes for backfill")
+    parser.add_argument("--refresh", action="store_true", help="Check sets again even if they have stored results")
+    parser.add_argument("--json", action="store_true", help="Print the summary as json")
+    args = parser.parse_args()
+
+    try:
+        start, end = cogs.popularity.date_range(args.start, args.end)
+    except ValueError as e:
+        parser.error(str(e))
+
+    if args.command == "flagged":
+        store = cogs.popularity.PopularityStore()
+        for flagged_set in store.get_sets(start, end, flagged_only=True):
+            print(f"{flagged_set['end_time']}  {flagged_set['playlist_id']}  {flagged_set['title']} ({flagged_set['category']}): "
+                  f"average artist popularity {flagged_set['average_artist_popularity']:.1f}, average track popularity {flagged_set['average_track_popularity']:.1f}")
+        store.close()
+        return
+
+    if args.command == "backfill":
+        def progress(done: int, total: int):
+            if not args.json:
+                print(f"{done}/{total} sets checked", file=sys.stderr)
+        summary = cogs.popularity.backfill(start, end, processes=args.processes, refresh=args.refresh, progress=progress)
+    else:
+        summary = cogs.popularity.rescore(start, end)
+
+    if args.json:
+        print(json.dumps(summary))
+    else:
+        print(", ".join(f"{name}: {value:.1f}" if isinstance(value, float) else f"{name}: {value}" for name, value in summary.items()))
+
+
+if __name__ == "__main__":
+    main()